@@ -28,11 +28,55 @@ class Settings(BaseSettings):
     # Backend API URL
     backend_api_url: str = "http://localhost:8000"
 
+    # HTTP client للـ backend (pool واحد للخدمة كلها)
+    backend_client_max_connections: int = 100
+    backend_client_max_keepalive: int = 20
+    backend_client_keepalive_expiry_seconds: float = 30.0
+    backend_client_http2: bool = False  # محتاج h2 (pip install httpx[http2])
+    backend_client_connect_timeout_seconds: float = 2.0
+    backend_client_deadline_seconds: float = 10.0  # أقصى وقت للطلب كله بالـ retries
+    backend_client_retries: int = 2
+    backend_client_breaker_threshold: int = 5
+    backend_client_breaker_reset_seconds: float = 15.0
+
+    # الطلبات المتزامنة لنفس المستخدم بتشارك نفس النتيجة للمدة دي بعد ما تخلص
+    single_flight_linger_seconds: float = 2.0
+
+    # كاش السلاسل لكل مستخدم (بيتحدث بالجزء الجديد بس)
+    series_cache_max_bytes: int = 64 * 1024 * 1024
+    series_cache_full_refresh_seconds: float = 3600.0  # إعادة تحميل كاملة عشان القراءات المتأخرة
+
+    # الـ process pool اللي بيعمل fit و scoring بعيد عن الـ event loop
+    model_workers: int = 2  # عدد الـ processes (0 = تشغيل مباشر على الـ event loop)
+    model_queue_max: int = 64  # أقصى عدد tasks مستنية أو شغالة قبل ما نرجع 503
+    model_task_timeout_seconds: float = 20.0
+
+    # الموديلات المتدربة لكل مستخدم (ذاكرة + disk)
+    model_store_dir: str = "models"
+    model_refit_interval_seconds: int = 900  # كل قد إيه الـ worker بيراجع الموديلات (0 = مفيش refit في الخلفية)
+    model_refit_min_new_hours: int = 24  # refit لما يوصل عدد الساعات الجديدة من آخر تدريب للرقم ده
+    model_refit_max_age_seconds: float = 6 * 3600  # أو لما الموديل يعدي العمر ده
+
+    # التوقع المجمّع لمستخدمين كتير في pass واحد (forecast_kernel)
+    forecast_batch_max_users: int = 5000  # أقصى عدد مستخدمين في طلب /api/v1/prediction/batch
+    forecast_batch_chunk_users: int = 1000  # مستخدمين في كل طلب /api/internal/daily-series
+    forecast_precompute_interval_seconds: int = 3600  # تدريب موديلات كل المشتركين النشطين (0 = مقفول)
+
+    # مصدر التحليل والتوقع: "models" (الافتراضي) = الموديلات المتدربة على السلاسل
+    # (IsolationForest + regression)، "stats" = الإحصائيات التراكمية من /api/internal/stats
+    # (O(1)، اختياري ومحتاج consumption_stats_enabled في الـ backend: الـ anomalies بتيجي من
+    # الـ detector وقت الـ ingest والـ trend من المجاميع التراكمية، فالأرقام مش هتطابق الموديلات بالظبط)
+    analysis_source: str = "models"
+
+    # عدد الأيام اللي الموديلات بتتدرب عليها من /api/internal/features
+    feature_window_days: int = 30
+
     # الإعدادات في V2 بتتحط في متغير اسمه model_config
     model_config = SettingsConfigDict(
         env_file=".env",
         extra="ignore",
-        case_sensitive=False
+        case_sensitive=False,
+        protected_namespaces=("settings_",)  # عشان إعدادات model_* متتعارضش مع pydantic
     )
 
 settings = Settings()
\ No newline at end of file
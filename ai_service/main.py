@@ -1,11 +1,17 @@
+import asyncio
 from fastapi import FastAPI, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
-from typing import Optional
-import httpx
+from pydantic import BaseModel
+from typing import List
 from .config import settings
 from .services.analysis_service import AnalysisService
 from .services.prediction_service import PredictionService
 from .services.recommendation_service import RecommendationService
+from .services.http_client import backend_client
+from .services.single_flight import single_flight
+from .services.series_cache import series_cache
+from .services.model_store import model_store
+from .services.executor import ExecutorUnavailable, model_executor
 
 app = FastAPI(
     title="SEMS AI Service",
@@ -23,9 +29,70 @@ app.add_middleware(
 )
 
 # Initialize services
-analysis_service = AnalysisService(settings.backend_api_url)
-prediction_service = PredictionService(settings.backend_api_url)
-recommendation_service = RecommendationService(settings.backend_api_url)
+analysis_service = AnalysisService(settings.backend_api_url, settings.feature_window_days)
+prediction_service = PredictionService(settings.backend_api_url, settings.feature_window_days)
+recommendation_service = RecommendationService(settings.backend_api_url, settings.feature_window_days)
+
+
+@app.on_event("startup")
+async def startup_event():
+    # Pooled connection to the backend internal API
+    await backend_client.start()
+    model_executor.start()
+
+    # Refit stored models in the background so requests only score
+    async def model_refit_worker():
+        services = {"analysis": analysis_service, "daily": prediction_service}
+        if settings.forecast_precompute_interval_seconds > 0:
+            # الموديلات اليومية بيدرّبها forecast_precompute_worker لكل المستخدمين مرة واحدة
+            del services["daily"]
+        while True:
+            try:
+                await asyncio.sleep(settings.model_refit_interval_seconds)
+                for kind, user_id, window_days in model_store.keys():
+                    if window_days == settings.feature_window_days and kind in services:
+                        await services[kind].refresh_model(user_id)
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                print(f"Model refit worker error: {e}")
+
+    # مع analysis_source = "stats" الطلبات مش بتستخدم الموديلات المتخزنة خالص
+    use_models = settings.analysis_source == "models"
+    if use_models and settings.model_refit_interval_seconds > 0:
+        app.state.model_refit_task = asyncio.create_task(model_refit_worker())
+
+    # Fit the daily models of every active subscriber in one vectorized pass
+    async def forecast_precompute_worker():
+        while True:
+            try:
+                await asyncio.sleep(settings.forecast_precompute_interval_seconds)
+                user_ids = await prediction_service.fetch_active_users()
+                trained = 0
+                for i in range(0, len(user_ids), settings.forecast_batch_max_users):
+                    trained += await prediction_service.precompute_models(user_ids[i:i + settings.forecast_batch_max_users])
+                print(f"Forecast precompute: fitted {trained} of {len(user_ids)} active users")
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                print(f"Forecast precompute worker error: {e}")
+
+    if use_models and settings.forecast_precompute_interval_seconds > 0:
+        app.state.forecast_precompute_task = asyncio.create_task(forecast_precompute_worker())
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    for name in ("model_refit_task", "forecast_precompute_task"):
+        task = getattr(app.state, name, None)
+        if task:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+    model_executor.stop()
+    await backend_client.close()
 
 
 @app.get("/")
@@ -38,12 +105,31 @@ async def health_check():
     return {"status": "helloooooooooo"}
 
 
+@app.get("/api/v1/client-stats")
+async def get_client_stats():
+    """Counters and circuit breaker state of the backend client"""
+    return backend_client.stats()
+
+
+@app.get("/api/v1/cache-stats")
+async def get_cache_stats():
+    """Request coalescing, series cache, model store and executor counters"""
+    return {
+        "single_flight": single_flight.stats(),
+        "series": series_cache.stats(),
+        "models": model_store.stats(),
+        "executor": model_executor.stats()
+    }
+
+
 @app.get("/api/v1/analysis")
 async def get_analysis(user_id: str = Query(...)):
     """Analyze consumption patterns"""
     try:
         result = await analysis_service.analyze_consumption(user_id)
         return result
+    except ExecutorUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -54,6 +140,29 @@ async def get_prediction(user_id: str = Query(...), days: int = Query(7)):
     try:
         result = await prediction_service.predict_consumption(user_id, days)
         return result
+    except ExecutorUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+class BatchPredictionRequest(BaseModel):
+    user_ids: List[str]
+    days: int = 7
+
+
+@app.post("/api/v1/prediction/batch")
+async def get_batch_prediction(request: BatchPredictionRequest):
+    """Predict future consumption for many users in one vectorized pass"""
+    if not 1 <= request.days <= 366:
+        raise HTTPException(status_code=400, detail="days must be between 1 and 366")
+    if len(request.user_ids) > settings.forecast_batch_max_users:
+        raise HTTPException(status_code=400, detail=f"At most {settings.forecast_batch_max_users} users per request")
+    try:
+        predictions = await prediction_service.predict_batch(request.user_ids, request.days)
+        return {"days": request.days, "predictions": predictions}
+    except ExecutorUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -64,6 +173,8 @@ async def get_plan_exhaustion(user_id: str = Query(...)):
     try:
         result = await prediction_service.predict_plan_exhaustion(user_id)
         return result
+    except ExecutorUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -74,6 +185,32 @@ async def get_recommendations(user_id: str = Query(...)):
     try:
         result = await recommendation_service.get_recommendations(user_id)
         return result
+    except ExecutorUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/api/v1/insights")
+async def get_insights(user_id: str = Query(...), days: int = Query(7)):
+    """Analysis, prediction, plan exhaustion and recommendations in one call (for the backend's nightly precompute)"""
+    try:
+        # بيشتغلوا مع بعض، والـ single flight بيخليهم يشاركوا نفس البيانات والتحليل
+        analysis, prediction, plan_exhaustion, recommendations = await asyncio.gather(
+            analysis_service.analyze_consumption(user_id),
+            prediction_service.predict_consumption(user_id, days),
+            prediction_service.predict_plan_exhaustion(user_id),
+            recommendation_service.get_recommendations(user_id)
+        )
+        return {
+            "user_id": user_id,
+            "analysis": analysis,
+            "prediction": prediction,
+            "plan_exhaustion": plan_exhaustion,
+            "recommendations": recommendations
+        }
+    except ExecutorUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
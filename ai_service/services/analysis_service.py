@@ -1,26 +1,18 @@
-import httpx
-import pandas as pd
 import numpy as np
-from datetime import datetime
-from typing import Dict, List
-from sklearn.linear_model import LinearRegression
-from sklearn.ensemble import IsolationForest
+from typing import Dict, Optional
+from ..config import settings
+from .executor import model_executor
+from .features import load_series, load_stats, hourly_frame
+from .forecast_kernel import trend_from_range
+from .model_tasks import fit_analysis_models, score_analysis
+from .model_store import ModelRecord, model_store
+from .series_cache import UserSeries
+from .single_flight import single_flight
 
 class AnalysisService:
-    def __init__(self, backend_api_url: str):
+    def __init__(self, backend_api_url: str, window_days: int = 30):
         self.backend_api_url = backend_api_url
-
-    async def fetch_consumption_data(self, user_id: str) -> List[Dict]:
-        async with httpx.AsyncClient() as client:
-            try:
-                response = await client.get(
-                    f"{self.backend_api_url}/api/internal/consumption",
-                    params={"user_id": user_id},
-                    headers={"X-Service-Key": "internal-service-key-change-in-production"},
-                    timeout=30.0
-                )
-                return response.json() if response.status_code == 200 else []
-            except Exception: return []
+        self.window_days = window_days
 
     def generate_ai_recommendation(self, prediction: float, trend: float, anomalies: int) -> str:
         """محرك نصائح ذكي بناءً على نتائج الـ AI"""
@@ -36,31 +28,74 @@ class AnalysisService:
         return "استهلاكك في الحدود الطبيعية. ننصحك دائماً بفصل الأجهزة في ساعات الذروة."
 
     async def analyze_consumption(self, user_id: str) -> Dict:
-        data = await self.fetch_consumption_data(user_id)
-        if len(data) < 5:
+        """تحليل واحد لكل (مستخدم، window) مهما كان عدد الطلبات المتزامنة"""
+        return await single_flight.do(
+            ("analysis", user_id, self.window_days),
+            lambda: self._analyze_consumption(user_id)
+        )
+
+    async def refresh_model(self, user_id: str, series: Optional[UserSeries] = None, force: bool = False) -> Optional[ModelRecord]:
+        """Refit the stored models when missing, stale or (force) always"""
+        series = series or await load_series(self.backend_api_url, user_id, self.window_days)
+        df = hourly_frame(series)
+        key = ("analysis", user_id, self.window_days)
+        record = await model_store.get(key)
+        if len(df) < 5:
+            return record
+
+        new_hours = int((series.hours > np.datetime64(record.window_end)).sum()) if record else len(df)
+        if not force and not model_store.needs_refit(record, new_hours):
+            return record
+        models = await model_executor.run(fit_analysis_models, series.hours, series.hourly_total)
+        return await model_store.put(key, models, str(series.hours[0]), str(series.high_water), len(df))
+
+    async def _analyze_consumption(self, user_id: str) -> Dict:
+        if settings.analysis_source == "stats":
+            return await self._analyze_from_stats(user_id)
+
+        # سلاسل مجمعة بالساعة من الـ backend بدل القراءات الخام
+        series = await load_series(self.backend_api_url, user_id, self.window_days)
+        df = hourly_frame(series)
+        if len(df) < 5:
             return {"status": "Waiting for more data points..."}
 
-        df = pd.DataFrame(data)
-        df['timestamp'] = pd.to_datetime(df['timestamp'])
-        df = df.sort_values('timestamp')
+        # الموديلات متدربة مسبقاً (الـ refit بيحصل في الخلفية)، والطلب بيعمل scoring بس
+        record = await model_store.get(("analysis", user_id, self.window_days))
+        if record is None:
+            record = await self.refresh_model(user_id, series)
 
-        # 1. كشف الشذوذ (Anomaly Detection)
-        iso_forest = IsolationForest(contamination=0.05, random_state=42)
-        df['anomaly'] = iso_forest.fit_predict(df[['consumption_value']])
-        anomalies_count = int((df['anomaly'] == -1).sum())
+        # الـ scoring برضه في الـ process pool عشان الـ event loop يفضل فاضي
+        scores = await model_executor.run(
+            score_analysis, record.models, series.hours, series.hourly_total, series.hourly_count
+        )
+        return self._analysis_result(
+            user_id, scores["prediction"], scores["trend"], scores["anomalies"], scores["peak_hour"],
+            float(df['total'].sum()), record.metadata()
+        )
 
-        # 2. التنبؤ بالاستهلاك القادم (Regression)
-        df['day_index'] = np.arange(len(df)).reshape(-1, 1)
-        model = LinearRegression()
-        model.fit(df[['day_index']], df['consumption_value'])
-        
-        trend = model.coef_[0] # معامل الميل (هل بيزيد ولا بيقل؟)
-        prediction = model.predict([[len(df)]])[0]
+    async def _analyze_from_stats(self, user_id: str) -> Dict:
+        """نفس التحليل من الإحصائيات التراكمية: كل حاجة من مجاميع ثابتة الحجم"""
+        stats = await load_stats(self.backend_api_url, user_id, self.window_days)
+        if not stats or stats["first_hour"] is None or stats["last_hour"] - stats["first_hour"] + 1 < 5:
+            return {"status": "Waiting for more data points..."}
+
+        # trend بالساعة: الساعات اللي مفيهاش قراءات بتتحسب صفر
+        trend, intercept, hours = trend_from_range(
+            stats["first_hour"], stats["last_hour"], stats["total"], stats["hour_sxy"]
+        )
+        prediction = intercept + trend * hours  # الساعة اللي بعد آخر ساعة
 
-        # 3. استخراج ساعة الذروة (Peak Hour)
-        df['hour'] = df['timestamp'].dt.hour
-        peak_hour = int(df.groupby('hour')['consumption_value'].mean().idxmax())
+        # ساعة الذروة = أعلى متوسط قراءة في ساعة اليوم
+        totals, counts = np.array(stats["hourly_total"]), np.array(stats["hourly_count"])
+        peak_hour = int(np.argmax(np.divide(totals, counts, out=np.full(24, -np.inf), where=counts > 0)))
 
+        return self._analysis_result(
+            user_id, prediction, trend, stats["anomalies"], peak_hour, stats["total"],
+            {"source": "running_stats", "window_start": stats["start"], "readings": stats["readings"]}
+        )
+
+    def _analysis_result(self, user_id: str, prediction: float, trend: float, anomalies_count: int,
+                         peak_hour: int, total_usage: float, model: Dict) -> Dict:
         # 4. توليد النصيحة الذكية
         recommendation = self.generate_ai_recommendation(prediction, trend, anomalies_count)
 
@@ -78,6 +113,7 @@ class AnalysisService:
             },
             "energy_profile": {
                 "peak_hour_24h": peak_hour,
-                "total_usage": round(float(df['consumption_value'].sum()), 2)
-            }
-        }
\ No newline at end of file
+                "total_usage": round(float(total_usage), 2)
+            },
+            "model": model
+        }
@@ -0,0 +1,113 @@
+"""
+Process pool for the CPU-bound model steps (services/model_tasks.py), so a fit never
+blocks the event loop that serves every other request and the health check.
+"""
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Optional
+from ..config import settings
+
+
+class ExecutorUnavailable(Exception):
+    """The task was not run to completion; the caller should answer 503"""
+
+
+class ExecutorBusy(ExecutorUnavailable):
+    """More than max_pending tasks are already queued or running"""
+
+
+class TaskTimeout(ExecutorUnavailable):
+    """The task did not finish within its timeout"""
+
+
+class ModelExecutor:
+    """
+    Bounded front of a ProcessPoolExecutor.
+
+    At most max_pending tasks may be queued or running; beyond that run() raises
+    ExecutorBusy instead of letting the queue (and latency) grow without bound. A
+    task that outlives its timeout raises TaskTimeout to the caller. The worker
+    cannot be interrupted mid-fit, so its slot stays counted until it really ends.
+
+    workers=0 runs tasks inline on the event loop (useful for debugging).
+    """
+
+    def __init__(self, workers: int, max_pending: int, timeout_seconds: float):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout_seconds = timeout_seconds
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+    def start(self):
+        if self.workers > 0 and self._pool is None:
+            # spawn: الـ workers مبيورثوش الـ event loop ولا الـ sockets المفتوحة
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+
+    def stop(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def _task_done(self):
+        self.pending -= 1
+        self.completed += 1
+
+    async def run(self, fn: Callable[..., Any], *args, timeout: Optional[float] = None) -> Any:
+        if self.workers <= 0:
+            return fn(*args)
+        if self._pool is None:
+            self.start()
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise ExecutorBusy(f"{self.pending} model tasks already pending")
+
+        try:
+            future = self._pool.submit(fn, *args)
+        except BrokenProcessPool:
+            self._restart()
+            raise ExecutorUnavailable("Model worker pool restarted")
+        self.pending += 1
+        loop = asyncio.get_running_loop()
+        # الـ callback بيتنفذ في thread الـ pool، فبنرجع للـ loop عشان نعدل العداد
+        future.add_done_callback(lambda _: loop.call_soon_threadsafe(self._task_done))
+
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout or self.timeout_seconds)
+        except asyncio.TimeoutError:
+            self.timed_out += 1
+            raise TaskTimeout(f"{getattr(fn, '__name__', 'task')} exceeded {timeout or self.timeout_seconds}s")
+        except BrokenProcessPool:
+            self._restart()
+            raise ExecutorUnavailable("Model worker pool restarted")
+
+    def _restart(self):
+        # worker مات (مثلاً OOM) - نبني pool جديد للطلبات الجاية
+        print("Model executor: process pool is broken, restarting it")
+        self._pool = None
+        self.start()
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "pending": self.pending,
+            "max_pending": self.max_pending,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out
+        }
+
+
+model_executor = ModelExecutor(
+    workers=settings.model_workers,
+    max_pending=settings.model_queue_max,
+    timeout_seconds=settings.model_task_timeout_seconds
+)
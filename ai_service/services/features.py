@@ -0,0 +1,86 @@
+"""
+Client side of the backend's /api/internal/features endpoint: daily and hourly
+consumption series that are already aggregated in MongoDB, kept per user in the
+series cache and refreshed incrementally. Also /api/internal/stats: the user's
+running sums (constant size whatever the history).
+"""
+from typing import Dict, Optional
+import numpy as np
+import pandas as pd
+from .http_client import backend_client
+from .series_cache import UserSeries, series_cache
+from .single_flight import single_flight
+
+
+async def load_series(backend_api_url: str, user_id: str, days: int) -> Optional[UserSeries]:
+    """كل الـ services اللي بتطلب نفس (المستخدم، الـ window) في نفس الوقت بتشارك طلب واحد"""
+    return await single_flight.do(
+        ("features", user_id, days),
+        lambda: _load_series(backend_api_url, user_id, days)
+    )
+
+
+async def _load_series(backend_api_url: str, user_id: str, days: int) -> Optional[UserSeries]:
+    key = (user_id, days)
+    cached = series_cache.get(key)
+    params = {"user_id": user_id, "days": days}
+    if cached is not None and cached.high_water is not None:
+        # من أول الساعة الأخيرة المتخزنة (ممكن تكون لسه بتتملي) لحد دلوقتي
+        params["since"] = str(cached.high_water)
+
+    try:
+        response = await backend_client.get(f"{backend_api_url}/api/internal/features", params=params)
+        if response.status_code != 200:
+            return cached
+        features = response.json()
+    except Exception: return cached
+
+    fetched = UserSeries.from_features(features)
+    if "since" not in params:
+        series = fetched
+        series_cache.record(False, len(response.content))
+    else:
+        series = cached.merge(fetched, np.datetime64(features["start"]))
+        # الصفوف اللي مااتبعتتش تاني، بمتوسط حجم الصف في الرد ده
+        row_bytes = len(response.content) / max(fetched.rows, 1)
+        series_cache.record(True, len(response.content), int((series.rows - fetched.rows) * row_bytes))
+    series_cache.put(key, series)
+    return series
+
+
+async def load_stats(backend_api_url: str, user_id: str, days: int) -> Optional[Dict]:
+    """الإحصائيات التراكمية للمستخدم (مجاميع + 24 ساعة + مجاميع الـ regression)"""
+    return await single_flight.do(
+        ("stats", user_id, days),
+        lambda: _load_stats(backend_api_url, user_id, days)
+    )
+
+
+async def _load_stats(backend_api_url: str, user_id: str, days: int) -> Optional[Dict]:
+    try:
+        response = await backend_client.get(
+            f"{backend_api_url}/api/internal/stats",
+            params={"user_id": user_id, "days": days}
+        )
+        return response.json() if response.status_code == 200 else None
+    except Exception: return None
+
+
+def daily_frame(series: Optional[UserSeries]) -> pd.DataFrame:
+    """DataFrame[date, consumption] بيوم لكل صف، والأيام اللي مفيهاش قراءات = صفر"""
+    if series is None or not len(series.days):
+        return pd.DataFrame({"date": pd.Series(dtype="datetime64[ns]"), "consumption": pd.Series(dtype="float64")})
+    daily = pd.Series(series.daily_total, index=pd.DatetimeIndex(series.days))
+    daily = daily.reindex(pd.date_range(daily.index.min(), daily.index.max(), freq="D"), fill_value=0.0)
+    return pd.DataFrame({"date": daily.index, "consumption": daily.values})
+
+
+def hourly_frame(series: Optional[UserSeries]) -> pd.DataFrame:
+    """DataFrame[hour, total, count] لكل ساعة فيها قراءات، مرتبة زمنياً"""
+    if series is None or not len(series.hours):
+        return pd.DataFrame({
+            "hour": pd.Series(dtype="datetime64[ns]"),
+            "total": pd.Series(dtype="float64"),
+            "count": pd.Series(dtype="int64")
+        })
+    return pd.DataFrame({"hour": series.hours, "total": series.hourly_total, "count": series.hourly_count})
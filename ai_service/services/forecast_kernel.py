@@ -0,0 +1,86 @@
+"""
+Vectorized daily-trend forecasting for many users at once.
+
+Each user's daily totals become one row of a zero-padded matrix, left-aligned so
+column j is day j since that user's first day, with a mask marking the real days.
+A single pass of masked sums gives every user's ordinary least-squares line
+
+    slope = (n*Sxy - Sx*Sy) / (n*Sxx - Sx^2),   intercept = (Sy - slope*Sx) / n
+
+which is what LinearRegression fits on X = [0, 1, ..., n-1] for that user alone.
+"""
+from typing import Dict, List, Tuple
+import numpy as np
+
+MIN_DAILY_PREDICTION = 0.5  # نفس الحد الأدنى اللي PredictionService بيستخدمه
+
+
+def pack_daily(series: List[np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+    """List of per-user daily totals (any lengths) -> (matrix, mask), both (users, max_days)"""
+    lengths = np.array([len(values) for values in series], dtype=np.int64)
+    width = int(lengths.max()) if len(lengths) else 0
+    matrix = np.zeros((len(series), width), dtype=np.float64)
+    mask = np.arange(width) < lengths[:, None]
+    if width:
+        matrix[mask] = np.concatenate(series)
+    return matrix, mask
+
+
+def fit_trends(matrix: np.ndarray, mask: np.ndarray) -> Dict[str, np.ndarray]:
+    """Per-row least-squares slope and intercept, plus n and the variance of y"""
+    weights = mask.astype(np.float64)
+    x = np.arange(matrix.shape[1], dtype=np.float64)
+    y = matrix * weights
+
+    n = weights.sum(axis=1)
+    sx = weights @ x
+    sxx = weights @ (x * x)
+    sy = y.sum(axis=1)
+    sxy = y @ x
+    syy = (y * matrix).sum(axis=1)
+
+    slope, intercept = solve_trend(n, sx, sxx, sy, sxy)
+    safe_n = np.maximum(n, 1.0)
+    variance = np.maximum(syy / safe_n - (sy / safe_n) ** 2, 0.0)
+    return {"slope": slope, "intercept": intercept, "n": n.astype(np.int64), "variance": variance}
+
+
+def solve_trend(n, sx, sxx, sy, sxy) -> Tuple[np.ndarray, np.ndarray]:
+    """Least-squares slope and intercept from the sums (scalars or arrays)"""
+    n, sx, sxx, sy, sxy = (np.asarray(value, dtype=np.float64) for value in (n, sx, sxx, sy, sxy))
+    denominator = n * sxx - sx * sx
+    # نقطة واحدة بس = مفيش ميل (LinearRegression بيرجع 0 برضه)
+    slope = np.divide(n * sxy - sx * sy, denominator, out=np.zeros_like(denominator), where=denominator > 0)
+    intercept = (sy - slope * sx) / np.maximum(n, 1.0)
+    return slope, intercept
+
+
+def trend_from_range(first: int, last: int, sy: float, sxy: float) -> Tuple[float, float, int]:
+    """
+    Trend over x = first .. last (missing x counted as y = 0) from the running sums
+    sum(y) and sum(x*y). Returns (slope, intercept, n) with x shifted so the first
+    point is 0, like fit_trends.
+    """
+    n = last - first + 1
+    sx = n * (n - 1) / 2
+    sxx = (n - 1) * n * (2 * n - 1) / 6
+    slope, intercept = solve_trend(n, sx, sxx, sy, sxy - first * sy)
+    return float(slope), float(intercept), n
+
+
+def project(slope: np.ndarray, intercept: np.ndarray, start: np.ndarray, horizon: int) -> np.ndarray:
+    """Predictions for day offsets start .. start+horizon-1 per user, floored at 0.5 kWh"""
+    offsets = start[:, None] + np.arange(horizon)[None, :]
+    return np.maximum(intercept[:, None] + slope[:, None] * offsets, MIN_DAILY_PREDICTION)
+
+
+def fit_series(series: List[np.ndarray]) -> Dict[str, np.ndarray]:
+    """fit_trends over a list of per-user daily totals"""
+    return fit_trends(*pack_daily(series))
+
+
+def forecast(series: List[np.ndarray], horizon: int) -> Dict[str, np.ndarray]:
+    """Fit every user's trend and forecast the `horizon` days after their last day"""
+    trends = fit_series(series)
+    predictions = project(trends["slope"], trends["intercept"], trends["n"], horizon)
+    return {**trends, "predictions": predictions}
@@ -0,0 +1,148 @@
+"""
+Fitted per-user models, kept in memory and persisted to disk with joblib.
+
+Each entry holds the fitted estimators plus metadata: a version that increments on
+every refit, when it was trained and the time range of the data it was trained on.
+Requests score with the stored models; refits happen when a model is missing, when
+enough new data has arrived since its training window, or when it gets too old
+(see main.model_refit_worker).
+
+joblib reads and writes run in a worker thread (asyncio.to_thread), so loading or
+persisting a model never blocks the event loop; get and put are coroutines.
+"""
+import asyncio
+import os
+import re
+import threading
+from datetime import datetime
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+import joblib
+from ..config import settings
+
+STORE_FORMAT = 3  # 3: daily models are plain slope/intercept (forecast_kernel)
+
+
+class ModelRecord:
+    def __init__(self, models: Dict[str, Any], version: int, trained_at: datetime,
+                 window_start: str, window_end: str, rows: int):
+        self.models = models
+        self.version = version
+        self.trained_at = trained_at
+        self.window_start = window_start  # أول ساعة في بيانات التدريب (ISO)
+        self.window_end = window_end      # آخر ساعة في بيانات التدريب (ISO) = high-water وقت التدريب
+        self.rows = rows
+
+    def metadata(self) -> dict:
+        return {
+            "version": self.version,
+            "trained_at": self.trained_at.isoformat(),
+            "window_start": self.window_start,
+            "window_end": self.window_end,
+            "rows": self.rows
+        }
+
+
+class ModelStore:
+    """
+    (kind, user_id, window_days) -> ModelRecord. Writes go to a temporary file and
+    are renamed into place, so a crash never leaves a half-written model behind.
+    """
+
+    def __init__(self, directory: str, min_new_hours: int, max_age_seconds: float):
+        self.directory = directory
+        self.min_new_hours = min_new_hours
+        self.max_age_seconds = max_age_seconds
+        self._records: Dict[Hashable, ModelRecord] = {}
+        self.fits = 0
+        self.loaded_from_disk = 0
+
+    def _path(self, key: Tuple[str, str, int]) -> str:
+        kind, user_id, window_days = key
+        safe_user = re.sub(r"[^A-Za-z0-9_-]", "_", user_id)
+        return os.path.join(self.directory, kind, f"{safe_user}-{window_days}d.joblib")
+
+    async def get(self, key: Tuple[str, str, int]) -> Optional[ModelRecord]:
+        record = self._records.get(key)
+        if record is not None:
+            return record
+
+        payload = await asyncio.to_thread(self._load, self._path(key))
+        if payload is None or payload.get("format") != STORE_FORMAT:
+            return None
+        record = ModelRecord(
+            payload["models"], payload["version"], datetime.fromisoformat(payload["trained_at"]),
+            payload["window_start"], payload["window_end"], payload["rows"]
+        )
+        # لو حد عمل put وإحنا بنقرا من الديسك، اللي في الذاكرة هو الأحدث
+        record = self._records.setdefault(key, record)
+        self.loaded_from_disk += 1
+        return record
+
+    async def put(self, key: Tuple[str, str, int], models: Dict[str, Any],
+                  window_start: str, window_end: str, rows: int) -> ModelRecord:
+        previous = await self.get(key)
+        record = ModelRecord(
+            models,
+            version=(previous.version + 1) if previous else 1,
+            trained_at=datetime.utcnow(),
+            window_start=window_start,
+            window_end=window_end,
+            rows=rows
+        )
+        self._records[key] = record
+        self.fits += 1
+
+        await asyncio.to_thread(
+            self._save, key, record, {"format": STORE_FORMAT, "models": models, **record.metadata()}
+        )
+        return record
+
+    @staticmethod
+    def _load(path: str) -> Optional[dict]:
+        if not os.path.exists(path):
+            return None
+        try:
+            return joblib.load(path)
+        except Exception as e:
+            print(f"Model store: could not load {path}: {e}")
+            return None
+
+    def _save(self, key: Tuple[str, str, int], record: ModelRecord, payload: dict):
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            joblib.dump(payload, tmp_path)
+            if self._records.get(key) is not record:
+                # put أحدث لنفس المفتاح اتعمل في الوقت ده، ونسخته هي اللي تتكتب
+                os.remove(tmp_path)
+                return
+            os.replace(tmp_path, path)
+        except Exception as e:
+            # الموديل لسه شغال من الذاكرة، بس هيتعمله fit تاني بعد restart
+            print(f"Model store: could not persist {path}: {e}")
+
+    def needs_refit(self, record: Optional[ModelRecord], new_hours: int) -> bool:
+        if record is None:
+            return True
+        if new_hours >= self.min_new_hours:
+            return True
+        return (datetime.utcnow() - record.trained_at).total_seconds() >= self.max_age_seconds
+
+    def keys(self) -> List[Hashable]:
+        return list(self._records)
+
+    def stats(self) -> dict:
+        return {
+            "models": len(self._records),
+            "fits": self.fits,
+            "loaded_from_disk": self.loaded_from_disk,
+            "directory": self.directory
+        }
+
+
+model_store = ModelStore(
+    directory=settings.model_store_dir,
+    min_new_hours=settings.model_refit_min_new_hours,
+    max_age_seconds=settings.model_refit_max_age_seconds
+)
@@ -0,0 +1,73 @@
+"""
+CPU-bound fitting and scoring steps, as plain module-level functions so they can
+run in the model executor's worker processes. Inputs and outputs are NumPy arrays,
+fitted estimators and small dicts; nothing here touches the network or the event
+loop.
+"""
+from typing import Dict
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import IsolationForest
+from sklearn.linear_model import LinearRegression
+from .forecast_kernel import fit_trends, project
+
+
+def _hour_offsets(hours: np.ndarray, origin: np.datetime64) -> np.ndarray:
+    return ((hours - origin) / np.timedelta64(1, "h")).astype(np.float64).reshape(-1, 1)
+
+
+def fit_analysis_models(hours: np.ndarray, totals: np.ndarray) -> Dict:
+    """Anomaly detector + hourly trend; X is the number of hours since the first hour"""
+    # 1. كشف الشذوذ (Anomaly Detection) على استهلاك كل ساعة
+    iso_forest = IsolationForest(contamination=0.05, random_state=42)
+    iso_forest.fit(totals.reshape(-1, 1))
+
+    # 2. الـ Regression - المحور هو عدد الساعات من أول ساعة في بيانات التدريب
+    origin = hours[0]
+    model = LinearRegression()
+    model.fit(_hour_offsets(hours, origin), totals)
+    return {"isolation_forest": iso_forest, "trend": model, "origin": origin}
+
+
+def score_analysis(models: Dict, hours: np.ndarray, totals: np.ndarray, counts: np.ndarray) -> Dict:
+    anomalies = int((models["isolation_forest"].predict(totals.reshape(-1, 1)) == -1).sum())
+
+    model = models["trend"]
+    last_hour = _hour_offsets(hours[-1:], models["origin"])[0, 0]
+    prediction = float(model.predict([[last_hour + 1]])[0])
+
+    # 3. ساعة الذروة = أعلى متوسط قراءة في ساعة اليوم
+    by_hour = pd.DataFrame({
+        "hour_of_day": pd.DatetimeIndex(hours).hour,
+        "total": totals,
+        "count": counts
+    }).groupby("hour_of_day")[["total", "count"]].sum()
+    peak_hour = int((by_hour["total"] / by_hour["count"]).idxmax())
+
+    return {
+        "anomalies": anomalies,
+        "trend": float(model.coef_[0]),
+        "prediction": prediction,
+        "peak_hour": peak_hour
+    }
+
+
+def fit_daily_model(dates: np.ndarray, totals: np.ndarray) -> Dict:
+    """Daily trend; X is the number of days since the first training day"""
+    # نفس الـ kernel اللي بيدرّب آلاف المستخدمين مرة واحدة (forecast_kernel)، بصف واحد
+    trends = fit_trends(totals.reshape(1, -1), np.ones((1, len(totals)), dtype=bool))
+    return {"slope": float(trends["slope"][0]), "intercept": float(trends["intercept"][0]), "origin": dates[0]}
+
+
+def score_daily(models: Dict, dates: np.ndarray, totals: np.ndarray, days: int) -> Dict:
+    # توقع الأيام القادمة بعد آخر يوم في البيانات الحالية
+    last_day = int((dates[-1] - models["origin"]) / np.timedelta64(1, "D"))
+    predictions = project(
+        np.array([models["slope"]]), np.array([models["intercept"]]), np.array([last_day + 1]), days
+    )[0]  # نمنع القيم الصفرية أو السالبة
+    return {
+        "predictions": predictions,
+        "trend": models["slope"],
+        "variance": float(np.var(totals))
+    }
+
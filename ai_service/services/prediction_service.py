@@ -1,92 +1,194 @@
-import httpx
-import pandas as pd
+import asyncio
 import numpy as np
 from datetime import datetime, timedelta
-from typing import Dict, List
-from sklearn.linear_model import LinearRegression
+from typing import Dict, List, Optional, Tuple
+from ..config import settings
+from .executor import model_executor
+from .features import load_series, load_stats, daily_frame
+from .forecast_kernel import fit_series, forecast, project, trend_from_range
+from .model_tasks import fit_daily_model, score_daily
+from .model_store import ModelRecord, model_store
+from .series_cache import UserSeries
+from .http_client import backend_client
+from .single_flight import single_flight
 
 class PredictionService:
-    def __init__(self, backend_api_url: str):
+    def __init__(self, backend_api_url: str, window_days: int = 30):
         self.backend_api_url = backend_api_url
+        self.window_days = window_days
     
-    async def fetch_consumption_data(self, user_id: str) -> List[Dict]:
-        async with httpx.AsyncClient() as client:
-            try:
-                response = await client.get(
-                    f"{self.backend_api_url}/api/internal/consumption",
-                    params={"user_id": user_id},
-                    headers={"X-Service-Key": "internal-service-key-change-in-production"},
-                    timeout=30.0
-                )
-                return response.json() if response.status_code == 200 else []
-            except Exception: return []
-
     async def fetch_subscription_data(self, user_id: str) -> Dict:
-        async with httpx.AsyncClient() as client:
-            try:
-                response = await client.get(
-                    f"{self.backend_api_url}/api/internal/subscription",
-                    params={"user_id": user_id},
-                    headers={"X-Service-Key": "internal-service-key-change-in-production"},
-                    timeout=30.0
-                )
-                return response.json() if response.status_code == 200 else None
-            except Exception: return None
+        return await single_flight.do(("subscription", user_id), lambda: self._fetch_subscription_data(user_id))
+
+    async def _fetch_subscription_data(self, user_id: str) -> Dict:
+        try:
+            response = await backend_client.get(
+                f"{self.backend_api_url}/api/internal/subscription",
+                params={"user_id": user_id}
+            )
+            return response.json() if response.status_code == 200 else None
+        except Exception: return None
+
+    async def fetch_active_users(self) -> List[str]:
+        """كل المستخدمين اللي عندهم اشتراك نشط (للـ jobs اللي بتشتغل على الكل)"""
+        response = await backend_client.get(f"{self.backend_api_url}/api/internal/active-users")
+        response.raise_for_status()
+        return response.json()["user_ids"]
 
     async def predict_consumption(self, user_id: str, days: int = 7) -> Dict:
         """توقع الاستهلاك المستقبلي باستخدام الـ Linear Regression المطوّر"""
-        data = await self.fetch_consumption_data(user_id)
-        
-        if not data or len(data) < 3:
-            return {
-                "user_id": user_id,
-                "predicted_total_kwh": 5.0 * days, # قيمة افتراضية
-                "confidence": "Very Low (Initial Phase)"
-            }
-        
-        df = pd.DataFrame(data)
-        df['timestamp'] = pd.to_datetime(df['timestamp'])
-        daily = df.groupby(df['timestamp'].dt.date)['consumption_value'].sum().reset_index()
-        daily.columns = ['date', 'consumption']
-        
-        # تحويل التاريخ لأرقام للتدريب
-        X = np.arange(len(daily)).reshape(-1, 1)
-        y = daily['consumption'].values
-        
-        # AI Model - التدريب
-        model = LinearRegression()
-        model.fit(X, y)
-        
-        # توقع الأيام القادمة
-        future_X = np.arange(len(daily), len(daily) + days).reshape(-1, 1)
-        predictions = model.predict(future_X)
-        predictions = np.maximum(predictions, 0.5) # نمنع القيم الصفرية أو السالبة
-        
+        return await single_flight.do(
+            ("prediction", user_id, self.window_days, days),
+            lambda: self._predict_consumption(user_id, days)
+        )
+
+    async def refresh_model(self, user_id: str, series: Optional[UserSeries] = None, force: bool = False) -> Optional[ModelRecord]:
+        """Refit the stored daily model when missing, stale or (force) always"""
+        series = series or await load_series(self.backend_api_url, user_id, self.window_days)
+        daily = daily_frame(series)
+        key = ("daily", user_id, self.window_days)
+        record = await model_store.get(key)
+        if daily.empty:
+            return record
+
+        new_hours = int((series.hours > np.datetime64(record.window_end)).sum()) if record else len(series.hours)
+        if not force and not model_store.needs_refit(record, new_hours):
+            return record
+        models = await model_executor.run(fit_daily_model, daily['date'].to_numpy(), daily['consumption'].to_numpy())
+        return await model_store.put(key, models, str(series.days[0]), str(series.high_water), len(daily))
+
+    async def _predict_consumption(self, user_id: str, days: int) -> Dict:
+        if settings.analysis_source == "stats":
+            return await self._predict_from_stats(user_id, days)
+
+        # إجمالي كل يوم جاهز من الـ rollups بدل groupby على القراءات الخام
+        series = await load_series(self.backend_api_url, user_id, self.window_days)
+        daily = daily_frame(series)
+
+        if daily.empty:
+            return self._default_prediction(user_id, days)
+
+        # الموديل متدرب مسبقاً (الـ refit بيحصل في الخلفية)، والطلب بيعمل scoring بس
+        record = await model_store.get(("daily", user_id, self.window_days))
+        if record is None:
+            record = await self.refresh_model(user_id, series)
+        scores = await model_executor.run(
+            score_daily, record.models, daily['date'].to_numpy(), daily['consumption'].to_numpy(), days
+        )
+        result = self._prediction_result(user_id, days, scores["predictions"], scores["trend"], scores["variance"], len(daily))
+        return {**result, "model": record.metadata()}
+
+    async def _predict_from_stats(self, user_id: str, days: int) -> Dict:
+        """الـ trend اليومي من الإحصائيات التراكمية بدل fit على السلسلة"""
+        stats = await load_stats(self.backend_api_url, user_id, self.window_days)
+        if not stats or stats["first_day"] is None:
+            return self._default_prediction(user_id, days)
+
+        slope, intercept, training_days = trend_from_range(
+            stats["first_day"], stats["last_day"], stats["total"], stats["day_sxy"]
+        )
+        predictions = project(np.array([slope]), np.array([intercept]), np.array([training_days]), days)[0]
+        mean = stats["total"] / training_days
+        variance = max(stats["daily_sum_squares"] / training_days - mean * mean, 0.0)
+
+        result = self._prediction_result(user_id, days, predictions, slope, variance, training_days)
+        return {**result, "model": {"source": "running_stats", "window_start": stats["start"], "readings": stats["readings"]}}
+
+    @staticmethod
+    def _default_prediction(user_id: str, days: int) -> Dict:
+        return {
+            "user_id": user_id,
+            "predicted_total_kwh": 5.0 * days, # قيمة افتراضية
+            "confidence": "Very Low (Initial Phase)"
+        }
+
+    @staticmethod
+    def _prediction_result(user_id: str, days: int, predictions: np.ndarray, slope: float,
+                           variance: float, training_days: int) -> Dict:
         avg_predicted = float(np.mean(predictions))
-        
+
         # قياس مدى دقة النموذج (لو الاستهلاك متذبذب جداً الدقة بتقل)
-        variance = np.var(y)
-        confidence = "High" if variance < 50 and len(daily) > 10 else "Medium"
+        confidence = "High" if variance < 50 and training_days > 10 else "Medium"
 
         return {
             "user_id": user_id,
             "prediction_period_days": days,
             "predicted_daily_avg": round(avg_predicted, 2),
             "predicted_total_for_period": round(float(np.sum(predictions)), 2),
-            "trend_slope": float(model.coef_[0]), # هل الاستهلاك بيزيد ولا بيقل مع الوقت؟
+            "trend_slope": slope, # هل الاستهلاك بيزيد ولا بيقل مع الوقت؟
             "confidence": confidence
         }
 
+    async def fetch_daily_batch(self, user_ids: List[str]) -> Dict[str, Tuple[np.ndarray, np.ndarray]]:
+        """
+        {user_id: (dates, totals)} for the training window, one row per day from the
+        user's first day with readings to the last (days without readings = 0, same as
+        daily_frame). Users without readings are left out.
+        """
+        chunk = settings.forecast_batch_chunk_users
+        responses = await asyncio.gather(*(
+            backend_client.request(
+                "POST", f"{self.backend_api_url}/api/internal/daily-series",
+                json={"user_ids": user_ids[i:i + chunk], "days": self.window_days}
+            )
+            for i in range(0, len(user_ids), chunk)
+        ))
+
+        series = {}
+        for response in responses:
+            response.raise_for_status()
+            for row in response.json()["users"]:
+                dates = np.array(row["dates"], dtype="datetime64[D]")
+                offsets = (dates - dates[0]).astype(np.int64)
+                totals = np.zeros(offsets[-1] + 1, dtype=np.float64)
+                totals[offsets] = row["totals"]
+                series[row["user_id"]] = (dates[0] + np.arange(len(totals)), totals)
+        return series
+
+    async def predict_batch(self, user_ids: List[str], days: int = 7) -> Dict[str, Dict]:
+        """نفس نتيجة predict_consumption لكل مستخدم، بس كل الموديلات بتتدرب في pass واحد"""
+        user_ids = list(dict.fromkeys(user_ids))
+        series = await self.fetch_daily_batch(user_ids)
+        with_data = [user_id for user_id in user_ids if user_id in series]
+
+        results = {user_id: self._default_prediction(user_id, days) for user_id in user_ids if user_id not in series}
+        if with_data:
+            batch = await model_executor.run(forecast, [series[user_id][1] for user_id in with_data], days)
+            for i, user_id in enumerate(with_data):
+                results[user_id] = self._prediction_result(
+                    user_id, days, batch["predictions"][i], float(batch["slope"][i]),
+                    float(batch["variance"][i]), int(batch["n"][i])
+                )
+        return {user_id: results[user_id] for user_id in user_ids}
+
+    async def precompute_models(self, user_ids: List[str]) -> int:
+        """Fit and store the daily models of many users in one vectorized pass"""
+        series = await self.fetch_daily_batch(list(dict.fromkeys(user_ids)))
+        if not series:
+            return 0
+        trained = list(series)
+        trends = await model_executor.run(fit_series, [series[user_id][1] for user_id in trained])
+
+        for i, user_id in enumerate(trained):
+            dates, totals = series[user_id]
+            models = {"slope": float(trends["slope"][i]), "intercept": float(trends["intercept"][i]), "origin": dates[0]}
+            # آخر يوم بالكامل كـ high-water، فالـ refit worker بيعتبر ساعات النهارده جديدة
+            await model_store.put(("daily", user_id, self.window_days), models, str(dates[0]), str(dates[-1]), len(totals))
+        return len(trained)
+
     async def predict_plan_exhaustion(self, user_id: str) -> Dict:
         """توقع تاريخ انتهاء شحن العداد/الباقة"""
-        sub = await self.fetch_subscription_data(user_id)
+        # الاشتراك والتوقع (لـ 30 يوم عشان نعرف معدل الاستهلاك اليومي) بيتجابوا مع بعض
+        sub, pred_data = await asyncio.gather(
+            self.fetch_subscription_data(user_id),
+            self.predict_consumption(user_id, days=30)
+        )
         if not sub:
             return {"message": "No active plan found"}
 
         remaining = sub.get('remaining_quota', 0)
-        # نطلب توقع لـ 30 يوم عشان نعرف معدل الاستهلاك اليومي
-        pred_data = await self.predict_consumption(user_id, days=30)
-        daily_rate = pred_data['predicted_daily_avg']
+        # مستخدم من غير قراءات بياخد _default_prediction ومفيهوش predicted_daily_avg
+        daily_rate = pred_data.get('predicted_daily_avg') or 0
 
         if daily_rate <= 0: daily_rate = 1.0 # حماية من القسمة على صفر
         
@@ -101,6 +203,7 @@ class PredictionService:
         return {
             "user_id": user_id,
             "current_balance_kwh": remaining,
+            "daily_rate_kwh": daily_rate,  # الـ backend بيعيد الحساب بيه على الرصيد الحالي
             "estimated_days_remaining": round(days_left, 1),
             "estimated_exhaustion_date": exhaustion_date.strftime("%Y-%m-%d"),
             "system_status": status,
@@ -1,31 +1,34 @@
-import httpx
-import pandas as pd
+import asyncio
 from datetime import datetime
-from typing import Dict, List
+from typing import Dict
 from .analysis_service import AnalysisService
+from .http_client import backend_client
+from .single_flight import single_flight
 
 class RecommendationService:
-    def __init__(self, backend_api_url: str):
+    def __init__(self, backend_api_url: str, window_days: int = 30):
         self.backend_api_url = backend_api_url
-        self.analysis_service = AnalysisService(backend_api_url)
+        self.analysis_service = AnalysisService(backend_api_url, window_days)
     
     async def fetch_subscription_data(self, user_id: str) -> Dict:
-        async with httpx.AsyncClient() as client:
-            try:
-                response = await client.get(
-                    f"{self.backend_api_url}/api/internal/subscription",
-                    params={"user_id": user_id},
-                    headers={"X-Service-Key": "internal-service-key-change-in-production"},
-                    timeout=30.0
-                )
-                return response.json() if response.status_code == 200 else None
-            except Exception: return None
+        return await single_flight.do(("subscription", user_id), lambda: self._fetch_subscription_data(user_id))
+
+    async def _fetch_subscription_data(self, user_id: str) -> Dict:
+        try:
+            response = await backend_client.get(
+                f"{self.backend_api_url}/api/internal/subscription",
+                params={"user_id": user_id}
+            )
+            return response.json() if response.status_code == 200 else None
+        except Exception: return None
 
     async def get_recommendations(self, user_id: str) -> Dict:
         """توليد توصيات ذكية جداً بناءً على تحليل الـ AI"""
-        # جلب التحليل المتطور من الـ AnalysisService اللي طورناه سوا
-        analysis_result = await self.analysis_service.analyze_consumption(user_id)
-        subscription = await self.fetch_subscription_data(user_id)
+        # جلب التحليل المتطور من الـ AnalysisService اللي طورناه سوا (بالتوازي مع الاشتراك)
+        analysis_result, subscription = await asyncio.gather(
+            self.analysis_service.analyze_consumption(user_id),
+            self.fetch_subscription_data(user_id)
+        )
         
         recommendations = []
 
@@ -0,0 +1,146 @@
+"""
+In-memory cache of each active user's daily and hourly consumption series.
+
+Series are kept as NumPy arrays. A refresh only asks the backend for rows from the
+cached high-water mark (the last cached hour, which may still have been filling up)
+onwards and splices them onto the cached arrays, so a repeat request transfers a
+few rows instead of the whole window.
+"""
+import time
+from collections import OrderedDict
+from typing import Dict, Hashable, Optional
+import numpy as np
+from ..config import settings
+
+
+class UserSeries:
+    """Daily and hourly totals/counts for one user over one window, oldest first"""
+
+    def __init__(self, days, daily_total, daily_count, hours, hourly_total, hourly_count):
+        self.days = days                    # datetime64[D]
+        self.daily_total = daily_total      # float64
+        self.daily_count = daily_count      # int64
+        self.hours = hours                  # datetime64[s], start of each UTC hour
+        self.hourly_total = hourly_total    # float64
+        self.hourly_count = hourly_count    # int64
+        self.loaded_at = time.monotonic()
+
+    @classmethod
+    def from_features(cls, features: Dict) -> "UserSeries":
+        daily, hourly = features["daily"], features["hourly"]
+        return cls(
+            np.array([row["date"] for row in daily], dtype="datetime64[D]"),
+            np.array([row["total"] for row in daily], dtype=np.float64),
+            np.array([row["count"] for row in daily], dtype=np.int64),
+            np.array([row["hour"] for row in hourly], dtype="datetime64[s]"),
+            np.array([row["total"] for row in hourly], dtype=np.float64),
+            np.array([row["count"] for row in hourly], dtype=np.int64)
+        )
+
+    @property
+    def high_water(self) -> Optional[np.datetime64]:
+        return self.hours[-1] if len(self.hours) else None
+
+    @property
+    def rows(self) -> int:
+        return len(self.days) + len(self.hours)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(array.nbytes for array in (
+            self.days, self.daily_total, self.daily_count,
+            self.hours, self.hourly_total, self.hourly_count
+        ))
+
+    def merge(self, delta: "UserSeries", window_start: np.datetime64) -> "UserSeries":
+        """
+        Replace everything from the delta's first hour/day onwards with the delta and
+        drop what fell out of the window. Returns a new object, so a caller still
+        holding the previous series is not affected.
+        """
+        day_cut = np.searchsorted(self.days, delta.days[0]) if len(delta.days) else len(self.days)
+        hour_cut = np.searchsorted(self.hours, delta.hours[0]) if len(delta.hours) else len(self.hours)
+        day_from = np.searchsorted(self.days, window_start.astype("datetime64[D]"))
+        hour_from = np.searchsorted(self.hours, window_start.astype("datetime64[s]"))
+
+        merged = UserSeries(
+            np.concatenate([self.days[day_from:day_cut], delta.days]),
+            np.concatenate([self.daily_total[day_from:day_cut], delta.daily_total]),
+            np.concatenate([self.daily_count[day_from:day_cut], delta.daily_count]),
+            np.concatenate([self.hours[hour_from:hour_cut], delta.hours]),
+            np.concatenate([self.hourly_total[hour_from:hour_cut], delta.hourly_total]),
+            np.concatenate([self.hourly_count[hour_from:hour_cut], delta.hourly_count])
+        )
+        merged.loaded_at = self.loaded_at
+        return merged
+
+
+class SeriesCache:
+    """
+    LRU map of (user, window) -> UserSeries bounded by the total bytes of the arrays.
+
+    Entries older than full_refresh_seconds are reloaded in full so readings that
+    arrive late (older than the high-water mark) are eventually picked up.
+    """
+
+    def __init__(self, max_bytes: int, full_refresh_seconds: float):
+        self.max_bytes = max_bytes
+        self.full_refresh_seconds = full_refresh_seconds
+        self._entries: "OrderedDict[Hashable, UserSeries]" = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.bytes_fetched = 0
+        self.bytes_saved = 0
+
+    def get(self, key: Hashable) -> Optional[UserSeries]:
+        """القيمة المتخزنة لو لسه صالحة للتحديث الجزئي (من غير ما تتحسب hit أو miss)"""
+        series = self._entries.get(key)
+        if series is None:
+            return None
+        if time.monotonic() - series.loaded_at >= self.full_refresh_seconds:
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return series
+
+    def put(self, key: Hashable, series: UserSeries):
+        self._remove(key)
+        if series.nbytes > self.max_bytes:
+            return
+        self._entries[key] = series
+        self.bytes += series.nbytes
+        while self.bytes > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+
+    def record(self, incremental: bool, fetched: int, saved: int = 0):
+        if incremental:
+            self.hits += 1
+        else:
+            self.misses += 1
+        self.bytes_fetched += fetched
+        self.bytes_saved += saved
+
+    def _remove(self, key: Hashable):
+        series = self._entries.pop(key, None)
+        if series is not None:
+            self.bytes -= series.nbytes
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "bytes_fetched": self.bytes_fetched,
+            "bytes_saved": self.bytes_saved
+        }
+
+
+series_cache = SeriesCache(
+    max_bytes=settings.series_cache_max_bytes,
+    full_refresh_seconds=settings.series_cache_full_refresh_seconds
+)
@@ -0,0 +1,70 @@
+"""
+Single-flight coalescing: concurrent (and nested) callers asking for the same key
+share one running coroutine instead of each refetching and refitting.
+"""
+import asyncio
+import time
+from typing import Awaitable, Callable, Dict, Hashable, Tuple, TypeVar
+from ..config import settings
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """
+    do(key, fn) runs fn() once per key while it is in flight; every other caller
+    awaits the same task. A successful result stays shareable for linger_seconds
+    after it completes, so the requests a dashboard fires together reuse it even
+    if they do not overlap exactly. Failures are never reused.
+
+    The shared task is shielded: a caller that disconnects does not cancel the
+    work the other callers are waiting on. Callers must treat results as read-only.
+    """
+
+    def __init__(self, linger_seconds: float = 0.0):
+        self.linger_seconds = linger_seconds
+        self._calls: Dict[Hashable, Tuple[asyncio.Future, float]] = {}
+        self.executed = 0
+        self.shared = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        entry = self._calls.get(key)
+        if entry is not None:
+            task, expires_at = entry
+            if not task.done() or expires_at > time.monotonic():
+                self.shared += 1
+                return await asyncio.shield(task)
+
+        task = asyncio.ensure_future(fn())
+        self._calls[key] = (task, float("inf"))
+        self.executed += 1
+        task.add_done_callback(lambda done: self._finished(key, done))
+        return await asyncio.shield(task)
+
+    def _finished(self, key: Hashable, task: asyncio.Future):
+        entry = self._calls.get(key)
+        if entry is None or entry[0] is not task:
+            return
+        if task.cancelled() or task.exception() is not None or self.linger_seconds <= 0:
+            del self._calls[key]
+            return
+        self._calls[key] = (task, time.monotonic() + self.linger_seconds)
+        asyncio.get_running_loop().call_later(self.linger_seconds, self._expire, key, task)
+
+    def _expire(self, key: Hashable, task: asyncio.Future):
+        entry = self._calls.get(key)
+        if entry is not None and entry[0] is task:
+            del self._calls[key]
+
+    def stats(self) -> dict:
+        calls = self.executed + self.shared
+        return {
+            "in_flight": sum(1 for task, _ in self._calls.values() if not task.done()),
+            "executed": self.executed,
+            "shared": self.shared,
+            "shared_ratio": round(self.shared / calls, 4) if calls else 0.0
+        }
+
+
+# مشترك بين كل الـ services عشان الـ nested calls (recommendations -> analysis) تتجمع برضه
+single_flight = SingleFlight(linger_seconds=settings.single_flight_linger_seconds)
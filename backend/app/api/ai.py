@@ -1,35 +1,46 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from typing import Optional
 import httpx
-from ..config import settings
 from ..utils.dependencies import get_current_user
+from ..utils.http_client import ai_client, CircuitOpenError
+from ..services.ai_insights import get_fresh_insight
 
 router = APIRouter()
 
 
-@router.get("/analysis")
-async def get_consumption_analysis(current_user: dict = Depends(get_current_user)):
-    """Get AI analysis of consumption patterns"""
+async def _ask_ai_service(path: str, params: dict):
+    """GET من الـ AI service عن طريق الـ client المشترك، وأي فشل = 503"""
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{settings.ai_service_url}/api/v1/analysis",
-                params={"user_id": current_user["id"]},
-                timeout=30.0
-            )
-            if response.status_code == 200:
-                return response.json()
-            else:
-                raise HTTPException(
-                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-                    detail="AI service unavailable"
-                )
+        response = await ai_client.get(path, params=params)
+    except CircuitOpenError:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="AI service unavailable",
+            headers={"Retry-After": str(max(1, round(ai_client.breaker.retry_after())))}
+        )
     except httpx.RequestError:
         raise HTTPException(
             status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
             detail="AI service unavailable"
         )
 
+    if response.status_code == 200:
+        return response.json()
+    raise HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="AI service unavailable"
+    )
+
+
+@router.get("/analysis")
+async def get_consumption_analysis(current_user: dict = Depends(get_current_user)):
+    """Get AI analysis of consumption patterns"""
+    # النتيجة المحسوبة بالليل لو لسه صالحة، وإلا نحسبها دلوقتي
+    insight = await get_fresh_insight(current_user["id"], "analysis")
+    if insight is not None:
+        return insight
+    return await _ask_ai_service("/api/v1/analysis", {"user_id": current_user["id"]})
+
 
 @router.get("/prediction")
 async def get_consumption_prediction(
@@ -37,70 +48,25 @@ async def get_consumption_prediction(
     current_user: dict = Depends(get_current_user)
 ):
     """Get AI prediction of future consumption"""
-    try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{settings.ai_service_url}/api/v1/prediction",
-                params={"user_id": current_user["id"], "days": days},
-                timeout=30.0
-            )
-            if response.status_code == 200:
-                return response.json()
-            else:
-                raise HTTPException(
-                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-                    detail="AI service unavailable"
-                )
-    except httpx.RequestError:
-        raise HTTPException(
-            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-            detail="AI service unavailable"
-        )
+    insight = await get_fresh_insight(current_user["id"], "prediction", prediction_days=days)
+    if insight is not None:
+        return insight
+    return await _ask_ai_service("/api/v1/prediction", {"user_id": current_user["id"], "days": days})
 
 
 @router.get("/plan-exhaustion")
 async def get_plan_exhaustion_prediction(current_user: dict = Depends(get_current_user)):
     """Get AI prediction of when plan will be exhausted"""
-    try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{settings.ai_service_url}/api/v1/plan-exhaustion",
-                params={"user_id": current_user["id"]},
-                timeout=30.0
-            )
-            if response.status_code == 200:
-                return response.json()
-            else:
-                raise HTTPException(
-                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-                    detail="AI service unavailable"
-                )
-    except httpx.RequestError:
-        raise HTTPException(
-            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-            detail="AI service unavailable"
-        )
+    insight = await get_fresh_insight(current_user["id"], "plan_exhaustion")
+    if insight is not None:
+        return insight
+    return await _ask_ai_service("/api/v1/plan-exhaustion", {"user_id": current_user["id"]})
 
 
 @router.get("/recommendations")
 async def get_energy_recommendations(current_user: dict = Depends(get_current_user)):
     """Get AI-generated energy-saving recommendations"""
-    try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{settings.ai_service_url}/api/v1/recommendations",
-                params={"user_id": current_user["id"]},
-                timeout=30.0
-            )
-            if response.status_code == 200:
-                return response.json()
-            else:
-                raise HTTPException(
-                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-                    detail="AI service unavailable"
-                )
-    except httpx.RequestError:
-        raise HTTPException(
-            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-            detail="AI service unavailable"
-        )
+    insight = await get_fresh_insight(current_user["id"], "recommendations")
+    if insight is not None:
+        return insight
+    return await _ask_ai_service("/api/v1/recommendations", {"user_id": current_user["id"]})
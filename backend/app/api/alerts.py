@@ -1,14 +1,17 @@
-from fastapi import APIRouter, Depends, Query, HTTPException
+from fastapi import APIRouter, Depends, Query, HTTPException, Request
 from typing import List
 from datetime import datetime
 from ..database import get_database
 from ..schemas.alert import AlertResponse
 from ..utils.dependencies import get_current_user
+from ..utils.response_cache import cached_response
 
 router = APIRouter()
 
 @router.get("", response_model=List[AlertResponse])
+@cached_response("alerts.list", response_model=List[AlertResponse])
 async def get_alerts(
+    request: Request,
     limit: int = Query(50, le=200),
     current_user: dict = Depends(get_current_user)
 ):
@@ -1,44 +1,60 @@
+import json
+import logging
 from datetime import datetime, timedelta
-from fastapi import APIRouter, Depends, HTTPException, status, Query
-from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+from fastapi.security import HTTPAuthorizationCredentials
+from pydantic import ValidationError
+from typing import Optional
+from ..config import settings
 from ..database import get_database
-from ..schemas.consumption import ConsumptionCreate, ConsumptionResponse
-from ..utils.dependencies import get_current_user
-from ..services.plan_service import deduct_quota_and_check_alerts
+from ..schemas.consumption import ConsumptionCreate, ConsumptionResponse, ConsumptionBatchCreate, ConsumptionBatchResponse, ConsumptionHistoryPage
+from ..utils.dependencies import get_current_user, get_ingest_principal, ensure_device_allowed
+from ..utils.response_cache import cached_response
+from ..services.ingest_service import new_reading, normalize_timestamp, persist_readings
+from ..services.ingest_buffer import ingest_buffer
+from ..services.anomaly_detector import anomaly_detector
+from ..services.reconciliation import sum_consumption_since
+from ..services.consumption_store import decode_cursor, encode_cursor, iter_readings
 
 router = APIRouter()
 
+logger = logging.getLogger(__name__)
+
 # --- 1. إحصائيات الاستهلاك (الرسم البياني) ---
 
 @router.get("/daily")
-async def get_daily_consumption(current_user: dict = Depends(get_current_user)):
+@cached_response("consumption.daily")
+async def get_daily_consumption(request: Request, current_user: dict = Depends(get_current_user)):
     """حساب الاستهلاك اليومي لآخر 7 أيام - يعتمد عليه الرسم البياني"""
     db = get_database()
-    seven_days_ago = datetime.utcnow() - timedelta(days=7)
-    
+    first_day = (datetime.utcnow() - timedelta(days=6)).strftime("%Y-%m-%d")
+
+    # بنقرا من التجميعات اليومية (صف لكل جهاز في اليوم) بدل القراءات الخام
     pipeline = [
         {
             "$match": {
                 "user_id": current_user["id"],
-                "timestamp": {"$gte": seven_days_ago}
+                "date": {"$gte": first_day}
             }
         },
         {
             "$group": {
-                "_id": { "$dateToString": { "format": "%Y-%m-%d", "date": "$timestamp" } },
-                "total": { "$sum": "$consumption_value" }
+                "_id": "$date",
+                "total": { "$sum": "$total" }
             }
         },
         { "$sort": { "_id": 1 } }
     ]
     
-    cursor = db.consumption.aggregate(pipeline)
+    cursor = db.consumption_daily.aggregate(pipeline)
     result = await cursor.to_list(length=7)
     return [{"date": item["_id"], "value": round(item["total"], 2)} for item in result]
 
 
 @router.get("/summary")
-async def get_consumption_summary(current_user: dict = Depends(get_current_user)):
+@cached_response("consumption.summary")
+async def get_consumption_summary(request: Request, current_user: dict = Depends(get_current_user)):
     """حساب إجمالي الاستهلاك للباقة النشطة (تصفير العداد)"""
     db = get_database()
     subscription = await db.plan_subscriptions.find_one({
@@ -49,20 +65,11 @@ async def get_consumption_summary(current_user: dict = Depends(get_current_user)
     if not subscription:
         return {"total_consumption": 0.0, "remaining_quota": 0.0, "message": "No active plan"}
 
-    start_date = subscription["start_date"]
-    pipeline = [
-        {
-            "$match": {
-                "user_id": current_user["id"],
-                "timestamp": {"$gte": start_date}
-            }
-        },
-        {"$group": {"_id": None, "total": {"$sum": "$consumption_value"}}}
-    ]
-    
-    cursor = db.consumption.aggregate(pipeline)
-    result = await cursor.to_list(length=1)
-    total = result[0]["total"] if result else 0.0
+    # العداد بيتحدث مع كل خصم للكوتا، فمش محتاجين نجمع القراءات
+    total = subscription.get("consumed_since_start")
+    if total is None:
+        # اشتراك قديم قبل العداد - الـ reconciliation هيملاه
+        total = await sum_consumption_since(current_user["id"], subscription["start_date"])
     
     return {
         "total_consumption": float(total),
@@ -75,144 +82,285 @@ async def get_consumption_summary(current_user: dict = Depends(get_current_user)
 @router.post("", response_model=ConsumptionResponse, status_code=status.HTTP_201_CREATED)
 async def create_consumption(
     consumption_data: ConsumptionCreate,
-    current_user: dict = Depends(get_current_user)
+    current_user: dict = Depends(get_ingest_principal)
 ):
     """العملية الموحدة: تسجيل الاستهلاك، تحديث حالة الجهاز، وخصم الرصيد"""
-    db = get_database()
+    ensure_device_allowed(current_user, consumption_data.device_id)
     user_id = current_user["id"]
-    timestamp = datetime.utcnow() 
+    timestamp = datetime.utcnow()
+    consumption_dict = new_reading(user_id, consumption_data.device_id, consumption_data.consumption_value, timestamp)
+
+    if settings.ingest_write_behind_enabled:
+        # تحديث الجهاز + حفظ السجل + خصم الكوتا بيتعملوا مجمّعين في الـ flush الجاي
+        if not ingest_buffer.offer(consumption_dict):
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Ingestion queue is full, retry later",
+                headers={"Retry-After": "1"}
+            )
+    else:
+        await persist_readings([consumption_dict])
+
+    # كشف الـ spikes في الذاكرة (O(1))، والتنبيه نفسه بيتكتب في الخلفية
+    if settings.anomaly_detection_enabled:
+        anomaly_detector.observe(consumption_dict)
+
+    return ConsumptionResponse(
+        id=str(consumption_dict["_id"]),
+        device_id=consumption_dict["device_id"],
+        user_id=user_id,
+        consumption_value=consumption_dict["consumption_value"],
+        timestamp=timestamp
+    )
 
-    # 1. تحديد حالة الجهاز (Active لو القيمة > 0)
-    status_active = consumption_data.consumption_value > 0
 
-    # 2. تحديث جدول الأجهزة (أو إنشاؤه لو أول مرة)
-    await db.devices.update_one(
-        {"device_id": consumption_data.device_id, "user_id": user_id},
-        {
-            "$set": {
-                "last_seen": timestamp,
-                "is_active": status_active,
-                "value": consumption_data.consumption_value
-            },
-            "$setOnInsert": {
-                "device_name": f"Device {consumption_data.device_id}",
-                "created_at": timestamp
-            }
-        },
-        upsert=True # دي بتغنيك عن الـ if/else وتعمل insert لو مش موجود
-    )
+@router.post("/batch", response_model=ConsumptionBatchResponse, status_code=status.HTTP_201_CREATED)
+async def create_consumption_batch(
+    batch: ConsumptionBatchCreate,
+    current_user: dict = Depends(get_ingest_principal)
+):
+    """تسجيل مجموعة قراءات (من جهاز واحد أو أكثر) بعملية insert واحدة وخصم واحد للكوتا"""
+    if not batch.readings:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Batch must contain at least one reading"
+        )
+    if len(batch.readings) > settings.consumption_batch_max_size:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"Batch exceeds {settings.consumption_batch_max_size} readings"
+        )
+    for device_id in {reading.device_id for reading in batch.readings}:
+        ensure_device_allowed(current_user, device_id)
 
-    # 3. حفظ السجل الخام (التاريخ)
-    consumption_dict = {
-        "device_id": consumption_data.device_id,
-        "user_id": user_id,
-        "consumption_value": consumption_data.consumption_value,
-        "timestamp": timestamp
-    }
-    result = await db.consumption.insert_one(consumption_dict)
-    
-    # 4. خصم الكوتا وفحص التنبيهات
-    await deduct_quota_and_check_alerts(user_id, consumption_data.consumption_value)
-    
-    consumption_dict["id"] = str(result.inserted_id)
-    return consumption_dict
+    user_id = current_user["id"]
+    received_at = datetime.utcnow()
 
+    # القراءات المتجمعة على الجهاز بتيجي بتوقيتها، ولو مفيش توقيت نستخدم وقت الاستلام
+    readings = [
+        new_reading(user_id, reading.device_id, reading.consumption_value,
+                    normalize_timestamp(reading.timestamp, received_at))
+        for reading in batch.readings
+    ]
+    totals = await persist_readings(readings, received_at=received_at)
+    if settings.anomaly_detection_enabled:
+        for reading in sorted(readings, key=lambda reading: reading["timestamp"]):
+            anomaly_detector.observe(reading)
+
+    return ConsumptionBatchResponse(
+        inserted=len(readings),
+        devices=len({reading["device_id"] for reading in readings}),
+        total_consumption=round(totals.get(user_id, 0.0), 4)
+    )
 
-@router.get("/monthly")
 
-async def get_monthly_consumption(current_user: dict = Depends(get_current_user)):
+@router.websocket("/ws")
+async def stream_consumption(
+    websocket: WebSocket,
+    device_key: Optional[str] = Query(None),
+    token: Optional[str] = Query(None)
+):
+    """
+    اتصال دائم للعدادات: كل frame فيه قراءة (أو list قراءات) بنفس شكل create_consumption.
+
+    Protocol:
+      server -> {"type": "ready", "window": N}        max frames in flight before an ack
+      client -> {"seq": 1, "device_id": "...", "consumption_value": 1.2}
+      server -> {"type": "ack", "seq": 1}              cumulative: every frame up to seq is queued
+      server -> {"type": "error", "seq": 1, "detail": "...", "accepted": n}
+
+    An error frame means the frame was not acknowledged, except for its first
+    `accepted` readings, which were queued and must not be sent again (n is only
+    non-zero when the queue filled partway through a multi-reading frame).
+
+    seq is an increasing integer per connection. A frame whose seq is more than N
+    past the last ack the server sent (or past the first seq, before any ack) is
+    outside the window: it is answered with an error frame and not stored.
+
+    Readings go through the same write-behind queue as create_consumption. When the
+    queue is full the server stops reading frames until there is room, which pushes
+    back on the device over TCP instead of dropping data.
+    """
+    # المصادقة مرة واحدة للاتصال كله: مفتاح الجهاز أو JWT (في الـ query أو الـ headers)
+    device_key = device_key or websocket.headers.get("x-device-key")
+    authorization = websocket.headers.get("authorization", "")
+    if not token and authorization.lower().startswith("bearer "):
+        token = authorization[7:]
+    credentials = HTTPAuthorizationCredentials(scheme="Bearer", credentials=token) if token else None
+
+    try:
+        principal = await get_ingest_principal(x_device_key=device_key, credentials=credentials)
+    except HTTPException as e:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason=str(e.detail))
+        return
+
+    await websocket.accept()
+    await websocket.send_json({"type": "ready", "window": settings.ws_ingest_window})
+
+    user_id = principal["id"]
+    acked_seq = None
+    pending = 0
+    # أول الـ window: آخر seq اتبعتله ack (أو قبل أول frame لحد ما يتبعت ack)
+    window_base = None
+
+    async def send_ack():
+        nonlocal pending, window_base
+        await websocket.send_json({"type": "ack", "seq": acked_seq})
+        pending = 0
+        if isinstance(acked_seq, int):
+            window_base = acked_seq
+
+    async def send_error(seq, detail: str, accepted: int = 0):
+        # الـ frames اللي قبل كده اتقبلت: الـ ack بتاعها يوصل قبل الخطأ
+        if pending:
+            await send_ack()
+        await websocket.send_json({"type": "error", "seq": seq, "detail": detail, "accepted": accepted})
+
+    try:
+        while True:
+            message = await websocket.receive_text()
+            seq = None
+            try:
+                frame = json.loads(message)
+                items = frame if isinstance(frame, list) else [frame]
+                seq = items[-1].get("seq") if items else None
+                readings = []
+                for item in items:
+                    item.setdefault("device_id", principal.get("device_id"))
+                    data = ConsumptionCreate(**item)
+                    ensure_device_allowed(principal, data.device_id)
+                    readings.append(new_reading(user_id, data.device_id, data.consumption_value, datetime.utcnow()))
+            except (ValueError, TypeError, AttributeError, ValidationError, HTTPException) as e:
+                await send_error(seq, e.detail if isinstance(e, HTTPException) else str(e))
+                continue
+
+            if isinstance(seq, int):
+                if window_base is None:
+                    window_base = seq - 1
+                if seq - window_base > settings.ws_ingest_window:
+                    await send_error(seq, f"Frame is outside the flow-control window of {settings.ws_ingest_window}")
+                    continue
+
+            if settings.ingest_write_behind_enabled:
+                accepted = 0
+                for reading in readings:
+                    # الانتظار هنا هو الـ flow control: مش بنقرا frames جديدة لحد ما الطابور يفضى
+                    if not await ingest_buffer.put(reading, timeout=settings.ws_ingest_put_timeout_seconds):
+                        break
+                    accepted += 1
+                    if settings.anomaly_detection_enabled:
+                        anomaly_detector.observe(reading)
+                if accepted < len(readings):
+                    # أول accepted قراءة اتحطت في الطابور وهتتكتب: العميل يبعت الباقي بس
+                    await send_error(seq, "Ingestion queue is full", accepted)
+                    continue
+            else:
+                try:
+                    await persist_readings(readings)
+                except Exception:
+                    logger.exception("WebSocket ingest: storing frame %s for user %s failed", seq, user_id)
+                    await send_error(seq, "Failed to store readings")
+                    continue
+                if settings.anomaly_detection_enabled:
+                    for reading in readings:
+                        anomaly_detector.observe(reading)
+
+            acked_seq = seq
+            pending += 1
+            if pending >= settings.ws_ingest_ack_every:
+                await send_ack()
+    except WebSocketDisconnect:
+        pass
 
-    """حساب الاستهلاك الشهري لآخر 6 أشهر"""
 
+@router.get("/monthly")
+@cached_response("consumption.monthly")
+async def get_monthly_consumption(request: Request, current_user: dict = Depends(get_current_user)):
+    """حساب الاستهلاك الشهري لآخر 6 أشهر"""
     db = get_database()
 
-    pipeline = [
+    months = await db.consumption_monthly.find(
+        {"user_id": current_user["id"]},
+        {"_id": 0, "month": 1, "total": 1}
+    ).sort("month", -1).limit(6).to_list(length=6)
 
-        { "$match": { "user_id": current_user["id"] } },
+    return [{"month": item["month"], "value": round(item["total"], 2)} for item in reversed(months)]
 
-        {
-
-            "$group": {
 
-                "_id": { "$dateToString": { "format": "%Y-%m", "date": "$timestamp" } },
+@router.get("/history", response_model=ConsumptionHistoryPage)
+async def get_consumption_history(
+    device_id: Optional[str] = Query(None),
+    start: Optional[datetime] = Query(None),
+    end: Optional[datetime] = Query(None),
+    limit: Optional[int] = Query(None, ge=1),
+    cursor: Optional[str] = Query(None),
+    format: str = Query("json", pattern="^(json|ndjson)$"),
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    سجل القراءات الخام من الأحدث للأقدم.
+
+    json: صفحة واحدة (limit افتراضي 100) ومعاها next_cursor للصفحة اللي بعدها.
+    ndjson: قراءة في كل سطر، بتتبعت أول بأول من الـ cursor من غير ما تتجمع في الذاكرة.
+    """
+    before = None
+    if cursor:
+        try:
+            before = decode_cursor(cursor)
+        except ValueError:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+    page_size = limit if format == "ndjson" else min(limit or 100, settings.history_page_max_size)
+    readings = iter_readings(
+        current_user["id"], device_id, start, end,
+        limit=page_size,
+        before=before,
+        batch_size=settings.history_batch_size
+    )
 
-                "total": { "$sum": "$consumption_value" }
+    if format == "ndjson":
+        async def lines():
+            async for reading in readings:
+                reading["timestamp"] = reading["timestamp"].isoformat()
+                yield json.dumps(reading, separators=(",", ":")) + "\n"
 
-            }
+        return StreamingResponse(lines(), media_type="application/x-ndjson")
 
-        },
+    try:
+        items = [reading async for reading in readings]
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
 
-        { "$sort": { "_id": 1 } }
+    return ConsumptionHistoryPage(
+        items=[ConsumptionResponse(**item) for item in items],
+        next_cursor=encode_cursor(items[-1]) if len(items) == page_size else None
+    )
 
-    ]
 
-   
-
-    cursor = db.consumption.aggregate(pipeline)
-
-    result = await cursor.to_list(length=6)
-
-    return [{"month": item["_id"], "value": round(item["total"], 2)} for item in result]
-
-
-# @router.get("", response_model=List[ConsumptionResponse])
-# async def get_consumption_history(
-#     device_id: Optional[str] = Query(None),
-#     limit: int = Query(50),
-#     current_user: dict = Depends(get_current_user)
-# ):
-#     """جلب قائمة آخر القراءات"""
-#     db = get_database()
-#     query = {"user_id": current_user["id"]}
-#     if device_id: query["device_id"] = device_id
-        
-#     cursor = db.consumption.find(query).sort("timestamp", -1).limit(limit)
-#     consumptions = await cursor.to_list(length=limit)
-#     return [
-#         ConsumptionResponse(
-#             id=str(c["_id"]),
-#             device_id=c["device_id"],
-#             user_id=c["user_id"],
-#             consumption_value=c["consumption_value"],
-#             timestamp=c["timestamp"] 
-#         ) for c in consumptions
-#     ]
 @router.get("/per-device-daily")
 async def get_total_consumption_per_day_per_device(
+    days: Optional[int] = Query(None, ge=1),
     current_user: dict = Depends(get_current_user)
 ):
     """حساب إجمالي الاستهلاك لكل يوم لكل جهاز على حدة"""
     db = get_database()
-    
-    pipeline = [
-        # 1. تصفية البيانات الخاصة بالمستخدم الحالي فقط
-        { "$match": { "user_id": current_user["id"] } },
-        
-        # 2. تجميع البيانات بناءً على (تاريخ اليوم + الـ device_id)
-        {
-            "$group": {
-                "_id": {
-                    "date": { "$dateToString": { "format": "%Y-%m-%d", "date": "$timestamp" } },
-                    "device_id": "$device_id"
-                },
-                "total_daily_value": { "$sum": "$consumption_value" }
-            }
-        },
-        
-        # 3. ترتيب النتائج حسب التاريخ (الأحدث أولاً) ثم اسم الجهاز
-        { "$sort": { "_id.date": -1, "_id.device_id": 1 } },
-        
-        # 4. تجميل شكل البيانات الخارجة (Projection)
+
+    # كل صف في التجميعات اليومية هو (يوم، جهاز) جاهز
+    query = {"user_id": current_user["id"]}
+    if days:
+        query["date"] = {"$gte": (datetime.utcnow() - timedelta(days=days - 1)).strftime("%Y-%m-%d")}
+
+    # ترتيب النتائج حسب التاريخ (الأحدث أولاً) ثم اسم الجهاز
+    cursor = db.consumption_daily.find(
+        query,
+        {"_id": 0, "date": 1, "device_id": 1, "total": 1}
+    ).sort([("date", -1), ("device_id", 1)])
+
+    return [
         {
-            "$project": {
-                "_id": 0,
-                "date": "$_id.date",
-                "device_id": "$_id.device_id",
-                "total_consumption": { "$round": ["$total_daily_value", 2] }
-            }
+            "date": item["date"],
+            "device_id": item["device_id"],
+            "total_consumption": round(item["total"], 2)
         }
+        async for item in cursor
     ]
-    
-    cursor = db.consumption.aggregate(pipeline)
-    result = await cursor.to_list(length=None)
-    return result
\ No newline at end of file
@@ -3,7 +3,8 @@ from typing import List
 from bson import ObjectId
 from bson.errors import InvalidId
 from ..database import get_database
-from ..schemas.device import DeviceCreate, DeviceResponse
+from ..schemas.device import DeviceCreate, DeviceResponse, DeviceKeyResponse
+from ..services.device_keys import device_keys
 from ..utils.dependencies import get_current_user
 from datetime import datetime, timedelta
 import pytz
@@ -113,7 +114,29 @@ async def delete_device(device_id: str, current_user: dict = Depends(get_current
     except InvalidId:
         query = {"device_id": device_id, "user_id": current_user["id"]}
         
-    result = await db.devices.delete_one(query)
-    if result.deleted_count == 0: 
+    device = await db.devices.find_one_and_delete(query)
+    if not device: 
         raise HTTPException(status_code=404, detail="Device not found")
+
+    # الجهاز اتمسح => مفتاحه يتلغي
+    await device_keys.revoke(current_user["id"], device["device_id"])
+    return {"status": "success"}
+
+# 5. إصدار مفتاح API للجهاز (بيستبدل أي مفتاح قديم)
+@router.post("/{device_id}/api-key", response_model=DeviceKeyResponse, status_code=status.HTTP_201_CREATED)
+async def issue_device_key(device_id: str, current_user: dict = Depends(get_current_user)):
+    db = get_database()
+    device = await db.devices.find_one({"device_id": device_id, "user_id": current_user["id"]})
+    if not device:
+        raise HTTPException(status_code=404, detail="Device not found")
+
+    api_key = await device_keys.issue(current_user["id"], device_id)
+    return DeviceKeyResponse(device_id=device_id, api_key=api_key, created_at=datetime.utcnow())
+
+# 6. إلغاء مفتاح الجهاز (لو اتسرق مثلاً)
+@router.delete("/{device_id}/api-key")
+async def revoke_device_key(device_id: str, current_user: dict = Depends(get_current_user)):
+    revoked = await device_keys.revoke(current_user["id"], device_id)
+    if revoked == 0:
+        raise HTTPException(status_code=404, detail="No active key for this device")
     return {"status": "success"}
\ No newline at end of file
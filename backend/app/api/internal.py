@@ -2,9 +2,17 @@ from datetime import datetime
 from fastapi import APIRouter, HTTPException, status, Query, Header, Depends
 from typing import List, Optional
 from ..database import get_database
-from ..schemas.consumption import ConsumptionResponse
+from ..schemas.consumption import ConsumptionResponse, ConsumptionFeatures, ConsumptionStats, DailySeriesBatchRequest, DailySeriesBatch
 from ..schemas.plan import PlanSubscriptionResponse
 from ..config import settings
+from ..services.consumption_store import find_readings
+from ..services.feature_service import build_consumption_features, build_daily_series_batch
+from ..services.consumption_stats import load_user_stats
+from ..services.ingest_buffer import ingest_buffer, replay_dead_letters
+from ..services.anomaly_detector import anomaly_detector
+from ..utils.dependencies import claims_cache, principal_cache
+from ..utils.response_cache import response_cache
+from ..utils.http_client import ai_client
 
 router = APIRouter()
 
@@ -32,34 +40,66 @@ async def get_consumption_by_user_id(
     _: bool = Depends(verify_service_key)
 ):
     """Internal endpoint to get consumption data by user_id"""
-    db = get_database()
-    
-    query = {"user_id": user_id}
-    
-    if device_id:
-        query["device_id"] = device_id
-    
-    if start_date:
-        query["timestamp"] = {"$gte": start_date}
-    
-    if end_date:
-        if "timestamp" in query:
-            query["timestamp"]["$lte"] = end_date
-        else:
-            query["timestamp"] = {"$lte": end_date}
-    
-    consumptions = await db.consumption.find(query).sort("timestamp", -1).limit(limit).to_list(length=limit)
-    
-    return [
-        ConsumptionResponse(
-            id=str(cons["_id"]),
-            device_id=cons["device_id"],
-            user_id=cons["user_id"],
-            consumption_value=cons["consumption_value"],
-            timestamp=cons["timestamp"]
+    readings = await find_readings(user_id, device_id, start_date, end_date, limit)
+    return [ConsumptionResponse(**reading) for reading in readings]
+
+
+@router.get("/features", response_model=ConsumptionFeatures)
+async def get_consumption_features(
+    user_id: str = Query(...),
+    days: int = Query(30, ge=1, le=366),
+    since: Optional[datetime] = Query(None),
+    _: bool = Depends(verify_service_key)
+):
+    """
+    Internal endpoint with pre-aggregated daily and hourly series for the AI service
+
+    since limits the rows to the hour/day containing it onwards, for clients that
+    already hold the older part of the window.
+    """
+    return await build_consumption_features(user_id, days, since=since)
+
+
+@router.get("/stats", response_model=ConsumptionStats)
+async def get_consumption_stats(
+    user_id: str = Query(...),
+    days: int = Query(30, ge=1, le=366),
+    _: bool = Depends(verify_service_key)
+):
+    """Internal endpoint with the user's running consumption statistics (constant-size)"""
+    if not settings.consumption_stats_enabled:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Consumption statistics are not maintained (consumption_stats_enabled is off)"
+        )
+    return await load_user_stats(user_id, days)
+
+
+@router.post("/daily-series", response_model=DailySeriesBatch)
+async def get_daily_series_batch(
+    request: DailySeriesBatchRequest,
+    _: bool = Depends(verify_service_key)
+):
+    """Internal endpoint with daily consumption totals for many users at once"""
+    if not 1 <= request.days <= 366:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="days must be between 1 and 366"
+        )
+    if len(request.user_ids) > settings.daily_series_batch_max_users:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {settings.daily_series_batch_max_users} users per request"
         )
-        for cons in consumptions
-    ]
+    return await build_daily_series_batch(list(dict.fromkeys(request.user_ids)), request.days)
+
+
+@router.get("/active-users")
+async def get_active_users(_: bool = Depends(verify_service_key)):
+    """Internal endpoint listing the users that have an active subscription"""
+    db = get_database()
+    user_ids = await db.plan_subscriptions.distinct("user_id", {"is_active": True})
+    return {"user_ids": sorted(user_ids)}
 
 
 @router.get("/subscription", response_model=PlanSubscriptionResponse)
@@ -92,3 +132,25 @@ async def get_subscription_by_user_id(
         created_at=subscription.get("created_at"),
         updated_at=subscription.get("updated_at")
     )
+
+
+@router.post("/ingest/replay-dead-letters")
+async def replay_ingest_dead_letters(
+    limit: int = Query(100, ge=1, le=1000),
+    _: bool = Depends(verify_service_key)
+):
+    """Internal endpoint that runs dead-lettered ingest flushes again (apply-once per batch)"""
+    return await replay_dead_letters(limit)
+
+
+@router.get("/cache-stats")
+async def get_cache_stats(_: bool = Depends(verify_service_key)):
+    """Internal endpoint exposing in-process cache and queue counters"""
+    return {
+        "auth_claims": claims_cache.stats(),
+        "auth_principals": principal_cache.stats(),
+        "ingest_buffer": ingest_buffer.stats(),
+        "responses": response_cache.stats(),
+        "ai_client": ai_client.stats(),
+        "anomaly_detector": anomaly_detector.stats()
+    }
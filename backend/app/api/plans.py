@@ -1,10 +1,13 @@
 from datetime import datetime, timedelta
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, status, Request, Response
 from typing import List
 from bson import ObjectId
 from ..database import get_database
 from ..schemas.plan import PlanCreate, PlanResponse, PlanSubscriptionCreate, PlanSubscriptionResponse
+from ..services.plan_catalog import plan_catalog
 from ..utils.dependencies import get_current_user
+from ..utils.http_cache import etag_matches, not_modified
+from ..utils.response_cache import cached_response, response_cache
 
 router = APIRouter()
 
@@ -22,6 +25,9 @@ async def create_plan(plan_data: PlanCreate):
     
     result = await db.plans.insert_one(plan_dict)
     plan_dict["_id"] = result.inserted_id
+
+    # تحديث كاش الباقات هنا وفي باقي الـ workers
+    await plan_catalog.invalidate()
     
     return PlanResponse(
         id=str(plan_dict["_id"]),
@@ -32,11 +38,16 @@ async def create_plan(plan_data: PlanCreate):
     )
 
 @router.get("/available", response_model=List[PlanResponse])
-async def get_available_plans():
+async def get_available_plans(request: Request, response: Response):
     """Get all available energy plans"""
-    db = get_database()
-    plans = await db.plans.find().to_list(length=100)
-    
+    plans = await plan_catalog.all_plans()
+
+    # الموبايل يبعت If-None-Match وياخد 304 لو الباقات متغيرتش
+    etag = plan_catalog.etag
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    response.headers["ETag"] = etag
+
     return [
         PlanResponse(
             id=str(plan["_id"]),
@@ -64,7 +75,7 @@ async def subscribe_to_plan(
             detail="Invalid plan ID format"
         )
     
-    plan = await db.plans.find_one({"_id": plan_id})
+    plan = await plan_catalog.get(plan_id)
     if not plan:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -87,6 +98,11 @@ async def subscribe_to_plan(
         "start_date": start_date,
         "end_date": end_date,
         "remaining_quota": plan["total_quota"],
+        # حالة التنبيهات بتتحفظ على الاشتراك عشان الخصم ميحتاجش يقرأ الباقة أو التنبيهات
+        "total_quota": plan["total_quota"],
+        "alerts_fired": [],
+        # عداد الاستهلاك بيبدأ من الصفر مع كل اشتراك جديد
+        "consumed_since_start": 0.0,
         "is_active": True,
         "created_at": datetime.utcnow(),
         "updated_at": datetime.utcnow()
@@ -94,6 +110,7 @@ async def subscribe_to_plan(
     
     result = await db.plan_subscriptions.insert_one(subscription_dict)
     subscription_dict["_id"] = result.inserted_id
+    response_cache.invalidate_user(str(current_user["id"]))
     
     return PlanSubscriptionResponse(
         id=str(subscription_dict["_id"]),
@@ -108,7 +125,8 @@ async def subscribe_to_plan(
     )
 
 @router.get("/subscription", response_model=PlanSubscriptionResponse)
-async def get_current_subscription(current_user: dict = Depends(get_current_user)):
+@cached_response("plans.subscription", response_model=PlanSubscriptionResponse)
+async def get_current_subscription(request: Request, current_user: dict = Depends(get_current_user)):
     """Get current active subscription with mapping for Flutter UI"""
     db = get_database()
     
@@ -126,7 +144,7 @@ async def get_current_subscription(current_user: dict = Depends(get_current_user
         )
     
     # جلب تفاصيل الباقة الأصلية
-    plan_details = await db.plans.find_one({"_id": ObjectId(subscription["plan_id"])})
+    plan_details = await plan_catalog.get(subscription["plan_id"])
     
     # بناء الرد النهائي ليوافق الـ Schema (FastAPI) والـ UI (Flutter)
     return {
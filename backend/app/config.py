@@ -11,17 +11,85 @@ class Settings(BaseSettings):
     jwt_algorithm: str = "HS256"  # Algorithm used for JWT
     jwt_access_token_expire_minutes: int = 5000  # Token expiration time in minutes
 
+    # Authenticated principal cache
+    auth_cache_max_size: int = 10000  # Max verified tokens kept in memory
+    auth_cache_ttl_seconds: int = 300  # Keep a verified token signature (claims) this long
+    auth_principal_ttl_seconds: int = 60  # Re-check a token against the users collection after this long (bounds staleness across workers)
+
+    # Dashboard response cache
+    response_cache_max_bytes: int = 32 * 1024 * 1024  # Total encoded bodies kept in memory
+    response_cache_ttl_seconds: int = 30  # Upper bound on staleness across workers
+
+    # Device API keys
+    device_key_refresh_seconds: int = 30  # Reload the key map so revocations reach every worker
+
     # Backend Configuration
     backend_host: str = "0.0.0.0"  # Host for the backend server
     backend_port: int = 8000  # Port for the backend server
 
     # AI Service Configuration
     ai_service_url: str = "http://localhost:8001"  # URL for the AI service
+    ai_client_max_connections: int = 100  # Connections to the AI service per worker
+    ai_client_max_keepalive: int = 20  # Idle connections kept open for reuse
+    ai_client_keepalive_expiry_seconds: float = 30.0  # Close idle connections after this long
+    ai_client_http2: bool = False  # Needs the h2 package (pip install httpx[http2])
+    ai_client_connect_timeout_seconds: float = 2.0  # Connect timeout per attempt
+    ai_client_deadline_seconds: float = 15.0  # Total budget per call, retries included
+    ai_client_retries: int = 2  # Extra attempts for GETs on connection errors and 502/503/504
+    ai_client_breaker_threshold: int = 5  # Consecutive failures before failing fast
+    ai_client_breaker_reset_seconds: float = 15.0  # How long to fail fast before a trial call
 
     # Device status timings (seconds)
     device_timeout_seconds: int = 120  # Timeout for marking devices as inactive
     device_status_interval_seconds: int = 30  # Interval for checking device status
 
+    # Consumption ingestion
+    consumption_storage_mode: str = "documents"  # Raw reading layout: documents, buckets or timeseries
+    consumption_stats_enabled: bool = False  # Maintain consumption_stats at ingest; only the AI service's analysis_source="stats" reads it (run scripts.backfill_rollups after enabling)
+    consumption_batch_max_size: int = 5000  # Max readings accepted by one batch request
+    ingest_write_behind_enabled: bool = True  # Acknowledge readings once queued and persist them in bulk
+    ingest_queue_max_size: int = 20000  # Max queued readings before clients get 503
+    ingest_flush_interval_ms: int = 250  # Flush the queue at least this often
+    ingest_flush_max_batch: int = 1000  # Flush as soon as this many readings are queued
+    ingest_flush_max_attempts: int = 6  # Tries per flush before the batch goes to ingest_dead_letter
+    ingest_flush_retry_base_ms: int = 500  # Wait before the first retry, doubled on each retry
+    ingest_flush_retry_max_ms: int = 5000  # Cap on the wait between retries
+    ingest_writer_heartbeat_seconds: int = 60  # How often a flushing buffer refreshes its writer in ingest_writers
+    ingest_writer_retire_seconds: int = 24 * 3600  # Writers idle this long (and with no dead letters) lose their applied_seq marks
+    ingest_writer_prune_interval_seconds: int = 3600  # How often retired writers are pruned (0 disables)
+    ws_ingest_window: int = 32  # Frames a streaming device may send before waiting for an ack
+    ws_ingest_ack_every: int = 1  # Send a cumulative ack after this many frames
+    ws_ingest_put_timeout_seconds: float = 5.0  # How long a frame may wait for queue space
+
+    # Streaming anomaly detection at ingest
+    anomaly_detection_enabled: bool = True  # Score every ingested reading against its device's running mean
+    anomaly_ewma_alpha: float = 0.05  # Weight of the newest reading in the running mean/variance
+    anomaly_z_threshold: float = 4.0  # Standard deviations above the mean that count as a spike
+    anomaly_warmup_readings: int = 30  # Readings per device before spikes are flagged
+    anomaly_min_std_ratio: float = 0.1  # Floor for the standard deviation, as a fraction of the mean
+    anomaly_alert_cooldown_seconds: int = 3600  # At most one anomaly alert per device in this window
+    anomaly_checkpoint_interval_seconds: int = 60  # How often detector state is saved to MongoDB
+
+    # Consumption history
+    history_page_max_size: int = 1000  # Max readings in one JSON history page
+    history_batch_size: int = 1000  # Documents fetched per MongoDB round trip while streaming
+    daily_series_batch_max_users: int = 2000  # Max users in one internal daily-series request
+
+    # Subscription counter reconciliation
+    reconcile_interval_seconds: int = 3600  # How often consumed_since_start is checked against raw readings (0 disables)
+    reconcile_inflight_timeout_seconds: int = 3600  # In-flight ingest tags older than this belong to lost batches
+
+    # Precomputed AI insights (ai_insights collection)
+    ai_insights_run_hour_utc: int = 2  # Hour of the nightly precompute run (-1 disables)
+    ai_insights_concurrency: int = 4  # Users computed by the AI service at the same time during the run
+    ai_insights_max_age_seconds: int = 26 * 3600  # Serve a stored insight for at most this long
+    ai_insights_max_data_lag_seconds: int = 24 * 3600  # ...and while the user's data is at most this far past its high-water mark
+    ai_insights_prediction_days: int = 7  # Horizon of the stored prediction (other horizons are computed live)
+    ai_insights_lease_seconds: int = 12 * 3600  # Lease held by the worker running the nightly precompute (shorter than a day)
+
+    # Plan catalog cache
+    plan_catalog_ttl_seconds: int = 60  # Check the catalog version stamp after this long
+
     # Pydantic model configuration
     model_config = SettingsConfigDict(
         env_file=".env",  # Load environment variables from .env file
@@ -1,6 +1,7 @@
 from motor.motor_asyncio import AsyncIOMotorClient
 from typing import Optional, TYPE_CHECKING
 from .config import settings
+from .indexes import reconcile_indexes
 from backend.app.models.consumption import DailyConsumption  # Import the DailyConsumption model
 from backend.app.models.base import Base
 from sqlalchemy.orm import sessionmaker
@@ -23,15 +24,10 @@ async def connect_to_mongo():
     # Test connection
     await mongodb.client.admin.command('ping')
 
-    # Ensure important indexes for performance and uniqueness
+    # Ensure every index declared in the registry exists
     try:
         db = mongodb.client[settings.mongodb_db_name]
-        # Unique per-user device_id
-        await db.devices.create_index([("user_id", 1), ("device_id", 1)], unique=True)
-        # Index last_seen for devices to speed up active checks
-        await db.devices.create_index([("last_seen", -1)])
-        # Fast lookup of consumption by device (latest timestamp)
-        await db.consumption.create_index([("device_id", 1), ("timestamp", -1)])
+        await reconcile_indexes(db)
         print("Connected to MongoDB and ensured indexes")
     except Exception as e:
         # Log index creation errors but keep the connection (so devs can inspect logs)
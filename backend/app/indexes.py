@@ -0,0 +1,199 @@
+"""
+Single registry of every MongoDB index the backend relies on.
+
+INDEXES declares the indexes per collection. reconcile_indexes creates the missing
+ones at startup and reports indexes that exist in the database but are not declared.
+CANONICAL_QUERIES lists the query shapes each router runs so find_collscans can
+explain() them and flag any that fall back to a full collection scan.
+
+Layout-specific collections for raw readings (consumption_buckets, consumption_ts)
+are set up by services.consumption_store.ensure_layout.
+"""
+from datetime import datetime
+from typing import Dict, List
+from bson import ObjectId
+
+ASCENDING = 1
+DESCENDING = -1
+
+INDEXES: Dict[str, List[dict]] = {
+    "users": [
+        # login + get_current_user
+        {"keys": [("email", ASCENDING)]},
+        # register checks username availability
+        {"keys": [("username", ASCENDING)]},
+    ],
+    "devices": [
+        # Unique per-user device_id
+        {"keys": [("user_id", ASCENDING), ("device_id", ASCENDING)], "unique": True},
+        # Index last_seen for devices to speed up active checks
+        {"keys": [("last_seen", DESCENDING)]},
+    ],
+    "consumption": [
+        # Fast lookup of consumption by device (latest timestamp), _id breaks ties for history cursors
+        {"keys": [("device_id", ASCENDING), ("timestamp", DESCENDING), ("_id", DESCENDING)]},
+        # History pages, internal AI reads, summary fallback and reconciliation
+        {"keys": [("user_id", ASCENDING), ("timestamp", DESCENDING), ("_id", DESCENDING)]},
+    ],
+    "consumption_daily": [
+        {"keys": [("user_id", ASCENDING), ("date", ASCENDING), ("device_id", ASCENDING)], "unique": True},
+    ],
+    "consumption_monthly": [
+        {"keys": [("user_id", ASCENDING), ("month", ASCENDING)], "unique": True},
+    ],
+    "consumption_stats": [
+        # Running statistics per (user, device, month); analysis reads a user's recent months
+        {"keys": [("user_id", ASCENDING), ("month", ASCENDING), ("device_id", ASCENDING)], "unique": True},
+    ],
+    "plan_subscriptions": [
+        # Active subscription lookup on every quota deduction
+        {"keys": [("user_id", ASCENDING), ("is_active", ASCENDING)]},
+        # Scans over every active subscription: /internal/active-users, reconciliation, AI insights precompute
+        # is_active أول عشان الـ find والـ distinct من غير user_id يستخدموه
+        {
+            "keys": [("is_active", ASCENDING), ("user_id", ASCENDING)],
+            "partialFilterExpression": {"is_active": True},
+        },
+    ],
+    "alerts": [
+        # /alerts sorts newest first per user
+        {"keys": [("user_id", ASCENDING), ("created_at", DESCENDING)]},
+        # One alert per threshold per subscription cycle
+        {
+            "keys": [("subscription_id", ASCENDING), ("alert_type", ASCENDING)],
+            "unique": True,
+            "partialFilterExpression": {"subscription_id": {"$exists": True}},
+        },
+    ],
+    "device_keys": [
+        # Device API keys are resolved by hash
+        {"keys": [("key_hash", ASCENDING)], "unique": True},
+        {"keys": [("user_id", ASCENDING), ("device_id", ASCENDING)]},
+    ],
+    "device_anomaly_state": [
+        # Checkpointed detector state, one document per device
+        {"keys": [("user_id", ASCENDING), ("device_id", ASCENDING)], "unique": True},
+    ],
+    "ingest_dead_letter": [
+        # Flushes that kept failing, replayed oldest first under their own batch tag
+        {"keys": [("failed_at", ASCENDING)]},
+        {"keys": [("writer", ASCENDING), ("seq", ASCENDING)], "unique": True},
+        # Reconciliation skips users with a parked batch
+        {"keys": [("users", ASCENDING)]},
+    ],
+    "ingest_writers": [
+        # Retired writers are found by their last flush
+        {"keys": [("seen_at", ASCENDING)]},
+    ],
+    "ai_insights": [
+        # One precomputed insight document per user
+        {"keys": [("user_id", ASCENDING)], "unique": True},
+    ],
+}
+
+_SAMPLE_ID = "000000000000000000000000"
+_SAMPLE_TIME = datetime(2024, 1, 1)
+
+# شكل كل query بيتنفذ من الـ routers (القيم نفسها مش مهمة، المهم الحقول والترتيب)
+CANONICAL_QUERIES: List[dict] = [
+    {"name": "auth.login", "collection": "users", "filter": {"email": "user@example.com"}},
+    {"name": "auth.register.username", "collection": "users", "filter": {"username": "user"}},
+    {"name": "devices.list", "collection": "devices", "filter": {"user_id": _SAMPLE_ID}},
+    {"name": "devices.get", "collection": "devices", "filter": {"device_id": "meter", "user_id": _SAMPLE_ID}},
+    {"name": "devices.status_worker", "collection": "devices",
+     "filter": {"last_seen": {"$lt": _SAMPLE_TIME}, "is_active": True}},
+    {"name": "consumption.daily", "collection": "consumption_daily",
+     "filter": {"user_id": _SAMPLE_ID, "date": {"$gte": "2024-01-01"}}},
+    {"name": "consumption.monthly", "collection": "consumption_monthly",
+     "filter": {"user_id": _SAMPLE_ID}, "sort": [("month", DESCENDING)]},
+    {"name": "consumption.per_device_daily", "collection": "consumption_daily",
+     "filter": {"user_id": _SAMPLE_ID}, "sort": [("date", DESCENDING), ("device_id", ASCENDING)]},
+    {"name": "consumption.stats", "collection": "consumption_stats",
+     "filter": {"user_id": _SAMPLE_ID, "month": {"$gte": "2024-01"}}},
+    {"name": "consumption.summary", "collection": "consumption",
+     "filter": {"user_id": _SAMPLE_ID, "timestamp": {"$gte": _SAMPLE_TIME}}},
+    {"name": "consumption.history", "collection": "consumption",
+     "filter": {"user_id": _SAMPLE_ID}, "sort": [("timestamp", DESCENDING), ("_id", DESCENDING)]},
+    {"name": "consumption.history.device", "collection": "consumption",
+     "filter": {"user_id": _SAMPLE_ID, "device_id": "meter"}, "sort": [("timestamp", DESCENDING), ("_id", DESCENDING)]},
+    {"name": "consumption.history.cursor", "collection": "consumption",
+     "filter": {"user_id": _SAMPLE_ID, "$or": [
+         {"timestamp": {"$lt": _SAMPLE_TIME}},
+         {"timestamp": _SAMPLE_TIME, "_id": {"$lt": ObjectId(_SAMPLE_ID)}}
+     ]},
+     "sort": [("timestamp", DESCENDING), ("_id", DESCENDING)]},
+    {"name": "plans.subscription", "collection": "plan_subscriptions",
+     "filter": {"user_id": _SAMPLE_ID, "is_active": True}},
+    {"name": "plans.active_subscriptions", "collection": "plan_subscriptions",
+     "filter": {"is_active": True}},
+    {"name": "alerts.list", "collection": "alerts",
+     "filter": {"user_id": _SAMPLE_ID}, "sort": [("created_at", DESCENDING)]},
+    {"name": "alerts.backfill", "collection": "alerts",
+     "filter": {"user_id": _SAMPLE_ID, "created_at": {"$gte": _SAMPLE_TIME}}},
+    {"name": "ai.insights", "collection": "ai_insights", "filter": {"user_id": _SAMPLE_ID}},
+    {"name": "device_keys.resolve", "collection": "device_keys",
+     "filter": {"key_hash": "0" * 64, "revoked": False}},
+]
+
+
+def _index_signature(keys) -> tuple:
+    return tuple((field, int(direction)) for field, direction in keys)
+
+
+async def reconcile_indexes(db) -> dict:
+    """
+    Create every declared index that is missing and report the ones in the database
+    that the registry does not declare. Returns {"created": [...], "extra": [...]}.
+    """
+    created, extra = [], []
+    for collection, specs in INDEXES.items():
+        existing = await db[collection].index_information()
+        existing_keys = {_index_signature(info["key"]): name for name, info in existing.items()}
+
+        declared = set()
+        for spec in specs:
+            signature = _index_signature(spec["keys"])
+            declared.add(signature)
+            if signature in existing_keys:
+                continue
+            options = {key: value for key, value in spec.items() if key != "keys"}
+            name = await db[collection].create_index(spec["keys"], **options)
+            created.append(f"{collection}.{name}")
+
+        for signature, name in existing_keys.items():
+            if name != "_id_" and signature not in declared:
+                extra.append(f"{collection}.{name}")
+
+    if created:
+        print(f"Index registry: created {', '.join(created)}")
+    if extra:
+        print(f"Index registry: indexes not declared in the registry: {', '.join(extra)}")
+    return {"created": created, "extra": extra}
+
+
+def _plan_stages(plan) -> List[str]:
+    """كل الـ stages في الـ plan (بما فيها الـ inputStage/inputStages المتداخلة)"""
+    stages = []
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        for value in plan.values():
+            stages.extend(_plan_stages(value))
+    elif isinstance(plan, list):
+        for item in plan:
+            stages.extend(_plan_stages(item))
+    return stages
+
+
+async def find_collscans(db) -> List[str]:
+    """Explain every canonical query and return the names of those using COLLSCAN"""
+    collscans = []
+    for query in CANONICAL_QUERIES:
+        cursor = db[query["collection"]].find(query["filter"])
+        if query.get("sort"):
+            cursor = cursor.sort(query["sort"])
+        explanation = await cursor.explain()
+        winning_plan = explanation.get("queryPlanner", {}).get("winningPlan", {})
+        if "COLLSCAN" in _plan_stages(winning_plan):
+            collscans.append(query["name"])
+    return collscans
@@ -2,6 +2,15 @@ from fastapi import FastAPI, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from .database import connect_to_mongo, close_mongo_connection, get_database
 from .api import auth, users, devices, consumption, plans, alerts, ai, internal
+from .services.ingest_buffer import WRITER_PRUNE_LEASE, ingest_buffer, prune_writer_marks
+from .services.plan_catalog import plan_catalog
+from .services.device_keys import device_keys
+from .services.anomaly_detector import anomaly_detector
+from .services.reconciliation import RECONCILE_LEASE, reconcile_subscription_totals
+from .services.leases import acquire_lease
+from .services.ai_insights import AI_INSIGHTS_LEASE, precompute_insights, seconds_until_next_run
+from .services.consumption_store import ensure_layout
+from .utils.http_client import ai_client
 
 app = FastAPI(
     title="Smart Energy Management System",
@@ -42,6 +51,10 @@ async def cors_and_private_network_fix(request: Request, call_next):
 @app.on_event("startup")
 async def startup_event():
     await connect_to_mongo()
+    await ensure_layout(get_database())
+    await plan_catalog.load()
+    await device_keys.load()
+    device_keys.start()
 
     # Start background task to mark stale devices as inactive
     import asyncio
@@ -70,18 +83,89 @@ async def startup_event():
 
     app.state.device_status_task = asyncio.create_task(device_status_worker())
 
+    # Periodically fix drift between consumed_since_start and the raw readings
+    async def reconciliation_worker():
+        interval = settings.reconcile_interval_seconds
+        while True:
+            try:
+                await asyncio.sleep(interval)
+                # worker واحد بس من كل الـ workers هو اللي بيصحح في كل دورة
+                if await acquire_lease(RECONCILE_LEASE, interval):
+                    await reconcile_subscription_totals()
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                print(f"Reconciliation worker error: {e}")
+
+    if settings.reconcile_interval_seconds > 0:
+        app.state.reconciliation_task = asyncio.create_task(reconciliation_worker())
+
+    # Drop the apply-once marks of ingest writers that can no longer retry a batch
+    async def writer_prune_worker():
+        interval = settings.ingest_writer_prune_interval_seconds
+        while True:
+            try:
+                await asyncio.sleep(interval)
+                if await acquire_lease(WRITER_PRUNE_LEASE, interval):
+                    await prune_writer_marks(settings.ingest_writer_retire_seconds)
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                print(f"Writer prune worker error: {e}")
+
+    if settings.ingest_writer_prune_interval_seconds > 0:
+        app.state.writer_prune_task = asyncio.create_task(writer_prune_worker())
+
+    # Nightly precompute of the AI screen for every active subscriber
+    async def ai_insights_worker():
+        while True:
+            try:
+                await asyncio.sleep(seconds_until_next_run())
+                # كل الـ workers بيصحوا في نفس الساعة، واللي ياخد الـ lease بس هو اللي يحسب
+                if not await acquire_lease(AI_INSIGHTS_LEASE, settings.ai_insights_lease_seconds):
+                    continue
+                stored = await precompute_insights()
+                print(f"AI insights: stored insights for {stored} users")
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                print(f"AI insights worker error: {e}")
+                await asyncio.sleep(60)
+
+    if settings.ai_insights_run_hour_utc >= 0:
+        app.state.ai_insights_task = asyncio.create_task(ai_insights_worker())
+
+    # Write-behind stage for consumption readings
+    if settings.ingest_write_behind_enabled:
+        ingest_buffer.start()
+
+    # Per-device spike detection state, checkpointed to MongoDB
+    if settings.anomaly_detection_enabled:
+        await anomaly_detector.load()
+        anomaly_detector.start()
+
+    # Pooled connection to the AI service
+    await ai_client.start()
+
 
 @app.on_event("shutdown")
 async def shutdown_event():
-    # Cancel background task if running
+    # Cancel background tasks if running
     import asyncio
-    task = getattr(app.state, "device_status_task", None)
-    if task:
-        task.cancel()
-        try:
-            await task
-        except asyncio.CancelledError:
-            pass
+    for name in ("device_status_task", "reconciliation_task", "writer_prune_task", "ai_insights_task"):
+        task = getattr(app.state, name, None)
+        if task:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+    # Flush queued readings before the connection goes away
+    await ingest_buffer.stop()
+    await anomaly_detector.stop()
+    await device_keys.stop()
+    await ai_client.close()
 
     await close_mongo_connection()
 
@@ -1,7 +1,7 @@
 from .user import User
 from .device import Device
-from .consumption import Consumption
+from .consumption import Consumption, DailyRollup, MonthlyRollup
 from .plan import Plan, PlanSubscription
 from .alert import Alert
 
-__all__ = ["User", "Device", "Consumption", "Plan", "PlanSubscription", "Alert"]
+__all__ = ["User", "Device", "Consumption", "DailyRollup", "MonthlyRollup", "Plan", "PlanSubscription", "Alert"]
@@ -8,6 +8,7 @@ from .user import PyObjectId
 class Alert(BaseModel):
     id: Optional[PyObjectId] = None
     user_id: str
+    subscription_id: Optional[str] = None
     alert_type: str  # "70%", "90%", "100%"
     message: str
     threshold_percentage: float
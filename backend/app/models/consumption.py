@@ -20,6 +20,35 @@ class Consumption(BaseModel):
         collection = "consumption"
 
 
+class DailyRollup(BaseModel):
+    """Per (user, device, UTC day) total, maintained with $inc at ingest time"""
+    id: Optional[PyObjectId] = None
+    user_id: str
+    device_id: str
+    date: str  # YYYY-MM-DD
+    total: float  # kWh
+    count: int
+
+    class Config:
+        arbitrary_types_allowed = True
+        json_encoders = {ObjectId: str}
+        collection = "consumption_daily"
+
+
+class MonthlyRollup(BaseModel):
+    """Per (user, UTC month) total, maintained with $inc at ingest time"""
+    id: Optional[PyObjectId] = None
+    user_id: str
+    month: str  # YYYY-MM
+    total: float  # kWh
+    count: int
+
+    class Config:
+        arbitrary_types_allowed = True
+        json_encoders = {ObjectId: str}
+        collection = "consumption_monthly"
+
+
 class DailyConsumption(Base):
     __tablename__ = "daily_consumption"
 
@@ -1,5 +1,5 @@
 from datetime import datetime
-from typing import Optional
+from typing import List, Optional
 from pydantic import BaseModel
 from bson import ObjectId
 from .user import PyObjectId
@@ -25,6 +25,9 @@ class PlanSubscription(BaseModel):
     start_date: datetime
     end_date: datetime
     remaining_quota: float  # kWh
+    total_quota: Optional[float] = None  # kWh, copied from the plan at subscribe time
+    alerts_fired: List[str] = []  # alert types already sent in this cycle
+    consumed_since_start: float = 0.0  # kWh, running total kept with the quota deduction
     is_active: bool = True
     created_at: datetime = datetime.utcnow()
     updated_at: datetime = datetime.utcnow()
@@ -1,15 +1,19 @@
 from .auth import Token, TokenData, UserRegister, UserLogin
 from .user import UserResponse
-from .device import DeviceCreate, DeviceResponse
-from .consumption import ConsumptionCreate, ConsumptionResponse
+from .device import DeviceCreate, DeviceResponse, DeviceKeyResponse
+from .consumption import ConsumptionCreate, ConsumptionResponse, ConsumptionBatchCreate, ConsumptionBatchResponse, ConsumptionHistoryPage
+from .consumption import DailyFeature, HourlyFeature, ConsumptionFeatures
+from .consumption import DailySeriesBatchRequest, UserDailySeries, DailySeriesBatch, ConsumptionStats
 from .plan import PlanCreate, PlanResponse, PlanSubscriptionCreate, PlanSubscriptionResponse
 from .alert import AlertResponse
 
 __all__ = [
     "Token", "TokenData", "UserRegister", "UserLogin",
     "UserResponse",
-    "DeviceCreate", "DeviceResponse",
-    "ConsumptionCreate", "ConsumptionResponse",
+    "DeviceCreate", "DeviceResponse", "DeviceKeyResponse",
+    "ConsumptionCreate", "ConsumptionResponse", "ConsumptionBatchCreate", "ConsumptionBatchResponse", "ConsumptionHistoryPage",
+    "DailyFeature", "HourlyFeature", "ConsumptionFeatures",
+    "DailySeriesBatchRequest", "UserDailySeries", "DailySeriesBatch", "ConsumptionStats",
     "PlanCreate", "PlanResponse", "PlanSubscriptionCreate", "PlanSubscriptionResponse",
     "AlertResponse"
 ]
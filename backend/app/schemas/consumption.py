@@ -1,4 +1,5 @@
 from datetime import date, datetime
+from typing import List, Optional
 from pydantic import BaseModel
 
 
@@ -19,6 +20,80 @@ class ConsumptionResponse(BaseModel):
         from_attributes = True
 
 
+class ConsumptionHistoryPage(BaseModel):
+    items: List[ConsumptionResponse]
+    next_cursor: Optional[str] = None  # Pass back as ?cursor= for the next (older) page
+
+
+class ConsumptionBatchCreate(BaseModel):
+    readings: List[ConsumptionCreate]
+
+
+class ConsumptionBatchResponse(BaseModel):
+    inserted: int
+    devices: int
+    total_consumption: float
+
+
+class DailyFeature(BaseModel):
+    date: str  # YYYY-MM-DD (UTC)
+    total: float
+    count: int
+
+
+class HourlyFeature(BaseModel):
+    hour: datetime  # Start of the UTC hour
+    total: float
+    count: int
+
+
+class ConsumptionFeatures(BaseModel):
+    user_id: str
+    start: datetime
+    end: datetime
+    days: int
+    daily: List[DailyFeature]
+    hourly: List[HourlyFeature]
+
+
+class ConsumptionStats(BaseModel):
+    user_id: str
+    epoch: datetime  # hour/day indices below count whole hours/days since this instant
+    start: datetime  # First day of the oldest month included
+    end: datetime
+    devices: int
+    readings: int
+    total: float  # kWh, also sum(y) of both regressions
+    anomalies: int
+    hour_sxy: float
+    day_sxy: float
+    first_hour: Optional[int] = None
+    last_hour: Optional[int] = None
+    first_day: Optional[int] = None
+    last_day: Optional[int] = None
+    hourly_total: List[float]  # kWh per hour of day 0-23
+    hourly_count: List[int]
+    daily_sum_squares: float  # sum over days of (user's daily kWh)^2
+
+
+class DailySeriesBatchRequest(BaseModel):
+    user_ids: List[str]
+    days: int = 30
+
+
+class UserDailySeries(BaseModel):
+    user_id: str
+    dates: List[str]  # YYYY-MM-DD (UTC), ascending, only days with readings
+    totals: List[float]
+
+
+class DailySeriesBatch(BaseModel):
+    start: datetime
+    end: datetime
+    days: int
+    users: List[UserDailySeries]  # Users without readings in the window are left out
+
+
 class DailyConsumptionCreate(BaseModel):
     device_id: str
     consumption: float
@@ -16,4 +16,10 @@ class DeviceResponse(BaseModel):
     created_at: Optional[datetime] = None
 
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+
+class DeviceKeyResponse(BaseModel):
+    device_id: str
+    api_key: str  # بيظهر مرة واحدة بس وقت الإصدار
+    created_at: datetime
@@ -1,3 +1,4 @@
 from .plan_service import deduct_quota_and_check_alerts, check_and_create_alerts
+from .ingest_service import persist_readings
 
-__all__ = ["deduct_quota_and_check_alerts", "check_and_create_alerts"]
+__all__ = ["deduct_quota_and_check_alerts", "check_and_create_alerts", "persist_readings"]
@@ -0,0 +1,145 @@
+import asyncio
+from datetime import datetime, timedelta
+from typing import Optional
+from ..config import settings
+from ..database import get_database
+from ..utils.http_client import ai_client
+
+# أجزاء الـ document اللي بيرجعها /api/v1/insights في الـ AI service
+INSIGHT_SECTIONS = ("analysis", "prediction", "plan_exhaustion", "recommendations")
+
+# worker واحد بس بيعمل الـ precompute كل ليلة
+AI_INSIGHTS_LEASE = "ai_insights_precompute"
+
+
+def seconds_until_next_run(now: Optional[datetime] = None) -> float:
+    """الوقت لحد الساعة ai_insights_run_hour_utc الجاية"""
+    now = now or datetime.utcnow()
+    next_run = now.replace(hour=settings.ai_insights_run_hour_utc, minute=0, second=0, microsecond=0)
+    if next_run <= now:
+        next_run += timedelta(days=1)
+    return (next_run - now).total_seconds()
+
+
+async def precompute_user_insights(subscription: dict) -> bool:
+    """
+    Ask the AI service for every insight of one user and store them in ai_insights,
+    stamped with the subscription's updated_at (when the latest reading was applied)
+    as the data high-water mark. Returns False if the AI service did not answer.
+    """
+    db = get_database()
+    user_id = subscription["user_id"]
+    response = await ai_client.get(
+        "/api/v1/insights",
+        params={"user_id": user_id, "days": settings.ai_insights_prediction_days}
+    )
+    if response.status_code != 200:
+        print(f"AI insights: AI service answered {response.status_code} for user {user_id}")
+        return False
+
+    insights = response.json()
+    await db.ai_insights.update_one(
+        {"user_id": user_id},
+        {
+            "$set": {
+                **{section: insights[section] for section in INSIGHT_SECTIONS},
+                "subscription_id": str(subscription["_id"]),
+                "data_high_water": subscription.get("updated_at") or subscription.get("start_date"),
+                "prediction_days": settings.ai_insights_prediction_days,
+                "computed_at": datetime.utcnow()
+            }
+        },
+        upsert=True
+    )
+    return True
+
+
+async def precompute_insights() -> int:
+    """Compute and store the insights of every user with an active subscription"""
+    db = get_database()
+    semaphore = asyncio.Semaphore(settings.ai_insights_concurrency)
+
+    async def run(subscription: dict) -> bool:
+        async with semaphore:
+            try:
+                return await precompute_user_insights(subscription)
+            except Exception as e:
+                print(f"AI insights: failed for user {subscription['user_id']}: {e}")
+                return False
+
+    subscriptions = await db.plan_subscriptions.find(
+        {"is_active": True},
+        {"user_id": 1, "updated_at": 1, "start_date": 1}
+    ).to_list(length=None)
+    results = await asyncio.gather(*(run(subscription) for subscription in subscriptions))
+    return sum(results)
+
+
+def live_plan_exhaustion(stored: dict, remaining: float, now: Optional[datetime] = None) -> Optional[dict]:
+    """
+    The stored plan exhaustion recomputed on the subscription's current balance: the
+    daily rate comes from the nightly prediction, the balance moves with every
+    reading. Same formula as PredictionService.predict_plan_exhaustion.
+    """
+    daily_rate = stored.get("daily_rate_kwh")
+    if not daily_rate or daily_rate <= 0:
+        return None  # insight قديم من غير المعدل: يتحسب live من الـ AI service
+
+    now = now or datetime.utcnow()
+    days_left = remaining / daily_rate
+    exhaustion_date = now + timedelta(days=days_left)
+    status = "Healthy"
+    if days_left < 3:
+        status = "Urgent / Critical"
+    elif days_left < 7:
+        status = "Warning"
+
+    return {
+        **stored,
+        "current_balance_kwh": remaining,
+        "estimated_days_remaining": round(days_left, 1),
+        "estimated_exhaustion_date": exhaustion_date.strftime("%Y-%m-%d"),
+        "system_status": status,
+        "ai_advice": f"بناءً على معدل استهلاكك ({daily_rate} kWh/يوم)، يرجى إعادة الشحن قبل {exhaustion_date.strftime('%m/%d')}."
+    }
+
+
+async def get_fresh_insight(user_id: str, section: str, prediction_days: Optional[int] = None):
+    """
+    The stored `section` for this user, or None when it has to be computed live:
+    no document, a different (or no) active subscription, older than
+    ai_insights_max_age_seconds, or the user's data has moved more than
+    ai_insights_max_data_lag_seconds past the stored high-water mark.
+
+    plan_exhaustion is never served as stored: its balance is replaced by the
+    subscription's current remaining_quota (see live_plan_exhaustion).
+    """
+    db = get_database()
+    insight = await db.ai_insights.find_one(
+        {"user_id": user_id},
+        {section: 1, "subscription_id": 1, "data_high_water": 1, "prediction_days": 1, "computed_at": 1}
+    )
+    if not insight or section not in insight:
+        return None
+    if prediction_days is not None and insight.get("prediction_days") != prediction_days:
+        return None
+
+    now = datetime.utcnow()
+    if (now - insight["computed_at"]).total_seconds() > settings.ai_insights_max_age_seconds:
+        return None
+
+    subscription = await db.plan_subscriptions.find_one(
+        {"user_id": user_id, "is_active": True},
+        {"updated_at": 1, "start_date": 1, "remaining_quota": 1}
+    )
+    if not subscription or str(subscription["_id"]) != insight.get("subscription_id"):
+        return None
+    high_water = subscription.get("updated_at") or subscription.get("start_date")
+    stored_high_water = insight.get("data_high_water")
+    if high_water and stored_high_water and \
+            (high_water - stored_high_water).total_seconds() > settings.ai_insights_max_data_lag_seconds:
+        return None
+
+    if section == "plan_exhaustion":
+        return live_plan_exhaustion(insight[section], subscription.get("remaining_quota", 0))
+    return insight[section]
@@ -0,0 +1,232 @@
+import asyncio
+import math
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Set, Tuple
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from ..config import settings
+from ..database import get_database
+from ..utils.response_cache import response_cache
+from .consumption_stats import record_anomaly
+from .ingest_guard import only_duplicates
+
+ANOMALY_ALERT_TYPE = "anomaly"
+
+
+class DeviceAnomalyDetector:
+    """
+    Online spike detector run on every ingested reading.
+
+    Each (user_id, device_id) keeps an exponentially weighted mean and variance of
+    its readings: four numbers, updated in O(1) with no database access. After
+    warmup_readings readings, a reading more than z_threshold standard deviations
+    above the mean is a spike. Spikes are counted in consumption_stats (when it is
+    maintained) and an "anomaly" alert is written to the alerts collection in the
+    background (at most one per device per cooldown).
+
+    The state lives in memory and is checkpointed to device_anomaly_state every
+    checkpoint_interval_seconds (and at shutdown), then reloaded at startup.
+
+    Each uvicorn worker runs its own detector over the readings it receives, so
+    what must hold across workers is kept in MongoDB with conditional writes: an
+    alert is only sent by the worker whose update moves the device's last_alert_at
+    past the cooldown, and a checkpoint only replaces a stored state built from
+    fewer readings (the worker that has seen the most of the device wins).
+    """
+
+    def __init__(self, alpha: float, z_threshold: float, warmup_readings: int, min_std_ratio: float,
+                 cooldown_seconds: int, checkpoint_interval_seconds: int):
+        self.alpha = alpha
+        self.z_threshold = z_threshold
+        self.warmup_readings = warmup_readings
+        self.min_std_ratio = min_std_ratio
+        self.cooldown_seconds = cooldown_seconds
+        self.checkpoint_interval_seconds = checkpoint_interval_seconds
+        # [count, mean, variance, last alert (epoch seconds)]
+        self._state: Dict[Tuple[str, str], List[float]] = {}
+        self._dirty: Set[Tuple[str, str]] = set()
+        self._alert_tasks: Set[asyncio.Task] = set()
+        self._task: Optional[asyncio.Task] = None
+        self.observed = 0
+        self.flagged = 0
+        self.alerts = 0
+
+    async def load(self):
+        db = get_database()
+        docs = await db.device_anomaly_state.find(
+            # مستند اتعمل من claim تنبيه بس (قبل أول checkpoint) مفيهوش حالة
+            {"count": {"$exists": True}},
+            {"user_id": 1, "device_id": 1, "count": 1, "mean": 1, "variance": 1, "last_alert_at": 1}
+        ).to_list(length=None)
+        self._state = {
+            (doc["user_id"], doc["device_id"]): [doc["count"], doc["mean"], doc["variance"], doc.get("last_alert_at", 0.0)]
+            for doc in docs
+        }
+        self._dirty.clear()
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._checkpoint_loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._alert_tasks:
+            await asyncio.gather(*self._alert_tasks, return_exceptions=True)
+        await self.checkpoint()
+
+    def observe(self, reading: dict) -> Optional[dict]:
+        """تحديث حالة الجهاز بالقراءة، وبترجع تفاصيل الـ spike لو القراءة شاذة"""
+        key = (reading["user_id"], reading["device_id"])
+        value = reading["consumption_value"]
+        self.observed += 1
+        self._dirty.add(key)
+
+        state = self._state.get(key)
+        if state is None:
+            self._state[key] = [1, value, 0.0, 0.0]
+            return None
+
+        count, mean, variance, last_alert = state
+        std = max(math.sqrt(variance), self.min_std_ratio * abs(mean), 1e-6)
+        limit = mean + self.z_threshold * std
+        spike = None
+        if count >= self.warmup_readings and value > limit:
+            self.flagged += 1
+            spike = {"value": value, "expected": mean, "limit": limit, "z_score": (value - mean) / std}
+            # الـ cooldown المحلي بيوفر round-trip، و_claim_alert هو اللي بيحسم بين الـ workers
+            now = time.time()
+            alert = now - last_alert >= self.cooldown_seconds
+            if alert:
+                state[3] = now
+            self._schedule_spike(reading, spike, alert)
+
+        # الـ spike بيدخل المتوسط بحد أقصى = limit، عشان قراءة واحدة متوسعش الـ variance
+        diff = min(value, limit) - mean
+        increment = self.alpha * diff
+        state[0] = count + 1
+        state[1] = mean + increment
+        state[2] = (1 - self.alpha) * (variance + diff * increment)
+        return spike
+
+    def _schedule_spike(self, reading: dict, spike: dict, alert: bool):
+        task = asyncio.create_task(self._record_spike(reading, spike, alert))
+        self._alert_tasks.add(task)
+        task.add_done_callback(self._alert_tasks.discard)
+
+    async def _record_spike(self, reading: dict, spike: dict, alert: bool):
+        try:
+            # كل spike بيتعد في الإحصائيات (anomalies_detected في التحليل)، والتنبيه بس برا الـ cooldown
+            if settings.consumption_stats_enabled:
+                await record_anomaly(reading["user_id"], reading["device_id"], reading.get("timestamp") or datetime.utcnow())
+            if not alert or not await self._claim_alert(reading["user_id"], reading["device_id"]):
+                return
+            expected = max(spike["expected"], 1e-6)
+            await get_database().alerts.insert_one({
+                "user_id": reading["user_id"],
+                "device_id": reading["device_id"],
+                "alert_type": ANOMALY_ALERT_TYPE,
+                "message": f"قراءة غير طبيعية من الجهاز {reading['device_id']}: "
+                           f"{round(spike['value'], 3)} كيلوواط بدل حوالي {round(spike['expected'], 3)}.",
+                # النسب هنا من القراءة المعتادة للجهاز مش من الباقة
+                "threshold_percentage": float(spike["limit"] / expected * 100),
+                "current_usage_percentage": float(spike["value"] / expected * 100),
+                "consumption_value": spike["value"],
+                "z_score": float(spike["z_score"]),
+                "created_at": datetime.utcnow()
+            })
+            response_cache.invalidate_user(reading["user_id"])
+            self.alerts += 1
+            print(f"🚨 Anomaly Alert: device {reading['device_id']} for user {reading['user_id']}")
+        except Exception as e:
+            print(f"Anomaly alert error: {e}")
+
+    async def _claim_alert(self, user_id: str, device_id: str) -> bool:
+        """
+        Take the device's alert cooldown in MongoDB. The cooldown kept in memory only
+        covers this worker; this update matches once per cooldown across all of them.
+        """
+        now = time.time()
+        try:
+            await get_database().device_anomaly_state.update_one(
+                {
+                    "user_id": user_id,
+                    "device_id": device_id,
+                    "$or": [
+                        {"last_alert_at": {"$lt": now - self.cooldown_seconds}},
+                        {"last_alert_at": {"$exists": False}}
+                    ]
+                },
+                {"$set": {"last_alert_at": now}},
+                upsert=True
+            )
+            return True
+        except DuplicateKeyError:
+            # المستند موجود وتنبيهه لسه جوه الـ cooldown: worker تاني بعت التنبيه
+            return False
+
+    async def checkpoint(self) -> int:
+        """كتابة حالة الأجهزة اللي اتغيرت من آخر checkpoint"""
+        if not self._dirty:
+            return 0
+        dirty, self._dirty = self._dirty, set()
+        now = datetime.utcnow()
+        ops = []
+        for user_id, device_id in dirty:
+            count, mean, variance, _ = self._state[(user_id, device_id)]
+            # last_alert_at بيتكتب من _claim_alert بس، والحالة متكتبش فوق حالة من قراءات أكتر
+            ops.append(UpdateOne(
+                {
+                    "user_id": user_id,
+                    "device_id": device_id,
+                    "$or": [{"count": {"$lt": count}}, {"count": {"$exists": False}}]
+                },
+                {"$set": {"count": count, "mean": mean, "variance": variance, "updated_at": now}},
+                upsert=True
+            ))
+        try:
+            await get_database().device_anomaly_state.bulk_write(ops, ordered=False)
+        except BulkWriteError as e:
+            # duplicate key = الحالة المتخزنة من قراءات أكتر، فبتفضل زي ما هي
+            if not only_duplicates(e):
+                self._dirty |= dirty
+                raise
+        except Exception:
+            self._dirty |= dirty  # نحاول تاني في الـ checkpoint الجاي
+            raise
+        return len(ops)
+
+    async def _checkpoint_loop(self):
+        while True:
+            try:
+                await asyncio.sleep(self.checkpoint_interval_seconds)
+                await self.checkpoint()
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                print(f"Anomaly checkpoint error: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "devices": len(self._state),
+            "observed": self.observed,
+            "flagged": self.flagged,
+            "alerts": self.alerts,
+            "dirty": len(self._dirty)
+        }
+
+
+anomaly_detector = DeviceAnomalyDetector(
+    alpha=settings.anomaly_ewma_alpha,
+    z_threshold=settings.anomaly_z_threshold,
+    warmup_readings=settings.anomaly_warmup_readings,
+    min_std_ratio=settings.anomaly_min_std_ratio,
+    cooldown_seconds=settings.anomaly_alert_cooldown_seconds,
+    checkpoint_interval_seconds=settings.anomaly_checkpoint_interval_seconds
+)
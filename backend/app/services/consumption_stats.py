@@ -0,0 +1,133 @@
+"""
+Running sufficient statistics of consumption per (user, device, month).
+
+Every ingested reading is folded into its month document with $inc / $min / $max,
+so the statistics the AI endpoints need never require a scan of the readings:
+
+  count, total                  readings and kWh
+  hourly_total.h, hourly_count.h  per hour of day (0-23), for the peak-hour profile
+  daily_total.d                 kWh per day of month (1-31)
+  first_hour, last_hour, hour_sxy  regression accumulators of hourly totals
+  first_day, last_day, day_sxy     regression accumulators of daily totals
+  anomalies                     spikes flagged by the ingest anomaly detector
+
+x is the whole number of hours (or days) since STATS_EPOCH. Hours and days without
+readings count as zero consumption, so the x range is contiguous from first to
+last and sum(x) and sum(x^2) follow from its ends; only sum(y) (= total) and
+sum(x*y) have to be accumulated.
+"""
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+from pymongo import UpdateOne
+from ..database import get_database
+from .ingest_guard import BatchTag, guard_update
+
+STATS_EPOCH = datetime(2024, 1, 1)
+
+
+def hour_index(timestamp: datetime) -> int:
+    return int((timestamp - STATS_EPOCH).total_seconds() // 3600)
+
+
+def day_index(timestamp: datetime) -> int:
+    return (timestamp - STATS_EPOCH).days
+
+
+def build_stats_ops(readings: List[dict], tag: Optional[BatchTag] = None) -> List[UpdateOne]:
+    """One upsert per (user, device, month) touched by the batch"""
+    groups: Dict[tuple, dict] = {}
+    for reading in readings:
+        timestamp = reading["timestamp"]
+        key = (reading["user_id"], reading["device_id"], timestamp.strftime("%Y-%m"))
+        group = groups.get(key)
+        if group is None:
+            # defaultdict(int): العدادات تفضل int والمجاميع بتبقى float
+            group = groups[key] = {"inc": defaultdict(int), "min": {}, "max": {}}
+
+        value = reading["consumption_value"]
+        hour, day = hour_index(timestamp), day_index(timestamp)
+        inc = group["inc"]
+        inc["count"] += 1
+        inc["total"] += value
+        inc[f"hourly_total.{timestamp.hour}"] += value
+        inc[f"hourly_count.{timestamp.hour}"] += 1
+        inc[f"daily_total.{timestamp.day}"] += value
+        inc["hour_sxy"] += hour * value
+        inc["day_sxy"] += day * value
+        group["min"]["first_hour"] = min(hour, group["min"].get("first_hour", hour))
+        group["max"]["last_hour"] = max(hour, group["max"].get("last_hour", hour))
+        group["min"]["first_day"] = min(day, group["min"].get("first_day", day))
+        group["max"]["last_day"] = max(day, group["max"].get("last_day", day))
+
+    return [
+        UpdateOne(
+            *guard_update(
+                {"user_id": user_id, "device_id": device_id, "month": month},
+                {
+                    "$inc": dict(group["inc"]),
+                    "$min": group["min"],
+                    "$max": group["max"]
+                },
+                tag
+            ),
+            upsert=True
+        )
+        for (user_id, device_id, month), group in groups.items()
+    ]
+
+
+async def record_anomaly(user_id: str, device_id: str, timestamp: datetime):
+    await get_database().consumption_stats.update_one(
+        {"user_id": user_id, "device_id": device_id, "month": timestamp.strftime("%Y-%m")},
+        {"$inc": {"anomalies": 1}},
+        upsert=True
+    )
+
+
+async def load_user_stats(user_id: str, days: int, now: Optional[datetime] = None) -> dict:
+    """
+    The user's statistics summed over devices and over the calendar months that
+    cover the last `days` days. Reads at most (months x devices) small documents,
+    whatever the number of readings.
+    """
+    db = get_database()
+    now = now or datetime.utcnow()
+    start = (now - timedelta(days=days - 1)).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+    docs = await db.consumption_stats.find(
+        {"user_id": user_id, "month": {"$gte": start.strftime("%Y-%m")}},
+        {"_id": 0, "user_id": 0}
+    ).to_list(length=None)
+
+    hourly_total, hourly_count = [0.0] * 24, [0] * 24
+    daily: Dict[str, float] = defaultdict(float)
+    stats = {"readings": 0, "total": 0.0, "anomalies": 0, "hour_sxy": 0.0, "day_sxy": 0.0,
+             "first_hour": None, "last_hour": None, "first_day": None, "last_day": None}
+    for doc in docs:
+        stats["readings"] += doc.get("count", 0)
+        stats["anomalies"] += doc.get("anomalies", 0)
+        for field in ("total", "hour_sxy", "day_sxy"):
+            stats[field] += doc.get(field, 0.0)
+        for field, pick in (("first_hour", min), ("last_hour", max), ("first_day", min), ("last_day", max)):
+            if doc.get(field) is not None:
+                stats[field] = doc[field] if stats[field] is None else pick(stats[field], doc[field])
+        for hour, amount in doc.get("hourly_total", {}).items():
+            hourly_total[int(hour)] += amount
+        for hour, amount in doc.get("hourly_count", {}).items():
+            hourly_count[int(hour)] += amount
+        for day, amount in doc.get("daily_total", {}).items():
+            daily[f"{doc['month']}-{int(day):02d}"] += amount
+
+    return {
+        "user_id": user_id,
+        "epoch": STATS_EPOCH,
+        "start": start,
+        "end": now,
+        "devices": len({doc["device_id"] for doc in docs}),
+        **stats,
+        "hourly_total": hourly_total,
+        "hourly_count": hourly_count,
+        # مجموع مربعات الاستهلاك اليومي للمستخدم كله (للـ variance)
+        "daily_sum_squares": sum(amount * amount for amount in daily.values())
+    }
@@ -0,0 +1,414 @@
+"""
+Storage layouts for raw consumption readings.
+
+documents   one document per reading in db.consumption (the original layout)
+buckets     one document per (user, device, UTC hour) in db.consumption_buckets, holding
+            parallel arrays of millisecond offsets and values plus count/sum/min/max
+timeseries  a native MongoDB time-series collection, db.consumption_ts
+
+Every reader of raw readings goes through this module so the API works on any layout.
+"""
+import base64
+import binascii
+import json
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from ..config import settings
+from ..database import get_database
+from .ingest_guard import BatchTag, bulk_write_once, guard_update, only_duplicates
+
+STORAGE_DOCUMENTS = "documents"
+STORAGE_BUCKETS = "buckets"
+STORAGE_TIMESERIES = "timeseries"
+STORAGE_MODES = (STORAGE_DOCUMENTS, STORAGE_BUCKETS, STORAGE_TIMESERIES)
+
+TIMESERIES_COLLECTION = "consumption_ts"
+BUCKETS_COLLECTION = "consumption_buckets"
+
+
+def storage_mode() -> str:
+    mode = settings.consumption_storage_mode
+    if mode not in STORAGE_MODES:
+        raise ValueError(f"Unknown consumption storage mode: {mode}")
+    return mode
+
+
+def bucket_hour(timestamp: datetime) -> datetime:
+    return timestamp.replace(minute=0, second=0, microsecond=0)
+
+
+def build_bucket_ops(readings: List[dict], tag: Optional[BatchTag] = None) -> List[UpdateOne]:
+    """قراءات الـ flush متجمعة في $push واحد لكل (مستخدم، جهاز، ساعة)"""
+    buckets: Dict[tuple, List[dict]] = defaultdict(list)
+    for reading in readings:
+        buckets[(reading["user_id"], reading["device_id"], bucket_hour(reading["timestamp"]))].append(reading)
+
+    ops = []
+    for (user_id, device_id, hour), items in buckets.items():
+        values = [item["consumption_value"] for item in items]
+        offsets = [int((item["timestamp"] - hour).total_seconds() * 1000) for item in items]
+        ops.append(UpdateOne(
+            *guard_update(
+                {"user_id": user_id, "device_id": device_id, "hour": hour},
+                {
+                    "$push": {"offsets": {"$each": offsets}, "values": {"$each": values}},
+                    "$inc": {"count": len(values), "sum": sum(values)},
+                    "$min": {"min": min(values)},
+                    "$max": {"max": max(values)}
+                },
+                tag
+            ),
+            upsert=True
+        ))
+    return ops
+
+
+async def ensure_layout(db):
+    """إنشاء الـ collection والـ indexes المطلوبة للـ layout الحالي"""
+    mode = storage_mode()
+    if mode == STORAGE_TIMESERIES:
+        if TIMESERIES_COLLECTION not in await db.list_collection_names():
+            await db.create_collection(
+                TIMESERIES_COLLECTION,
+                timeseries={"timeField": "timestamp", "metaField": "meta", "granularity": "seconds"}
+            )
+        await db[TIMESERIES_COLLECTION].create_index([("meta.user_id", 1), ("meta.device_id", 1), ("timestamp", -1)])
+        # سجل المستخدم كله (من غير device_id) متترتب بالوقت من الـ index على طول
+        await db[TIMESERIES_COLLECTION].create_index([("meta.user_id", 1), ("timestamp", -1)])
+    elif mode == STORAGE_BUCKETS:
+        await db[BUCKETS_COLLECTION].create_index([("user_id", 1), ("device_id", 1), ("hour", -1)], unique=True)
+        await db[BUCKETS_COLLECTION].create_index([("user_id", 1), ("hour", -1)])
+
+
+def raw_readings_pipeline() -> Tuple[str, List[dict]]:
+    """
+    (collection, stages) that turn the current layout's raw documents into one
+    {user_id, device_id, timestamp, consumption_value} document per reading, for
+    aggregations that rebuild derived data (scripts/backfill_rollups.py).
+    """
+    mode = storage_mode()
+    if mode == STORAGE_DOCUMENTS:
+        return "consumption", []
+    if mode == STORAGE_TIMESERIES:
+        return TIMESERIES_COLLECTION, [
+            {"$project": {"_id": 0, "user_id": "$meta.user_id", "device_id": "$meta.device_id",
+                          "timestamp": 1, "consumption_value": 1}}
+        ]
+    return BUCKETS_COLLECTION, [
+        {"$unwind": {"path": "$offsets", "includeArrayIndex": "index"}},
+        {"$project": {"_id": 0, "user_id": 1, "device_id": 1,
+                      "timestamp": {"$add": ["$hour", "$offsets"]},
+                      "consumption_value": {"$arrayElemAt": ["$values", "$index"]}}}
+    ]
+
+
+async def insert_readings(readings: List[dict], tag: Optional[BatchTag] = None, retry: bool = False):
+    """
+    كتابة القراءات الخام بالـ layout المختار.
+    مع tag الكتابة بتتطبق مرة واحدة لو الدفعة اتعادت: الـ _id بتاع القراءة بيمنع
+    التكرار في documents، والـ buckets متأمنة بالـ tag، والـ timeseries (مفيهاش
+    unique index) بنشيل منها في الـ retry القراءات اللي اتكتبت قبل كده.
+    """
+    db = get_database()
+    mode = storage_mode()
+    if mode == STORAGE_DOCUMENTS:
+        try:
+            await db.consumption.insert_many(readings, ordered=False)
+        except BulkWriteError as e:
+            if tag is None or not only_duplicates(e):
+                raise
+    elif mode == STORAGE_TIMESERIES:
+        # الـ _id بيتثبت على القراءة نفسها، فالـ retry بيدور على نفس الـ ids
+        for reading in readings:
+            reading.setdefault("_id", ObjectId())
+        if retry:
+            readings = await _not_yet_inserted(db[TIMESERIES_COLLECTION], readings)
+        if readings:
+            await db[TIMESERIES_COLLECTION].insert_many([
+                {
+                    "_id": reading["_id"],
+                    "timestamp": reading["timestamp"],
+                    "meta": {"user_id": reading["user_id"], "device_id": reading["device_id"]},
+                    "consumption_value": reading["consumption_value"]
+                }
+                for reading in readings
+            ], ordered=False)
+    else:
+        await bulk_write_once(db[BUCKETS_COLLECTION], build_bucket_ops(readings, tag), tag)
+
+
+async def _not_yet_inserted(collection, readings: List[dict]) -> List[dict]:
+    timestamps = [reading["timestamp"] for reading in readings]
+    existing = {
+        doc["_id"]
+        async for doc in collection.find(
+            {
+                "meta.user_id": {"$in": list({reading["user_id"] for reading in readings})},
+                "timestamp": {"$gte": min(timestamps), "$lte": max(timestamps)},
+                "_id": {"$in": [reading["_id"] for reading in readings]}
+            },
+            {"_id": 1}
+        )
+    }
+    return [reading for reading in readings if reading["_id"] not in existing]
+
+
+def _time_range(start: Optional[datetime], end: Optional[datetime], field: str = "timestamp") -> dict:
+    time_range = {}
+    if start:
+        time_range["$gte"] = start
+    if end:
+        time_range["$lte"] = end
+    return {field: time_range} if time_range else {}
+
+
+def encode_cursor(reading: dict) -> str:
+    """token الصفحة الجاية = (timestamp, id) لآخر قراءة في الصفحة"""
+    raw = json.dumps({"t": reading["timestamp"].isoformat(), "i": reading["id"]})
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(token: str) -> Tuple[datetime, str]:
+    """Raises ValueError for a malformed token"""
+    try:
+        raw = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+        timestamp, reading_id = datetime.fromisoformat(raw["t"]), str(raw["i"])
+    except (TypeError, KeyError, binascii.Error, UnicodeDecodeError, json.JSONDecodeError) as e:
+        raise ValueError("Invalid cursor") from e
+    # ids في الـ buckets layout شكلها "bucketid-index"
+    if not ObjectId.is_valid(reading_id.split("-")[0]):
+        raise ValueError("Invalid cursor")
+    return timestamp, reading_id
+
+
+def _tie_ordered(readings: List[dict], before: Optional[Tuple[datetime, str]]) -> List[dict]:
+    """قراءات بنفس الـ timestamp بترتيب الـ _id التنازلي، من غير اللي قبل الـ cursor"""
+    readings.sort(key=lambda reading: ObjectId(reading["id"]), reverse=True)
+    if before:
+        timestamp, reading_id = before
+        readings = [r for r in readings if r["timestamp"] < timestamp or ObjectId(r["id"]) < ObjectId(reading_id)]
+    return readings
+
+
+def _keyset_filter(before: Tuple[datetime, str], time_field: str = "timestamp") -> dict:
+    """كل القراءات اللي قبل (timestamp, _id) في الترتيب التنازلي"""
+    timestamp, reading_id = before
+    if not ObjectId.is_valid(reading_id):
+        raise ValueError("Invalid cursor")
+    return {
+        "$or": [
+            {time_field: {"$lt": timestamp}},
+            {time_field: timestamp, "_id": {"$lt": ObjectId(reading_id)}}
+        ]
+    }
+
+
+async def iter_readings(
+    user_id: str,
+    device_id: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    limit: Optional[int] = None,
+    before: Optional[Tuple[datetime, str]] = None,
+    batch_size: int = 1000
+) -> AsyncIterator[dict]:
+    """
+    Stream raw readings newest first as {id, device_id, user_id, consumption_value,
+    timestamp}, straight from the Motor cursor.
+
+    `before` is a (timestamp, id) keyset position: only readings strictly older than
+    it are returned, so every page costs the same however deep it is. The
+    time-series layout can only index meta and timestamp, so its cursor is sorted
+    by timestamp alone and readings sharing a timestamp are put in _id order here.
+    """
+    db = get_database()
+    mode = storage_mode()
+
+    if mode == STORAGE_DOCUMENTS:
+        query = {"user_id": user_id, **_time_range(start, end)}
+        if device_id:
+            query["device_id"] = device_id
+        if before:
+            query.update(_keyset_filter(before))
+
+        cursor = db.consumption.find(
+            query,
+            {"device_id": 1, "user_id": 1, "consumption_value": 1, "timestamp": 1}
+        ).sort([("timestamp", -1), ("_id", -1)]).batch_size(batch_size)
+        if limit:
+            cursor = cursor.limit(limit)
+        async for doc in cursor:
+            yield {
+                "id": str(doc["_id"]),
+                "device_id": doc["device_id"],
+                "user_id": doc["user_id"],
+                "consumption_value": doc["consumption_value"],
+                "timestamp": doc["timestamp"]
+            }
+        return
+
+    if mode == STORAGE_TIMESERIES:
+        # الـ secondary indexes هنا على meta و timestamp بس: الترتيب من الـ index بالوقت بس،
+        # والقراءات اللي ليها نفس الـ timestamp بتترتب بالـ _id هنا (عددها صغير)
+        if before and not ObjectId.is_valid(before[1]):
+            raise ValueError("Invalid cursor")
+        upper = end
+        if before and (upper is None or before[0] < upper):
+            upper = before[0]
+        query = {"meta.user_id": user_id, **_time_range(start, upper)}
+        if device_id:
+            query["meta.device_id"] = device_id
+
+        emitted = 0
+        ties: List[dict] = []
+        cursor = db[TIMESERIES_COLLECTION].find(
+            query,
+            {"meta": 1, "consumption_value": 1, "timestamp": 1}
+        ).sort("timestamp", -1).batch_size(batch_size)
+        async for doc in cursor:
+            reading = {
+                "id": str(doc["_id"]),
+                "device_id": doc["meta"]["device_id"],
+                "user_id": doc["meta"]["user_id"],
+                "consumption_value": doc["consumption_value"],
+                "timestamp": doc["timestamp"]
+            }
+            if ties and reading["timestamp"] != ties[0]["timestamp"]:
+                for tied in _tie_ordered(ties, before):
+                    yield tied
+                    emitted += 1
+                    if limit and emitted >= limit:
+                        return
+                ties = []
+            ties.append(reading)
+        for tied in _tie_ordered(ties, before):
+            yield tied
+            emitted += 1
+            if limit and emitted >= limit:
+                return
+        return
+
+    # buckets: نفرد كل ساعة من الأحدث للأقدم، وكل الأجهزة في نفس الساعة بتترتب مع بعض
+    query = {"user_id": user_id}
+    if device_id:
+        query["device_id"] = device_id
+    upper = end
+    if before and (upper is None or before[0] < upper):
+        upper = before[0]
+    query.update(_time_range(bucket_hour(start) if start else None, upper, field="hour"))
+
+    emitted = 0
+    hour_batch: List[dict] = []
+    current_hour = None
+
+    def ordered(batch: List[dict]) -> List[dict]:
+        batch.sort(key=lambda r: (r["timestamp"], r["id"]), reverse=True)
+        if before:
+            batch = [r for r in batch if (r["timestamp"], r["id"]) < before]
+        return batch
+
+    cursor = db[BUCKETS_COLLECTION].find(query).sort("hour", -1).batch_size(max(1, batch_size // 100))
+    async for bucket in cursor:
+        if bucket["hour"] != current_hour:
+            for reading in ordered(hour_batch):
+                yield reading
+                emitted += 1
+                if limit and emitted >= limit:
+                    return
+            hour_batch = []
+            current_hour = bucket["hour"]
+        hour_batch.extend(expand_bucket(bucket, start, end))
+    for reading in ordered(hour_batch):
+        yield reading
+        emitted += 1
+        if limit and emitted >= limit:
+            return
+
+
+async def find_readings(
+    user_id: str,
+    device_id: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    limit: int = 1000
+) -> List[dict]:
+    """Newest-first raw readings as a list (see iter_readings)"""
+    return [reading async for reading in iter_readings(user_id, device_id, start, end, limit=limit)]
+
+
+def expand_bucket(bucket: dict, start: Optional[datetime] = None, end: Optional[datetime] = None) -> List[dict]:
+    """تحويل مستند الساعة لقراءات منفصلة (id = bucket_id-index)"""
+    readings = []
+    for index, (offset, value) in enumerate(zip(bucket["offsets"], bucket["values"])):
+        timestamp = bucket["hour"] + timedelta(milliseconds=offset)
+        if (start and timestamp < start) or (end and timestamp > end):
+            continue
+        readings.append({
+            "id": f"{bucket['_id']}-{index}",
+            "device_id": bucket["device_id"],
+            "user_id": bucket["user_id"],
+            "consumption_value": value,
+            "timestamp": timestamp
+        })
+    return readings
+
+
+async def sum_since(user_id: str, start: datetime) -> float:
+    """مجموع القراءات الخام للمستخدم من تاريخ معين"""
+    db = get_database()
+    mode = storage_mode()
+
+    if mode in (STORAGE_DOCUMENTS, STORAGE_TIMESERIES):
+        collection = db.consumption if mode == STORAGE_DOCUMENTS else db[TIMESERIES_COLLECTION]
+        user_field = "user_id" if mode == STORAGE_DOCUMENTS else "meta.user_id"
+        pipeline = [
+            {"$match": {user_field: user_id, "timestamp": {"$gte": start}}},
+            {"$group": {"_id": None, "total": {"$sum": "$consumption_value"}}}
+        ]
+        result = await collection.aggregate(pipeline).to_list(length=1)
+        return float(result[0]["total"]) if result else 0.0
+
+    # الساعات الكاملة من الـ header، والساعة الأولى بس بتتفرد قراءة قراءة
+    first_hour = bucket_hour(start)
+    pipeline = [
+        {"$match": {"user_id": user_id, "hour": {"$gt": first_hour}}},
+        {"$group": {"_id": None, "total": {"$sum": "$sum"}}}
+    ]
+    result = await db[BUCKETS_COLLECTION].aggregate(pipeline).to_list(length=1)
+    total = float(result[0]["total"]) if result else 0.0
+    async for bucket in db[BUCKETS_COLLECTION].find({"user_id": user_id, "hour": first_hour}):
+        total += sum(reading["consumption_value"] for reading in expand_bucket(bucket, start=start))
+    return total
+
+
+async def hourly_series(user_id: str, start: datetime) -> List[dict]:
+    """total و count لكل ساعة (UTC) من تاريخ معين، متجمعة في Mongo"""
+    db = get_database()
+    mode = storage_mode()
+
+    if mode in (STORAGE_DOCUMENTS, STORAGE_TIMESERIES):
+        collection = db.consumption if mode == STORAGE_DOCUMENTS else db[TIMESERIES_COLLECTION]
+        user_field = "user_id" if mode == STORAGE_DOCUMENTS else "meta.user_id"
+        pipeline = [
+            {"$match": {user_field: user_id, "timestamp": {"$gte": start}}},
+            {"$group": {
+                "_id": {"$dateTrunc": {"date": "$timestamp", "unit": "hour"}},
+                "total": {"$sum": "$consumption_value"},
+                "count": {"$sum": 1}
+            }}
+        ]
+    else:
+        # مستند الـ bucket هو الساعة نفسها، فبنجمع الـ header بس (من غير ما نفرد القراءات)
+        collection = db[BUCKETS_COLLECTION]
+        pipeline = [
+            {"$match": {"user_id": user_id, "hour": {"$gte": bucket_hour(start)}}},
+            {"$group": {"_id": "$hour", "total": {"$sum": "$sum"}, "count": {"$sum": "$count"}}}
+        ]
+    pipeline.append({"$sort": {"_id": 1}})
+
+    rows = await collection.aggregate(pipeline).to_list(length=None)
+    return [{"hour": row["_id"], "total": float(row["total"]), "count": row["count"]} for row in rows]
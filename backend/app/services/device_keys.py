@@ -0,0 +1,111 @@
+import asyncio
+import hashlib
+import secrets
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+from ..config import settings
+from ..database import get_database
+from ..utils.cache import TTLCache
+
+KEY_PREFIX = "sems_dk_"
+
+
+def hash_device_key(api_key: str) -> str:
+    """المفتاح نفسه مش بيتخزن - بنخزن الـ sha256 بتاعه بس"""
+    return hashlib.sha256(api_key.encode()).hexdigest()
+
+
+class DeviceKeyRegistry:
+    """
+    In-memory map of device API key hash to (user_id, device_id).
+
+    Resolving a key is a dict lookup with no database hit. The map is loaded at
+    startup and reloaded every device_key_refresh_seconds so keys issued or revoked
+    by other workers propagate. Unknown keys are looked up once and negatively cached.
+    """
+
+    def __init__(self, refresh_seconds: int):
+        self.refresh_seconds = refresh_seconds
+        self._keys: Dict[str, Tuple[str, str]] = {}
+        self._unknown = TTLCache(max_size=10000, ttl_seconds=refresh_seconds)
+        self._task: Optional[asyncio.Task] = None
+
+    async def load(self):
+        db = get_database()
+        docs = await db.device_keys.find(
+            {"revoked": False},
+            {"key_hash": 1, "user_id": 1, "device_id": 1}
+        ).to_list(length=None)
+        self._keys = {doc["key_hash"]: (doc["user_id"], doc["device_id"]) for doc in docs}
+        self._unknown.clear()
+
+    def start(self):
+        """تحديث دوري للخريطة عشان الإلغاء يوصل لكل الـ workers"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def issue(self, user_id: str, device_id: str) -> str:
+        """إصدار مفتاح جديد للجهاز (وإلغاء أي مفتاح قديم له)"""
+        await self.revoke(user_id, device_id)
+
+        api_key = KEY_PREFIX + secrets.token_urlsafe(32)
+        key_hash = hash_device_key(api_key)
+        await get_database().device_keys.insert_one({
+            "key_hash": key_hash,
+            "user_id": user_id,
+            "device_id": device_id,
+            "revoked": False,
+            "created_at": datetime.utcnow()
+        })
+        self._keys[key_hash] = (user_id, device_id)
+        self._unknown.pop(key_hash)
+        return api_key
+
+    async def revoke(self, user_id: str, device_id: str) -> int:
+        result = await get_database().device_keys.update_many(
+            {"user_id": user_id, "device_id": device_id, "revoked": False},
+            {"$set": {"revoked": True, "revoked_at": datetime.utcnow()}}
+        )
+        self._keys = {
+            key_hash: identity for key_hash, identity in self._keys.items()
+            if identity != (user_id, device_id)
+        }
+        return result.modified_count
+
+    async def resolve(self, api_key: str) -> Optional[Tuple[str, str]]:
+        """(user_id, device_id) لصاحب المفتاح، أو None لو المفتاح مش صالح"""
+        key_hash = hash_device_key(api_key)
+        identity = self._keys.get(key_hash)
+        if identity is not None or self._unknown.get(key_hash):
+            return identity
+
+        # ممكن يكون اتصدر من worker تاني ولسه الخريطة متحدثتش
+        doc = await get_database().device_keys.find_one({"key_hash": key_hash, "revoked": False})
+        if doc is None:
+            self._unknown.set(key_hash, True)
+            return None
+        identity = (doc["user_id"], doc["device_id"])
+        self._keys[key_hash] = identity
+        return identity
+
+    async def _refresh_loop(self):
+        while True:
+            try:
+                await asyncio.sleep(self.refresh_seconds)
+                await self.load()
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                print(f"Device key refresh error: {e}")
+
+
+device_keys = DeviceKeyRegistry(refresh_seconds=settings.device_key_refresh_seconds)
@@ -0,0 +1,76 @@
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+from ..database import get_database
+from .consumption_store import hourly_series
+
+
+async def build_consumption_features(
+    user_id: str,
+    days: int,
+    since: Optional[datetime] = None,
+    now: Optional[datetime] = None
+) -> dict:
+    """
+    Daily and hourly consumption series for the AI service over the last `days` days.
+
+    Daily totals come from the consumption_daily rollups and hourly totals from a
+    $group in Mongo, so the payload is at most days + 24 * days rows however often
+    the devices report.
+
+    With `since`, only rows from the UTC hour (hourly) and day (daily) containing it
+    are returned; "start" still reports the start of the full window.
+    """
+    db = get_database()
+    now = now or datetime.utcnow()
+    start = (now - timedelta(days=days - 1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    lower = start
+    if since is not None:
+        if since.tzinfo is not None:
+            since = since.astimezone(timezone.utc).replace(tzinfo=None)
+        lower = max(start, since.replace(minute=0, second=0, microsecond=0))
+
+    pipeline = [
+        {"$match": {"user_id": user_id, "date": {"$gte": lower.strftime("%Y-%m-%d")}}},
+        {"$group": {"_id": "$date", "total": {"$sum": "$total"}, "count": {"$sum": "$count"}}},
+        {"$sort": {"_id": 1}}
+    ]
+    daily = await db.consumption_daily.aggregate(pipeline).to_list(length=days)
+    hourly = await hourly_series(user_id, lower)
+
+    return {
+        "user_id": user_id,
+        "start": start,
+        "end": now,
+        "days": days,
+        "daily": [{"date": row["_id"], "total": float(row["total"]), "count": row["count"]} for row in daily],
+        "hourly": hourly
+    }
+
+
+async def build_daily_series_batch(user_ids: List[str], days: int, now: Optional[datetime] = None) -> dict:
+    """
+    Daily consumption totals over the last `days` days for many users in one
+    aggregation over the consumption_daily rollups, for the AI service's batched
+    forecasts. Each user's dates and totals come back as two parallel lists.
+    """
+    db = get_database()
+    now = now or datetime.utcnow()
+    start = (now - timedelta(days=days - 1)).replace(hour=0, minute=0, second=0, microsecond=0)
+
+    pipeline = [
+        {"$match": {"user_id": {"$in": user_ids}, "date": {"$gte": start.strftime("%Y-%m-%d")}}},
+        {"$group": {"_id": {"user_id": "$user_id", "date": "$date"}, "total": {"$sum": "$total"}}},
+        {"$sort": {"_id.user_id": 1, "_id.date": 1}},
+        {"$group": {"_id": "$_id.user_id", "dates": {"$push": "$_id.date"}, "totals": {"$push": "$total"}}}
+    ]
+    rows = await db.consumption_daily.aggregate(pipeline).to_list(length=len(user_ids))
+
+    return {
+        "start": start,
+        "end": now,
+        "days": days,
+        "users": [
+            {"user_id": row["_id"], "dates": row["dates"], "totals": [float(total) for total in row["totals"]]}
+            for row in rows
+        ]
+    }
@@ -0,0 +1,268 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import List, Optional
+from ..config import settings
+from ..database import get_database
+from .consumption_store import BUCKETS_COLLECTION
+from .ingest_guard import APPLIED_SEQ_FIELD, BatchTag, new_writer
+from .ingest_service import persist_readings
+
+logger = logging.getLogger(__name__)
+
+DEAD_LETTER_COLLECTION = "ingest_dead_letter"
+WRITERS_COLLECTION = "ingest_writers"
+WRITER_PRUNE_LEASE = "ingest_writer_prune"
+
+# كل collection بتشيل applied_seq.<writer> من الكتابات المتأمنة (ingest_guard)
+GUARDED_COLLECTIONS = (
+    "consumption_daily", "consumption_monthly", "consumption_stats", "plan_subscriptions", BUCKETS_COLLECTION
+)
+
+_STOP = object()
+
+
+class IngestBuffer:
+    """
+    In-process write-behind stage for the ingestion hot path.
+
+    Readings are acknowledged once they are queued. A single worker drains the queue
+    and hands batches to persist_readings every flush interval or every max batch
+    readings, whichever comes first, so inserts, device upserts and quota deductions
+    are merged per flush instead of paid per reading.
+
+    Clients already have their 201, so a failed flush is retried with exponential
+    backoff under the same batch tag, which keeps the writes it already made from
+    being applied twice (see ingest_guard). Nothing new is taken from the queue
+    meanwhile, so an outage turns into 503s at the edge instead of lost readings.
+    A batch that still fails after flush_max_attempts goes to ingest_dead_letter
+    with its tag and the buffer carries on under a new writer id, so
+    replay_dead_letters can run it again later without counting anything twice.
+
+    Every writer id is recorded in ingest_writers with the last time it flushed, so
+    prune_writer_marks can drop the applied_seq marks of writers that can no longer
+    retry anything.
+    """
+
+    def __init__(self, max_size: int, flush_interval_ms: int, flush_max_batch: int,
+                 flush_max_attempts: int, retry_base_ms: int, retry_max_ms: int):
+        self.max_size = max_size
+        self.flush_interval = flush_interval_ms / 1000
+        self.flush_max_batch = flush_max_batch
+        self.flush_max_attempts = max(1, flush_max_attempts)
+        self.retry_base = retry_base_ms / 1000
+        self.retry_max = retry_max_ms / 1000
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+        self._writer = new_writer()
+        self._seq = 0
+        self._writer_seen: Optional[datetime] = None
+        self.flushed = 0
+        self.retried = 0
+        self.dead_lettered = 0
+        self.dropped = 0
+        self.rejected = 0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done() and not self._closing
+
+    def start(self):
+        """تشغيل الـ worker (لازم يتنادى من جوه الـ event loop)"""
+        if self.running:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_size)
+        self._closing = False
+        self._task = asyncio.create_task(self._run())
+
+    def offer(self, reading: dict) -> bool:
+        """إضافة قراءة بدون انتظار - بترجع False لو الطابور مليان"""
+        if not self.running:
+            return False
+        try:
+            self._queue.put_nowait(reading)
+            return True
+        except asyncio.QueueFull:
+            self.rejected += 1
+            return False
+
+    async def put(self, reading: dict, timeout: float) -> bool:
+        """إضافة قراءة مع انتظار مكان في الطابور لحد timeout ثانية"""
+        if not self.running:
+            return False
+        try:
+            await asyncio.wait_for(self._queue.put(reading), timeout)
+            return True
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            return False
+
+    async def stop(self):
+        """تفريغ كل القراءات المتبقية في قاعدة البيانات ثم إيقاف الـ worker"""
+        if not self.running:
+            return
+        self._closing = True
+        await self._queue.put(_STOP)
+        await self._task
+        self._task = None
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self._queue.qsize() if self._queue else 0,
+            "queue_max_size": self.max_size,
+            "flushed": self.flushed,
+            "retried": self.retried,
+            "dead_lettered": self.dead_lettered,
+            "dropped": self.dropped,
+            "rejected": self.rejected
+        }
+
+    async def _collect(self) -> tuple:
+        """تجميع دفعة: بتستنى أول قراءة، وبعدها لحد ما الدفعة تكمل أو الوقت يخلص"""
+        loop = asyncio.get_running_loop()
+        first = await self._queue.get()
+        if first is _STOP:
+            return [], True
+
+        batch = [first]
+        deadline = loop.time() + self.flush_interval
+        while len(batch) < self.flush_max_batch:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(self._queue.get(), remaining)
+            except asyncio.TimeoutError:
+                break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    async def _flush(self, batch: List[dict]):
+        self._seq += 1
+        tag = BatchTag(self._writer, self._seq)
+        for attempt in range(1, self.flush_max_attempts + 1):
+            try:
+                await self._touch_writer()
+                await persist_readings(batch, tag=tag, retry=attempt > 1)
+                self.flushed += len(batch)
+                return
+            except Exception as e:
+                error = e
+            if attempt < self.flush_max_attempts:
+                delay = min(self.retry_base * 2 ** (attempt - 1), self.retry_max)
+                self.retried += 1
+                logger.warning(
+                    "Ingest flush %s/%d failed (attempt %d of %d, %d readings), retrying in %.1fs: %r",
+                    tag.writer, tag.seq, attempt, self.flush_max_attempts, len(batch), delay, error
+                )
+                await asyncio.sleep(delay)
+        await self._dead_letter(batch, tag, error)
+
+    async def _touch_writer(self):
+        """سجل إن الـ writer لسه شغال (مرة كل ingest_writer_heartbeat_seconds بس)"""
+        now = datetime.utcnow()
+        if self._writer_seen and (now - self._writer_seen).total_seconds() < settings.ingest_writer_heartbeat_seconds:
+            return
+        await get_database()[WRITERS_COLLECTION].update_one(
+            {"_id": self._writer}, {"$set": {"seen_at": now}}, upsert=True
+        )
+        self._writer_seen = now
+
+    async def _dead_letter(self, batch: List[dict], tag: BatchTag, error: Exception):
+        try:
+            await get_database()[DEAD_LETTER_COLLECTION].insert_one({
+                "writer": tag.writer,
+                "seq": tag.seq,
+                # الـ reconciliation بيستنى المستخدمين دول لحد الـ replay
+                "users": sorted({reading["user_id"] for reading in batch}),
+                "readings": batch,
+                "attempts": self.flush_max_attempts,
+                "error": repr(error),
+                "failed_at": datetime.utcnow()
+            })
+            self.dead_lettered += len(batch)
+            logger.error(
+                "Ingest flush %s/%d failed %d times, %d readings moved to %s: %r",
+                tag.writer, tag.seq, self.flush_max_attempts, len(batch), DEAD_LETTER_COLLECTION, error
+            )
+        except Exception:
+            self.dropped += len(batch)
+            logger.exception(
+                "Ingest flush %s/%d: %d readings lost, the dead-letter write failed too (flush error: %r)",
+                tag.writer, tag.seq, len(batch), error
+            )
+        # writer جديد: الدفعات الجاية متعديش الـ applied_seq بتاع الدفعة دي فالـ replay يفضل صح
+        self._writer, self._seq, self._writer_seen = new_writer(), 0, None
+
+    async def _run(self):
+        while True:
+            batch, stopping = await self._collect()
+            if batch:
+                await self._flush(batch)
+            if stopping:
+                break
+
+
+async def replay_dead_letters(limit: int = 100) -> dict:
+    """
+    Run dead-lettered flushes again, oldest first, under their original tags.
+    Replayed batches are deleted; batches that fail again stay for the next call.
+    """
+    db = get_database()
+    replayed = failed = 0
+    docs = await db[DEAD_LETTER_COLLECTION].find().sort("failed_at", 1).limit(limit).to_list(length=limit)
+    for doc in docs:
+        try:
+            await persist_readings(doc["readings"], tag=BatchTag(doc["writer"], doc["seq"]), retry=True)
+        except Exception:
+            failed += 1
+            logger.exception("Replay of dead-lettered flush %s/%d failed", doc["writer"], doc["seq"])
+            continue
+        await db[DEAD_LETTER_COLLECTION].delete_one({"_id": doc["_id"]})
+        replayed += 1
+    return {"replayed": replayed, "failed": failed, "remaining": await db[DEAD_LETTER_COLLECTION].count_documents({})}
+
+
+async def prune_writer_marks(retire_after_seconds: float) -> int:
+    """
+    Remove the applied_seq.<writer> marks of retired writers from every guarded
+    collection, so the documents do not keep one field per process start forever.
+
+    A writer only needs its marks while one of its batches can still run again: its
+    buffer retries the current batch (and flushes, refreshing seen_at, on every
+    attempt) and replay_dead_letters runs its parked batches. Writers not seen for
+    retire_after_seconds and without a batch in ingest_dead_letter are retired.
+    Returns the number of writers pruned.
+    """
+    db = get_database()
+    cutoff = datetime.utcnow() - timedelta(seconds=retire_after_seconds)
+    parked = set(await db[DEAD_LETTER_COLLECTION].distinct("writer"))
+    retired = [
+        doc["_id"]
+        async for doc in db[WRITERS_COLLECTION].find({"seen_at": {"$lt": cutoff}}, {"_id": 1})
+        if doc["_id"] not in parked
+    ]
+    for start in range(0, len(retired), 100):
+        fields = [f"{APPLIED_SEQ_FIELD}.{writer}" for writer in retired[start:start + 100]]
+        for collection in GUARDED_COLLECTIONS:
+            await db[collection].update_many(
+                {"$or": [{field: {"$exists": True}} for field in fields]},
+                {"$unset": {field: "" for field in fields}}
+            )
+        await db[WRITERS_COLLECTION].delete_many({"_id": {"$in": retired[start:start + 100]}})
+    if retired:
+        logger.info("Pruned applied_seq marks of %d retired ingest writers", len(retired))
+    return len(retired)
+
+
+ingest_buffer = IngestBuffer(
+    max_size=settings.ingest_queue_max_size,
+    flush_interval_ms=settings.ingest_flush_interval_ms,
+    flush_max_batch=settings.ingest_flush_max_batch,
+    flush_max_attempts=settings.ingest_flush_max_attempts,
+    retry_base_ms=settings.ingest_flush_retry_base_ms,
+    retry_max_ms=settings.ingest_flush_retry_max_ms
+)
@@ -0,0 +1,69 @@
+"""
+Apply-once writes for write-behind flushes.
+
+Every flush of the ingest buffer is tagged with its writer (a fresh id per buffer)
+and a sequence number that only grows within that writer. Each document a flush
+increments (bucket pushes, daily/monthly rollups, running statistics, the
+subscription's quota) keeps the highest sequence it has taken per writer under
+applied_seq.<writer>, and the guarded update only matches while that is below the
+flush's own sequence.
+
+A writer flushes one batch at a time and retries it before moving on, so running
+a batch again only touches the documents it has not updated yet. A guarded upsert
+of a document that already has the batch tries to insert a second copy and hits
+the collection's unique key: those duplicate-key errors mean "already applied".
+"""
+from typing import List, NamedTuple, Optional, Tuple
+from bson import ObjectId
+from pymongo.errors import BulkWriteError
+
+APPLIED_SEQ_FIELD = "applied_seq"
+DUPLICATE_KEY = 11000
+
+
+class BatchTag(NamedTuple):
+    writer: str
+    seq: int
+
+    @property
+    def field(self) -> str:
+        return f"{APPLIED_SEQ_FIELD}.{self.writer}"
+
+
+def new_writer() -> str:
+    # "w" عشان اسم الحقل ميبقاش أرقام بس (Mongo بيفهمه index في array)
+    return f"w{ObjectId()}"
+
+
+def guard_filter(filter_: dict, tag: Optional[BatchTag]) -> dict:
+    """الـ filter بيطابق بس المستندات اللي الدفعة دي لسه متطبقتش عليها"""
+    if tag is None:
+        return filter_
+    return {**filter_, tag.field: {"$not": {"$gte": tag.seq}}}
+
+
+def guard_update(filter_: dict, update: dict, tag: Optional[BatchTag]) -> Tuple[dict, dict]:
+    """(filter, update) of an operator update, guarded by the batch tag"""
+    if tag is None:
+        return filter_, update
+    return guard_filter(filter_, tag), {**update, "$max": {**update.get("$max", {}), tag.field: tag.seq}}
+
+
+def applied_mark(tag: Optional[BatchTag]) -> dict:
+    """The field to $set in a pipeline update that already matched guard_filter"""
+    return {tag.field: tag.seq} if tag is not None else {}
+
+
+def only_duplicates(error: BulkWriteError) -> bool:
+    details = error.details or {}
+    return not details.get("writeConcernErrors") and \
+        all(write_error.get("code") == DUPLICATE_KEY for write_error in details.get("writeErrors", []))
+
+
+async def bulk_write_once(collection, ops: List, tag: Optional[BatchTag]):
+    """bulk_write of guarded ops: duplicate keys from already applied upserts are fine"""
+    try:
+        await collection.bulk_write(ops, ordered=False)
+    except BulkWriteError as e:
+        if tag is None or not only_duplicates(e):
+            raise
@@ -0,0 +1,162 @@
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+from bson import ObjectId
+from pymongo import UpdateOne
+from ..config import settings
+from ..database import get_database
+from ..utils.response_cache import response_cache
+from .consumption_store import insert_readings
+from .consumption_stats import build_stats_ops
+from .ingest_guard import BatchTag, bulk_write_once, guard_update
+from .plan_service import deduct_quota_and_check_alerts, mark_inflight
+
+
+def normalize_timestamp(timestamp: Optional[datetime], now: datetime) -> datetime:
+    """توحيد توقيت القراءة: UTC بدون tzinfo زي باقي السجلات، ومفيش قراءات من المستقبل"""
+    if timestamp is None:
+        return now
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return min(timestamp, now)
+
+
+def new_reading(user_id: str, device_id: str, value: float, timestamp: datetime) -> dict:
+    """مستند قراءة جديد - الـ _id بيتولد هنا عشان نرجعه للعميل قبل ما القراءة تتكتب فعلياً"""
+    return {
+        "_id": ObjectId(),
+        "device_id": device_id,
+        "user_id": user_id,
+        "consumption_value": value,
+        "timestamp": timestamp
+    }
+
+
+def build_device_upsert(user_id: str, device_id: str, value: float, last_seen: datetime) -> UpdateOne:
+    """تحديث حالة الجهاز (أو إنشاؤه لو أول مرة) كعملية جاهزة للـ bulk_write"""
+    return UpdateOne(
+        {"device_id": device_id, "user_id": user_id},
+        {
+            "$set": {
+                "last_seen": last_seen,
+                "is_active": value > 0,
+                "value": value
+            },
+            "$setOnInsert": {
+                "device_name": f"Device {device_id}",
+                "created_at": last_seen
+            }
+        },
+        upsert=True
+    )
+
+
+def build_rollup_ops(readings: List[dict], tag: Optional[BatchTag] = None) -> Tuple[List[UpdateOne], List[UpdateOne]]:
+    """
+    Merge readings into $inc upserts for the daily (user, device, day) and monthly
+    (user, month) rollups. Days and months are UTC, like the $dateToString grouping
+    the dashboard endpoints used to run over raw readings.
+    """
+    daily: Dict[tuple, list] = defaultdict(lambda: [0.0, 0])
+    monthly: Dict[tuple, list] = defaultdict(lambda: [0.0, 0])
+    for reading in readings:
+        day = reading["timestamp"].strftime("%Y-%m-%d")
+        for bucket in (daily[(reading["user_id"], reading["device_id"], day)], monthly[(reading["user_id"], day[:7])]):
+            bucket[0] += reading["consumption_value"]
+            bucket[1] += 1
+
+    daily_ops = [
+        UpdateOne(
+            *guard_update({"user_id": user_id, "device_id": device_id, "date": day}, {"$inc": {"total": total, "count": count}}, tag),
+            upsert=True
+        )
+        for (user_id, device_id, day), (total, count) in daily.items()
+    ]
+    monthly_ops = [
+        UpdateOne(
+            *guard_update({"user_id": user_id, "month": month}, {"$inc": {"total": total, "count": count}}, tag),
+            upsert=True
+        )
+        for (user_id, month), (total, count) in monthly.items()
+    ]
+    return daily_ops, monthly_ops
+
+
+async def persist_readings(
+    readings: List[dict],
+    received_at: Optional[datetime] = None,
+    tag: Optional[BatchTag] = None,
+    retry: bool = False
+) -> Dict[str, float]:
+    """
+    Persist a batch of raw readings with one round-trip per collection.
+
+    Each reading is a consumption document (device_id, user_id, consumption_value,
+    timestamp). Device upserts are merged so every (user, device) pair is written once
+    with its latest reading, daily and monthly rollups and the running statistics
+    get one upsert per bucket, and quota is deducted once per user with the summed
+    value.
+
+    The users' subscriptions are tagged in-flight before the raw insert and the
+    deduction clears the tag, so reconciliation never counts a reading that is
+    stored but not yet deducted.
+
+    With a tag every write applies once per batch (see ingest_guard), so a batch
+    that failed partway can be run again with the same tag and retry=True. Every
+    user's deduction is attempted even when an earlier one fails; the first error
+    is raised after the loop.
+    Returns the consumed total per user.
+    """
+    if not readings:
+        return {}
+
+    db = get_database()
+
+    # آخر قراءة لكل جهاز + إجمالي الاستهلاك لكل مستخدم
+    latest: Dict[tuple, dict] = {}
+    totals: Dict[str, float] = defaultdict(float)
+    per_user: Dict[str, List[Tuple[datetime, float]]] = defaultdict(list)
+    for reading in readings:
+        key = (reading["user_id"], reading["device_id"])
+        if key not in latest or reading["timestamp"] >= latest[key]["timestamp"]:
+            latest[key] = reading
+        totals[reading["user_id"]] += reading["consumption_value"]
+        per_user[reading["user_id"]].append((reading["timestamp"], reading["consumption_value"]))
+
+    # قبل القراءات الخام: الـ reconciliation ميصححش اشتراك عنده قراءات مكتوبة ولسه متخصمتش
+    batch_key = f"{tag.writer}:{tag.seq}" if tag else str(ObjectId())
+    await mark_inflight(list(totals), batch_key, tag)
+
+    device_ops = [
+        build_device_upsert(
+            user_id,
+            device_id,
+            reading["consumption_value"],
+            received_at or reading["timestamp"]
+        )
+        for (user_id, device_id), reading in latest.items()
+    ]
+    await db.devices.bulk_write(device_ops, ordered=False)
+    await insert_readings(readings, tag, retry)
+
+    # التجميعات اليومية والشهرية اللي بتقرا منها شاشات الـ dashboard
+    daily_ops, monthly_ops = build_rollup_ops(readings, tag)
+    await bulk_write_once(db.consumption_daily, daily_ops, tag)
+    await bulk_write_once(db.consumption_monthly, monthly_ops, tag)
+    # الإحصائيات التراكمية اللي التحليل والتوقع بيقروا منها في O(1) (بس مع analysis_source = "stats")
+    if settings.consumption_stats_enabled:
+        await bulk_write_once(db.consumption_stats, build_stats_ops(readings, tag), tag)
+
+    failure = None
+    for user_id, total in totals.items():
+        try:
+            await deduct_quota_and_check_alerts(user_id, total, tag, per_user[user_id], batch_key)
+        except Exception as e:
+            # مستخدم واحد بيفشل ميوقفش الخصم لباقي المستخدمين في الدفعة
+            failure = failure or e
+        # شاشات الـ dashboard المتخزنة للمستخدم ده مبقتش صحيحة
+        response_cache.invalidate_user(user_id)
+    if failure:
+        raise failure
+
+    return dict(totals)
@@ -0,0 +1,31 @@
+import os
+import socket
+from datetime import datetime, timedelta
+from pymongo.errors import DuplicateKeyError
+from ..database import get_database
+
+# كل worker (process) ليه holder مختلف
+HOLDER = f"{socket.gethostname()}:{os.getpid()}"
+
+
+async def acquire_lease(name: str, ttl_seconds: float) -> bool:
+    """
+    Take (or renew) the named lease for ttl_seconds. Returns False while another
+    worker holds it, so background jobs that must run once per deployment (not
+    once per uvicorn worker) only run where this returns True.
+    """
+    now = datetime.utcnow()
+    try:
+        await get_database().leases.update_one(
+            {"_id": name, "$or": [{"expires_at": {"$lte": now}}, {"holder": HOLDER}]},
+            {"$set": {"holder": HOLDER, "acquired_at": now, "expires_at": now + timedelta(seconds=ttl_seconds)}},
+            upsert=True
+        )
+        return True
+    except DuplicateKeyError:
+        # المستند موجود ومحجوز لـ worker تاني: الـ upsert حاول يعمل نسخة بنفس الـ _id
+        return False
+
+
+async def release_lease(name: str):
+    await get_database().leases.delete_one({"_id": name, "holder": HOLDER})
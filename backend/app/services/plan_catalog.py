@@ -0,0 +1,100 @@
+import asyncio
+import time
+from typing import Dict, List, Optional
+from ..config import settings
+from ..database import get_database
+
+# مستند الإصدار المشترك بين كل الـ workers
+CATALOG_VERSION_ID = "plans"
+
+
+class PlanCatalog:
+    """
+    Process-local copy of the plans collection.
+
+    The catalog is loaded at startup and served from memory. A version stamp in
+    db.catalog_versions is bumped whenever plans change; once the local copy is older
+    than the TTL, the stamp is checked in the background and the catalog is reloaded
+    only when another worker (or a script) has bumped it.
+    """
+
+    def __init__(self, ttl_seconds: int):
+        self.ttl_seconds = ttl_seconds
+        self.version: Optional[int] = None
+        self._plans: Dict[str, dict] = {}
+        self._checked_at = 0.0
+        self._refresh_task: Optional[asyncio.Task] = None
+
+    @property
+    def loaded(self) -> bool:
+        return self.version is not None
+
+    @property
+    def etag(self) -> str:
+        return f'"plans-{self.version}"'
+
+    async def load(self):
+        """تحميل الباقات كلها ومعاها رقم الإصدار الحالي"""
+        db = get_database()
+        version = await self._read_version()
+        plans = await db.plans.find().to_list(length=None)
+        self._plans = {str(plan["_id"]): plan for plan in plans}
+        self.version = version
+        self._checked_at = time.monotonic()
+
+    async def refresh_if_changed(self):
+        """إعادة التحميل فقط لو رقم الإصدار في قاعدة البيانات اتغير"""
+        version = await self._read_version()
+        if version != self.version:
+            await self.load()
+        else:
+            self._checked_at = time.monotonic()
+
+    async def invalidate(self):
+        """رفع رقم الإصدار (عشان باقي الـ workers) وإعادة التحميل محلياً"""
+        await bump_catalog_version(get_database())
+        await self.load()
+
+    async def all_plans(self) -> List[dict]:
+        await self._ensure_fresh()
+        return list(self._plans.values())
+
+    async def get(self, plan_id) -> Optional[dict]:
+        await self._ensure_fresh()
+        plan = self._plans.get(str(plan_id))
+        if plan is None:
+            # ممكن تكون باقة جديدة اتعملت من worker تاني ولسه موصلتناش
+            await self.refresh_if_changed()
+            plan = self._plans.get(str(plan_id))
+        return plan
+
+    async def _ensure_fresh(self):
+        if not self.loaded:
+            await self.load()
+            return
+        stale = time.monotonic() - self._checked_at > self.ttl_seconds
+        if stale and (self._refresh_task is None or self._refresh_task.done()):
+            self._refresh_task = asyncio.create_task(self._background_refresh())
+
+    async def _background_refresh(self):
+        try:
+            await self.refresh_if_changed()
+        except Exception as e:
+            print(f"Plan catalog refresh error: {e}")
+
+    async def _read_version(self) -> int:
+        db = get_database()
+        meta = await db.catalog_versions.find_one({"_id": CATALOG_VERSION_ID})
+        return meta.get("version", 0) if meta else 0
+
+
+async def bump_catalog_version(db):
+    """أي حد بيعدل في db.plans لازم ينادي دي عشان الكاش يتحدث"""
+    await db.catalog_versions.update_one(
+        {"_id": CATALOG_VERSION_ID},
+        {"$inc": {"version": 1}},
+        upsert=True
+    )
+
+
+plan_catalog = PlanCatalog(ttl_seconds=settings.plan_catalog_ttl_seconds)
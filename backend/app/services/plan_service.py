@@ -1,93 +1,209 @@
 from datetime import datetime
-from bson import ObjectId
+from typing import Dict, List, Optional, Tuple
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
 from ..database import get_database
+from .ingest_guard import BatchTag, applied_mark, guard_filter
+from .plan_catalog import plan_catalog
 
-async def deduct_quota_and_check_alerts(user_id: str, consumption_value: float):
-    """خصم الاستهلاك من الباقة والتحقق من التنبيهات"""
-    db = get_database()
-    
-    # البحث عن الاشتراك النشط
-    subscription = await db.plan_subscriptions.find_one({
-        "user_id": user_id,
-        "is_active": True
-    })
-    
+# المستويات اللي عندها هنبعت تنبيه
+ALERT_THRESHOLDS = [
+    {"percentage": 70, "alert_type": "70%"},
+    {"percentage": 90, "alert_type": "90%"},
+    {"percentage": 100, "alert_type": "100%"}
+]
+
+# القراءات اللي اتكتبت خام ولسه متخصمتش، عشان الـ reconciliation ميعدهاش مرتين
+INFLIGHT_FIELD = "ingest_inflight"
+
+
+# start_date الاشتراك النشط لكل مستخدم، متخزن في الـ process. الخصم بيفلتر عليه،
+# فلو اتغير (اشتراك جديد) الخصم مش بيلاقي المستند وبنقرا القيمة الجديدة
+_start_dates: Dict[str, Optional[datetime]] = {}
+
+
+async def active_start_date(user_id: str, refresh: bool = False) -> Tuple[bool, Optional[datetime]]:
+    """(found, start_date) of the user's active subscription, from the cache unless refresh"""
+    if not refresh and user_id in _start_dates:
+        return True, _start_dates[user_id]
+    subscription = await get_database().plan_subscriptions.find_one(
+        {"user_id": user_id, "is_active": True}, {"start_date": 1}
+    )
     if not subscription:
-        return
-    
-    # حساب المتبقي الجديد
-    new_remaining = subscription["remaining_quota"] - consumption_value
-    if new_remaining < 0:
-        new_remaining = 0
-    
-    # تحديث قيمة الباقة في قاعدة البيانات
-    await db.plan_subscriptions.update_one(
-        {"_id": subscription["_id"]},
-        {
-            "$set": {
-                "remaining_quota": new_remaining,
-                "updated_at": datetime.utcnow()
+        _start_dates.pop(user_id, None)
+        return False, None
+    _start_dates[user_id] = subscription.get("start_date")
+    return True, _start_dates[user_id]
+
+
+def counted_since_start(readings: List[Tuple[datetime, float]], start_date: Optional[datetime]) -> float:
+    """The part of a user's readings timestamped at or after start_date (sum_since's window)"""
+    if start_date is None:
+        return sum(value for _, value in readings)
+    return sum(value for timestamp, value in readings if timestamp >= start_date)
+
+
+async def mark_inflight(user_ids: List[str], batch_key: str, tag: Optional[BatchTag] = None):
+    """علامة على اشتراكات الدفعة قبل كتابة القراءات الخام، والخصم بيشيلها في نفس الكتابة"""
+    await get_database().plan_subscriptions.update_many(
+        guard_filter({"user_id": {"$in": user_ids}, "is_active": True}, tag),
+        {"$push": {INFLIGHT_FIELD: {"batch": batch_key, "at": datetime.utcnow()}}}
+    )
+
+
+async def deduct_quota_and_check_alerts(
+    user_id: str,
+    consumption_value: float,
+    tag: Optional[BatchTag] = None,
+    readings: Optional[List[Tuple[datetime, float]]] = None,
+    batch_key: Optional[str] = None
+):
+    """
+    خصم الاستهلاك من الباقة والتحقق من التنبيهات (مع tag الخصم بيحصل مرة واحدة للدفعة).
+    readings = (timestamp, value) للقراءات: القراءات اللي قبل start_date بتتخصم من
+    الكوتا بس مش بتتعد في consumed_since_start (التقسيم بيحصل هنا على start_date من
+    active_start_date، والـ update بياخد رقم واحد). batch_key بيشيل علامة mark_inflight.
+    """
+    db = get_database()
+    filter_ = {"user_id": user_id, "is_active": True}
+    counted = consumption_value
+    if readings:
+        found, start_date = await active_start_date(user_id)
+        if not found:
+            return
+        filter_["start_date"] = start_date
+        counted = counted_since_start(readings, start_date)
+    inflight = {}
+    if batch_key:
+        inflight[INFLIGHT_FIELD] = {
+            "$filter": {
+                "input": {"$ifNull": [f"${INFLIGHT_FIELD}", []]},
+                "as": "mark",
+                "cond": {"$ne": ["$$mark.batch", batch_key]}
             }
         }
+
+    # خصم ذري في round-trip واحد: الطرح والتقريب للصفر بيحصلوا جوه المونجو
+    # فالقراءات المتزامنة من أكتر من جهاز لنفس المستخدم مش بتضيع خصومات بعض
+    subscription = await db.plan_subscriptions.find_one_and_update(
+        guard_filter(filter_, tag),
+        [
+            {
+                "$set": {
+                    "remaining_quota": {
+                        "$max": [0, {"$subtract": ["$remaining_quota", consumption_value]}]
+                    },
+                    # إجمالي الاستهلاك من بداية الاشتراك بيتحدث في نفس الكتابة
+                    "consumed_since_start": {
+                        "$add": [{"$ifNull": ["$consumed_since_start", 0]}, counted]
+                    },
+                    "updated_at": datetime.utcnow(),
+                    **inflight,
+                    **applied_mark(tag)
+                }
+            }
+        ],
+        return_document=ReturnDocument.AFTER
     )
-    
-    # تحديث الكائن subscription بالقيمة الجديدة لاستخدامه في التحقق من التنبيهات
-    subscription["remaining_quota"] = new_remaining
+
+    if not subscription and readings:
+        found, current = await active_start_date(user_id, refresh=True)
+        if found and current != start_date:
+            # اشتراك جديد من وقت ما اتخزن الـ start_date: نعيد الحساب عليه
+            return await deduct_quota_and_check_alerts(user_id, consumption_value, tag, readings, batch_key)
+
+    if not subscription and tag is not None:
+        # الدفعة دي اتخصمت في محاولة سابقة، بس التنبيهات ممكن تكون ماكملتش
+        subscription = await db.plan_subscriptions.find_one({"user_id": user_id, "is_active": True})
+
+    if not subscription:
+        return
+
     await check_and_create_alerts(user_id, subscription)
 
 
 async def check_and_create_alerts(user_id: str, subscription: dict):
     """التحقق من تخطي حد الاستهلاك وإنشاء تنبيه"""
     db = get_database()
-    
-    # جلب تفاصيل الخطة لمعرفة الحد الأقصى (Total Quota)
-    plan_id = subscription["plan_id"]
-    if isinstance(plan_id, str):
-        try: plan_id = ObjectId(plan_id)
-        except: pass
-    
-    plan = await db.plans.find_one({"_id": plan_id})
-    if not plan:
-        return
-    
-    total_quota = plan.get("total_quota", 0)
+
+    # الحد الأقصى (Total Quota) محفوظ على الاشتراك نفسه
+    total_quota = subscription.get("total_quota")
+    if total_quota is None:
+        total_quota = await backfill_subscription_alert_state(subscription)
+        if total_quota is None:
+            return
+
     remaining_quota = subscription["remaining_quota"]
     used_quota = total_quota - remaining_quota
-    
+
     # حساب النسبة المئوية للاستهلاك
     usage_percentage = (used_quota / total_quota) * 100 if total_quota > 0 else 0
-    
-    # المستويات اللي عندها هنبعت تنبيه
-    thresholds = [
-        {"percentage": 70, "alert_type": "70%"},
-        {"percentage": 90, "alert_type": "90%"},
-        {"percentage": 100, "alert_type": "100%"}
+
+    # الحالة الشائعة: مفيش حد جديد اتعدى => مفيش أي query إضافية
+    fired = set(subscription.get("alerts_fired", []))
+    crossed = [
+        threshold for threshold in ALERT_THRESHOLDS
+        if usage_percentage >= threshold["percentage"] and threshold["alert_type"] not in fired
     ]
-    
-    for threshold in thresholds:
-        if usage_percentage >= threshold["percentage"]:
-            # التأكد إن التنبيه متبعثش قبل كدة في نفس دورة الاشتراك الحالية
-            existing_alert = await db.alerts.find_one({
-                "user_id": user_id,
-                "alert_type": threshold["alert_type"],
-                "created_at": {"$gte": subscription.get("start_date", datetime.utcnow())}
-            })
-            
-            if not existing_alert:
-                # إعداد رسالة التنبيه
-                message = f"لقد استهلكت {threshold['percentage']}% من سعة باقتك."
-                if threshold["percentage"] == 100:
-                    message = "تحذير: لقد استهلكت باقتك بالكامل (100%)."
-                
-                # إنشاء كائن التنبيه مع إضافة حقل created_at المهم جداً
-                alert_dict = {
-                    "user_id": user_id,
-                    "alert_type": threshold["alert_type"],
-                    "message": message,
-                    "threshold_percentage": float(threshold["percentage"]),
-                    "current_usage_percentage": float(usage_percentage),
-                    "created_at": datetime.utcnow()  # الحقل ده هو اللي كان ناقص وبيسبب الـ 500 Error
-                }
-                
-                await db.alerts.insert_one(alert_dict)
-                print(f"🚨 Alert Created: {threshold['percentage']}% for user {user_id}")
\ No newline at end of file
+
+    for threshold in crossed:
+        # حجز الحد بشكل ذري: أول قراءة توصله بس هي اللي تنشئ التنبيه
+        claimed = await db.plan_subscriptions.update_one(
+            {"_id": subscription["_id"], "alerts_fired": {"$ne": threshold["alert_type"]}},
+            {"$addToSet": {"alerts_fired": threshold["alert_type"]}}
+        )
+        if claimed.modified_count == 0:
+            continue
+
+        # إعداد رسالة التنبيه
+        message = f"لقد استهلكت {threshold['percentage']}% من سعة باقتك."
+        if threshold["percentage"] == 100:
+            message = "تحذير: لقد استهلكت باقتك بالكامل (100%)."
+
+        # إنشاء كائن التنبيه مع إضافة حقل created_at المهم جداً
+        alert_dict = {
+            "user_id": user_id,
+            "subscription_id": str(subscription["_id"]),
+            "alert_type": threshold["alert_type"],
+            "message": message,
+            "threshold_percentage": float(threshold["percentage"]),
+            "current_usage_percentage": float(usage_percentage),
+            "created_at": datetime.utcnow()  # الحقل ده هو اللي كان ناقص وبيسبب الـ 500 Error
+        }
+
+        # الـ unique index على (subscription_id, alert_type) بيمنع التكرار
+        try:
+            await db.alerts.insert_one(alert_dict)
+        except DuplicateKeyError:
+            continue
+        print(f"🚨 Alert Created: {threshold['percentage']}% for user {user_id}")
+
+
+async def backfill_subscription_alert_state(subscription: dict) -> Optional[float]:
+    """
+    Copy total_quota and the already fired thresholds onto a subscription created
+    before they were stored there. Runs once per legacy subscription.
+    """
+    db = get_database()
+
+    plan = await plan_catalog.get(subscription["plan_id"])
+    if not plan:
+        return None
+
+    total_quota = plan.get("total_quota", 0)
+    existing = await db.alerts.distinct("alert_type", {
+        "user_id": subscription["user_id"],
+        "created_at": {"$gte": subscription.get("start_date", datetime.utcnow())}
+    })
+    fired = [t["alert_type"] for t in ALERT_THRESHOLDS if t["alert_type"] in existing]
+
+    await db.plan_subscriptions.update_one(
+        {"_id": subscription["_id"]},
+        {
+            "$set": {"total_quota": total_quota},
+            "$addToSet": {"alerts_fired": {"$each": fired}}
+        }
+    )
+    subscription["total_quota"] = total_quota
+    subscription["alerts_fired"] = list(set(subscription.get("alerts_fired", [])) | set(fired))
+    return total_quota
@@ -0,0 +1,63 @@
+from datetime import datetime, timedelta
+from ..config import settings
+from ..database import get_database
+from .consumption_store import sum_since
+from .plan_service import INFLIGHT_FIELD
+
+RECONCILE_LEASE = "reconcile_subscription_totals"
+
+
+async def sum_consumption_since(user_id: str, start_date: datetime) -> float:
+    """مجموع القراءات الخام للمستخدم من تاريخ معين (بأي layout للتخزين)"""
+    return await sum_since(user_id, start_date)
+
+
+async def reconcile_subscription_totals(tolerance: float = 0.001) -> int:
+    """
+    Compare consumed_since_start on every active subscription with the raw readings
+    timestamped since its start_date and set it to their sum where the two drift
+    apart. Returns the number of subscriptions corrected.
+
+    The raw readings are summed after the counter is read, and the correction is a
+    compare-and-set on that counter value, so it is dropped if a deduction landed
+    meanwhile. It is also dropped while an ingest batch of the user sits between
+    its raw insert and its deduction: mark_inflight tags the subscription before
+    the insert and the deduction removes the tag. Tags older than
+    reconcile_inflight_timeout_seconds belong to batches lost in a crash and are
+    ignored (and cleared). Users with a batch parked in ingest_dead_letter are
+    skipped until it is replayed.
+
+    Run it under the reconciliation lease so only one worker corrects at a time.
+    """
+    db = get_database()
+    fixed = 0
+    cutoff = datetime.utcnow() - timedelta(seconds=settings.reconcile_inflight_timeout_seconds)
+    parked = set(await db.ingest_dead_letter.distinct("users"))
+
+    cursor = db.plan_subscriptions.find(
+        {"is_active": True},
+        {"user_id": 1, "start_date": 1, "consumed_since_start": 1}
+    )
+    async for subscription in cursor:
+        if subscription["user_id"] in parked:
+            continue
+        recorded = subscription.get("consumed_since_start")
+        actual = await sum_consumption_since(subscription["user_id"], subscription["start_date"])
+        if recorded is not None and abs(actual - recorded) <= tolerance:
+            continue
+
+        result = await db.plan_subscriptions.update_one(
+            {
+                "_id": subscription["_id"],
+                "consumed_since_start": recorded,
+                INFLIGHT_FIELD: {"$not": {"$elemMatch": {"at": {"$gt": cutoff}}}}
+            },
+            {"$set": {"consumed_since_start": actual}, "$pull": {INFLIGHT_FIELD: {"at": {"$lte": cutoff}}}}
+        )
+        if result.modified_count == 0:
+            continue
+        fixed += 1
+        print(f"Reconciliation: set consumed_since_start for user {subscription['user_id']} "
+              f"to {actual:.4f} kWh (was {recorded})")
+
+    return fixed
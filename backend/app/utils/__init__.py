@@ -1,4 +1,4 @@
 from .auth import verify_password, get_password_hash, create_access_token, verify_token
-from .dependencies import get_current_user
+from .dependencies import get_current_user, invalidate_user
 
-__all__ = ["verify_password", "get_password_hash", "create_access_token", "verify_token", "get_current_user"]
+__all__ = ["verify_password", "get_password_hash", "create_access_token", "verify_token", "get_current_user", "invalidate_user"]
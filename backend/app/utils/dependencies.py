@@ -1,12 +1,41 @@
-from fastapi import Depends, HTTPException, status
+import time
+from fastapi import Depends, HTTPException, status, Header
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from ..config import settings
 from ..database import get_database
 from ..utils.auth import verify_token
+from ..utils.cache import TTLCache
 from ..models.user import User
 from typing import Optional
 
 security = HTTPBearer(auto_error=False)
 
+# كاش التوكنات اللي اتأكدنا منها: التوكن => الـ claims، والتوكن => بيانات المستخدم
+claims_cache = TTLCache(max_size=settings.auth_cache_max_size, ttl_seconds=settings.auth_cache_ttl_seconds)
+# الـ principal بيعيش وقت أقصر: هو اللي بيتأثر لو المستخدم اتغير أو اتمسح
+principal_cache = TTLCache(max_size=settings.auth_cache_max_size, ttl_seconds=settings.auth_principal_ttl_seconds)
+
+
+def _token_lifetime(payload: dict) -> Optional[float]:
+    """الوقت الباقي على انتهاء التوكن عشان الكاش ميعيشش أكتر منه"""
+    exp = payload.get("exp")
+    return exp - time.time() if exp is not None else None
+
+
+def invalidate_user(user_id: Optional[str] = None, email: Optional[str] = None) -> int:
+    """
+    Drop cached principals for a user. Every route that changes or deletes a user
+    document (password, email, deactivation) must call it. It only clears this
+    worker's cache: the other workers keep serving the old principal for at most
+    auth_principal_ttl_seconds.
+    """
+    removed = principal_cache.invalidate_where(
+        lambda principal: principal["id"] == user_id or principal["email"] == email
+    )
+    if email is not None:
+        claims_cache.invalidate_where(lambda claims: claims.get("sub") == email)
+    return removed
+
 
 async def get_current_user(
 #     credentials: Optional[HTTPAuthorizationCredentials] = Depends(security)
@@ -32,7 +61,16 @@ credentials: Optional[HTTPAuthorizationCredentials] = Depends(security)
         )
 
     token = credentials.credentials
-    payload = verify_token(token)
+
+    principal = principal_cache.get(token)
+    if principal is not None:
+        return dict(principal)
+
+    payload = claims_cache.get(token)
+    if payload is None:
+        payload = verify_token(token)
+        if payload is not None:
+            claims_cache.set(token, payload, ttl=_token_lifetime(payload))
     
     if payload is None:
         print(f"DEBUG: Token verification failed for token: {token[:10]}...") 
@@ -62,8 +100,46 @@ credentials: Optional[HTTPAuthorizationCredentials] = Depends(security)
             detail="User not found",
         )
     
-    return {
+    principal = {
         "id": str(user["_id"]),
         "email": user["email"],
         "username": user["username"]
     }
+    principal_cache.set(token, principal, ttl=_token_lifetime(payload))
+    return dict(principal)
+
+
+async def get_ingest_principal(
+    x_device_key: Optional[str] = Header(None, alias="X-Device-Key"),
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(security)
+) -> dict:
+    """
+    Principal for the consumption ingest routes.
+
+    A device API key (X-Device-Key) resolves from memory to its owner and device
+    without touching the database. Without one, the regular user JWT path is used.
+    """
+    if x_device_key:
+        # import محلي عشان services بتستخدم utils (circular import)
+        from ..services.device_keys import device_keys
+
+        identity = await device_keys.resolve(x_device_key)
+        if identity is None:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Invalid device key",
+            )
+        user_id, device_id = identity
+        return {"id": user_id, "device_id": device_id}
+
+    return await get_current_user(credentials)
+
+
+def ensure_device_allowed(principal: dict, device_id: str):
+    """مفتاح الجهاز بيسمح بالكتابة لنفس الجهاز بس"""
+    allowed = principal.get("device_id")
+    if allowed is not None and allowed != device_id:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Device key is not valid for this device",
+        )
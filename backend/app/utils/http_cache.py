@@ -0,0 +1,17 @@
+from fastapi import Request, Response
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """هل العميل عنده نفس النسخة بالفعل (If-None-Match)؟"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    candidates = [tag.strip().removeprefix("W/") for tag in header.split(",")]
+    return etag.removeprefix("W/") in candidates
+
+
+def not_modified(etag: str) -> Response:
+    """رد 304 فاضي مع نفس الـ ETag"""
+    return Response(status_code=304, headers={"ETag": etag})
@@ -0,0 +1,227 @@
+"""
+Shared outbound HTTP client: one keep-alive pool per upstream service, a deadline
+budget per call, retries with full jitter for idempotent requests and a circuit
+breaker that fails fast while the upstream is down.
+
+ai_service/services/http_client.py carries the same classes for the AI service (the
+two apps are built into separate images). Keep them in sync.
+"""
+import asyncio
+import random
+import time
+from typing import Optional
+import httpx
+from ..config import settings
+
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS"}
+RETRY_STATUS_CODES = {502, 503, 504}
+
+
+class CircuitOpenError(httpx.TransportError):
+    """Raised without touching the network while the circuit breaker is open"""
+
+
+class CircuitBreaker:
+    """
+    closed -> open after failure_threshold consecutive failures; open -> half-open
+    after reset_timeout seconds, when a single trial call is let through; the trial
+    closes the circuit on success or re-opens it on failure.
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial_in_flight = False
+        self.rejected = 0
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def retry_after(self) -> float:
+        if self.opened_at is None:
+            return 0.0
+        return max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half-open" and not self.trial_in_flight:
+            self.trial_in_flight = True
+            return True
+        self.rejected += 1
+        return False
+
+    def release_trial(self):
+        """Let the next call be the trial again (the current one ended without a result)"""
+        self.trial_in_flight = False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        self.trial_in_flight = False
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+
+class ServiceClient:
+    """
+    httpx.AsyncClient wrapper owned by the app: start() on startup, close() on
+    shutdown. Every call gets a total time budget (deadline); each attempt only gets
+    what is left of it, so retries never stretch a call past its deadline.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        base_url: str = "",
+        *,
+        max_connections: int = 100,
+        max_keepalive_connections: int = 20,
+        keepalive_expiry: float = 30.0,
+        http2: bool = False,
+        connect_timeout: float = 2.0,
+        deadline: float = 10.0,
+        retries: int = 2,
+        backoff_base: float = 0.1,
+        breaker_threshold: int = 5,
+        breaker_reset_seconds: float = 15.0,
+        headers: Optional[dict] = None
+    ):
+        self.name = name
+        self.base_url = base_url
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry
+        )
+        self.http2 = http2
+        self.connect_timeout = connect_timeout
+        self.deadline = deadline
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.headers = headers or {}
+        self.breaker = CircuitBreaker(breaker_threshold, breaker_reset_seconds)
+        self._client: Optional[httpx.AsyncClient] = None
+        self.requests = 0
+        self.retried = 0
+        self.failed = 0
+
+    async def start(self):
+        if self._client is not None:
+            return
+        http2 = self.http2
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                print(f"{self.name} client: HTTP/2 requested but the h2 package is not installed, using HTTP/1.1")
+                http2 = False
+        self._client = httpx.AsyncClient(
+            base_url=self.base_url,
+            limits=self.limits,
+            http2=http2,
+            headers=self.headers,
+            timeout=httpx.Timeout(self.deadline, connect=self.connect_timeout)
+        )
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def get(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("GET", url, **kwargs)
+
+    async def request(self, method: str, url: str, *, deadline: Optional[float] = None, **kwargs) -> httpx.Response:
+        """
+        Send a request within `deadline` seconds (the client default if omitted).
+        Idempotent methods are retried on transport errors and 502/503/504.
+        Raises CircuitOpenError while the upstream is considered down.
+        """
+        if self._client is None:
+            await self.start()
+        method = method.upper()
+        budget = deadline if deadline is not None else self.deadline
+        expires_at = time.monotonic() + budget
+        attempts = 1 + (self.retries if method in IDEMPOTENT_METHODS else 0)
+        self.requests += 1
+
+        for attempt in range(attempts):
+            if not self.breaker.allow():
+                self.failed += 1
+                raise CircuitOpenError(f"{self.name} circuit is open")
+
+            remaining = expires_at - time.monotonic()
+            if remaining <= 0:
+                self.breaker.release_trial()
+                self.failed += 1
+                raise httpx.TimeoutException(f"{self.name} deadline of {budget}s exceeded")
+
+            # الـ attempt ده هو الـ trial لو الـ breaker كان half-open
+            trial = self.breaker.trial_in_flight
+            try:
+                response = await self._client.request(
+                    method, url,
+                    timeout=httpx.Timeout(remaining, connect=min(self.connect_timeout, remaining)),
+                    **kwargs
+                )
+            except httpx.TransportError:
+                self.breaker.record_failure()
+                if attempt == attempts - 1:
+                    self.failed += 1
+                    raise
+            else:
+                if response.status_code not in RETRY_STATUS_CODES:
+                    self.breaker.record_success()
+                    return response
+                self.breaker.record_failure()
+                if attempt == attempts - 1:
+                    return response
+            finally:
+                # CancelledError أو أي exception تاني ماسجلش نتيجة: الـ trial لازم يتساب
+                # وإلا الـ breaker يفضل half-open رافض كل الطلبات للأبد
+                if trial:
+                    self.breaker.release_trial()
+
+            # full jitter: نوم عشوائي بين 0 والـ backoff، ومن غير ما نعدي الـ deadline
+            self.retried += 1
+            delay = random.uniform(0, self.backoff_base * (2 ** attempt))
+            await asyncio.sleep(min(delay, max(0.0, expires_at - time.monotonic())))
+
+    def stats(self) -> dict:
+        return {
+            "state": self.breaker.state,
+            "consecutive_failures": self.breaker.failures,
+            "requests": self.requests,
+            "retried": self.retried,
+            "failed": self.failed,
+            "rejected_by_breaker": self.breaker.rejected
+        }
+
+
+# الـ client الوحيد للـ AI service، بيتفتح في startup ويتقفل في shutdown
+ai_client = ServiceClient(
+    "ai_service",
+    settings.ai_service_url,
+    max_connections=settings.ai_client_max_connections,
+    max_keepalive_connections=settings.ai_client_max_keepalive,
+    keepalive_expiry=settings.ai_client_keepalive_expiry_seconds,
+    http2=settings.ai_client_http2,
+    connect_timeout=settings.ai_client_connect_timeout_seconds,
+    deadline=settings.ai_client_deadline_seconds,
+    retries=settings.ai_client_retries,
+    breaker_threshold=settings.ai_client_breaker_threshold,
+    breaker_reset_seconds=settings.ai_client_breaker_reset_seconds
+)
@@ -0,0 +1,134 @@
+import functools
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Set, Tuple
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+from ..config import settings
+from .http_cache import etag_matches, not_modified
+
+
+class ResponseCache:
+    """
+    Per-user cache of encoded JSON responses for the dashboard endpoints.
+
+    Entries are keyed by (user, endpoint, query parameters), bounded by total body
+    bytes with LRU eviction, and expire after ttl_seconds. Ingestion invalidates a
+    user's entries as soon as their readings are written; the TTL only bounds how
+    stale another worker's copy can get.
+    """
+
+    def __init__(self, max_bytes: int, ttl_seconds: float):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self._user_keys: Dict[str, Set[tuple]] = {}
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    def get(self, user_id: str, key: tuple) -> Optional[Tuple[bytes, str]]:
+        entry = self._entries.get((user_id, key))
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, body, etag = entry
+        if expires_at <= time.monotonic():
+            self._remove((user_id, key))
+            self.misses += 1
+            return None
+        self._entries.move_to_end((user_id, key))
+        self.hits += 1
+        return body, etag
+
+    def put(self, user_id: str, key: tuple, body: bytes, etag: str):
+        if len(body) > self.max_bytes:
+            return
+        self._remove((user_id, key))
+        self._entries[(user_id, key)] = (time.monotonic() + self.ttl_seconds, body, etag)
+        self._user_keys.setdefault(user_id, set()).add(key)
+        self.bytes += len(body)
+        while self.bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+
+    def invalidate_user(self, user_id: str):
+        """مسح كل الردود المتخزنة للمستخدم (بعد قراءة جديدة أو تغيير الاشتراك)"""
+        for key in list(self._user_keys.get(user_id, ())):
+            self._remove((user_id, key))
+
+    def _remove(self, entry_key: tuple):
+        entry = self._entries.pop(entry_key, None)
+        if entry is None:
+            return
+        self.bytes -= len(entry[1])
+        user_id, key = entry_key
+        keys = self._user_keys.get(user_id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._user_keys[user_id]
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "users": len(self._user_keys),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "not_modified": self.not_modified,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+
+response_cache = ResponseCache(
+    max_bytes=settings.response_cache_max_bytes,
+    ttl_seconds=settings.response_cache_ttl_seconds
+)
+
+
+def _encode(payload: Any, adapter: Optional[TypeAdapter]) -> bytes:
+    data = adapter.dump_python(adapter.validate_python(payload), mode="json") if adapter else jsonable_encoder(payload)
+    # نفس الـ encoding بتاع JSONResponse
+    return json.dumps(data, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+def cached_response(endpoint: str, response_model: Any = None):
+    """
+    Serve a per-user GET endpoint from the response cache with ETag/If-None-Match.
+
+    The endpoint must take `request: Request` and `current_user`. Errors raised by the
+    endpoint are not cached. The ETag is a hash of the body, so a recomputed but
+    unchanged response still answers 304.
+    """
+    adapter = TypeAdapter(response_model) if response_model is not None else None
+
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            request: Request = kwargs["request"]
+            user_id = kwargs["current_user"]["id"]
+            key = (endpoint, tuple(sorted(request.query_params.multi_items())))
+
+            cached = response_cache.get(user_id, key)
+            if cached is None:
+                body = _encode(await func(*args, **kwargs), adapter)
+                etag = '"' + hashlib.blake2b(body, digest_size=12).hexdigest() + '"'
+                response_cache.put(user_id, key, body, etag)
+            else:
+                body, etag = cached
+
+            if etag_matches(request, etag):
+                response_cache.not_modified += 1
+                return not_modified(etag)
+            return Response(content=body, media_type="application/json", headers={"ETag": etag})
+
+        return wrapper
+
+    return decorator
@@ -1,5 +1,6 @@
 import asyncio
 import httpx
+import json
 import random
 from datetime import datetime, timezone # تأكد من استيراد timezone
 import os
@@ -11,6 +12,10 @@ DEVICE_NAME = "Living Room Meter"
 USER_EMAIL = "a@test.com"
 USER_PASSWORD = "123"
 SEND_INTERVAL = 2 
+# مفتاح الجهاز من POST /api/v1/devices/{device_id}/api-key (لو موجود مش محتاجين login)
+DEVICE_API_KEY = os.getenv("DEVICE_API_KEY")
+# اتصال WebSocket واحد دائم بدل HTTP request لكل قراءة
+USE_WEBSOCKET = os.getenv("USE_WEBSOCKET", "1") != "0"
 
 class IoTSimulator:
     def __init__(self):
@@ -19,6 +24,11 @@ class IoTSimulator:
 
     async def login(self):
         """تسجيل الدخول للحصول على Token"""
+        if DEVICE_API_KEY:
+            self.client.headers.update({"X-Device-Key": DEVICE_API_KEY})
+            print("🔑 Using device API key")
+            return True
+
         print(f"🔑 Attempting login for {USER_EMAIL}...")
         try:
             response = await self.client.post("/api/v1/auth/login", json={
@@ -60,8 +70,56 @@ class IoTSimulator:
         except Exception as e:
             print(f"📡 [FAILED] Could not connect to server: {e}")
 
+    def stream_url(self) -> str:
+        base = BACKEND_URL.replace("https://", "wss://").replace("http://", "ws://")
+        auth = f"device_key={DEVICE_API_KEY}" if DEVICE_API_KEY else f"token={self.token}"
+        return f"{base}/api/v1/consumption/ws?{auth}"
+
+    async def stream_data(self):
+        """إرسال القراءات على اتصال WebSocket واحد مع احترام الـ window بتاع السيرفر"""
+        import websockets
+
+        async with websockets.connect(self.stream_url()) as ws:
+            ready = json.loads(await ws.recv())
+            window = ready.get("window", 1)
+            print(f"🔌 Stream connected (window={window}). Sending data every {SEND_INTERVAL}s...")
+
+            seq = 0
+            acked = 0
+
+            async def read_acks():
+                nonlocal acked
+                async for message in ws:
+                    reply = json.loads(message)
+                    if reply.get("type") == "ack":
+                        acked = reply["seq"]
+                    elif reply.get("type") == "error":
+                        print(f"⚠️ [ERROR] Frame {reply.get('seq')}: {reply.get('detail')}")
+
+            reader = asyncio.create_task(read_acks())
+            try:
+                while not reader.done():
+                    # flow control: منبعتش أكتر من window قراءات من غير ack
+                    if seq - acked >= window:
+                        await asyncio.sleep(0.1)
+                        continue
+
+                    seq += 1
+                    val = round(random.uniform(0.5, 3.5), 2)
+                    await ws.send(json.dumps({"seq": seq, "device_id": DEVICE_ID, "consumption_value": val}))
+                    print(f"🚀 [STREAM] Device: {DEVICE_ID} | Seq: {seq} | Value: {val} kWh")
+                    await asyncio.sleep(SEND_INTERVAL)
+            finally:
+                reader.cancel()
+
     async def start(self):
         if await self.login():
+            if USE_WEBSOCKET:
+                try:
+                    await self.stream_data()
+                except Exception as e:
+                    print(f"📡 [STREAM] Connection lost ({e}), falling back to HTTP")
+
             print(f"⚙️ Simulator started. Sending data every {SEND_INTERVAL}s...")
             try:
                 while True:
@@ -0,0 +1,146 @@
+"""
+Script to rebuild the daily and monthly consumption rollups and the running
+consumption statistics from raw readings
+Run this once after upgrading (with ingestion stopped), since the rollups are
+only maintained for readings ingested after the upgrade. Raw readings are read
+from the layout set by CONSUMPTION_STORAGE_MODE:
+
+    python -m scripts.backfill_rollups
+"""
+import asyncio
+from motor.motor_asyncio import AsyncIOMotorClient
+from backend.app.config import settings
+from backend.app.indexes import reconcile_indexes
+from backend.app.services.consumption_stats import STATS_EPOCH
+from backend.app.services.consumption_store import raw_readings_pipeline
+
+STATS_KEYS = {"_id": 0, "user_id": "$_id.user_id", "device_id": "$_id.device_id", "month": "$_id.month"}
+STATS_MERGE = {"into": "consumption_stats", "on": ["user_id", "month", "device_id"], "whenNotMatched": "insert"}
+
+
+def _buckets_pipeline(keys: dict, part: dict, total_field: str, count_field: str = None) -> list:
+    """{part: total} (and {part: count}) per (user, device, month), merged into consumption_stats"""
+    group = {"_id": {"user_id": "$_id.user_id", "device_id": "$_id.device_id", "month": "$_id.month"},
+             total_field: {"$push": {"k": {"$toString": "$_id.part"}, "v": "$total"}}}
+    project = {**STATS_KEYS, total_field: {"$arrayToObject": f"${total_field}"}}
+    if count_field:
+        group[count_field] = {"$push": {"k": {"$toString": "$_id.part"}, "v": "$count"}}
+        project[count_field] = {"$arrayToObject": f"${count_field}"}
+    return [
+        {"$group": {"_id": {**keys, "part": part}, "total": {"$sum": "$consumption_value"}, "count": {"$sum": 1}}},
+        {"$group": group},
+        {"$project": project},
+        {"$merge": {**STATS_MERGE, "whenMatched": "merge"}}
+    ]
+
+
+async def backfill_rollups():
+    """Rebuild consumption_daily, consumption_monthly and consumption_stats with $merge"""
+    client = AsyncIOMotorClient(settings.mongodb_url)
+    db = client[settings.mongodb_db_name]
+
+    # $merge needs the unique indexes the backend creates on startup
+    await reconcile_indexes(db)
+
+    collection, readings = raw_readings_pipeline()
+    raw = db[collection]
+    print(f"Reading raw readings from {collection} ({settings.consumption_storage_mode} layout)")
+
+    print("Rebuilding daily rollups...")
+    await raw.aggregate([
+        *readings,
+        {
+            "$group": {
+                "_id": {
+                    "user_id": "$user_id",
+                    "device_id": "$device_id",
+                    "date": {"$dateToString": {"format": "%Y-%m-%d", "date": "$timestamp"}}
+                },
+                "total": {"$sum": "$consumption_value"},
+                "count": {"$sum": 1}
+            }
+        },
+        {
+            "$project": {
+                "_id": 0,
+                "user_id": "$_id.user_id",
+                "device_id": "$_id.device_id",
+                "date": "$_id.date",
+                "total": 1,
+                "count": 1
+            }
+        },
+        {
+            "$merge": {
+                "into": "consumption_daily",
+                "on": ["user_id", "date", "device_id"],
+                "whenMatched": "replace",
+                "whenNotMatched": "insert"
+            }
+        }
+    ], allowDiskUse=True).to_list(length=None)
+    print(f"  [OK] {await db.consumption_daily.count_documents({})} daily rollups")
+
+    print("Rebuilding monthly rollups...")
+    await db.consumption_daily.aggregate([
+        {
+            "$group": {
+                "_id": {"user_id": "$user_id", "month": {"$substrBytes": ["$date", 0, 7]}},
+                "total": {"$sum": "$total"},
+                "count": {"$sum": "$count"}
+            }
+        },
+        {"$project": {"_id": 0, "user_id": "$_id.user_id", "month": "$_id.month", "total": 1, "count": 1}},
+        {
+            "$merge": {
+                "into": "consumption_monthly",
+                "on": ["user_id", "month"],
+                "whenMatched": "replace",
+                "whenNotMatched": "insert"
+            }
+        }
+    ]).to_list(length=None)
+    print(f"  [OK] {await db.consumption_monthly.count_documents({})} monthly rollups")
+
+    print("Rebuilding running statistics...")
+    keys = {"user_id": "$user_id", "device_id": "$device_id", "month": {"$dateToString": {"format": "%Y-%m", "date": "$timestamp"}}}
+    hour_x = {"$floor": {"$divide": [{"$subtract": ["$timestamp", STATS_EPOCH]}, 3600 * 1000]}}
+    day_x = {"$floor": {"$divide": [{"$subtract": ["$timestamp", STATS_EPOCH]}, 86400 * 1000]}}
+
+    await raw.aggregate([
+        *readings,
+        {"$set": {"hour_x": hour_x, "day_x": day_x}},
+        {
+            "$group": {
+                "_id": keys,
+                "count": {"$sum": 1},
+                "total": {"$sum": "$consumption_value"},
+                "hour_sxy": {"$sum": {"$multiply": ["$hour_x", "$consumption_value"]}},
+                "day_sxy": {"$sum": {"$multiply": ["$day_x", "$consumption_value"]}},
+                "first_hour": {"$min": "$hour_x"},
+                "last_hour": {"$max": "$hour_x"},
+                "first_day": {"$min": "$day_x"},
+                "last_day": {"$max": "$day_x"}
+            }
+        },
+        {"$project": {**STATS_KEYS, "count": 1, "total": 1, "hour_sxy": 1, "day_sxy": 1,
+                      "first_hour": {"$toInt": "$first_hour"}, "last_hour": {"$toInt": "$last_hour"},
+                      "first_day": {"$toInt": "$first_day"}, "last_day": {"$toInt": "$last_day"}}},
+        {"$merge": {**STATS_MERGE, "whenMatched": "replace"}}
+    ], allowDiskUse=True).to_list(length=None)
+
+    # hourly_total.h / hourly_count.h و daily_total.d بنفس شكل الـ $inc اللي في الـ ingest
+    await raw.aggregate(
+        readings + _buckets_pipeline(keys, {"$hour": "$timestamp"}, "hourly_total", "hourly_count"), allowDiskUse=True
+    ).to_list(length=None)
+    await raw.aggregate(
+        readings + _buckets_pipeline(keys, {"$dayOfMonth": "$timestamp"}, "daily_total"), allowDiskUse=True
+    ).to_list(length=None)
+    print(f"  [OK] {await db.consumption_stats.count_documents({})} statistics documents")
+
+    print("\n[OK] Rollup backfill complete!")
+    client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(backfill_rollups())
@@ -0,0 +1,44 @@
+"""
+Script to measure what the ingest-time anomaly detector adds to each reading
+Feeds synthetic readings for many devices through DeviceAnomalyDetector.observe
+(the call create_consumption makes) and reports the cost per reading:
+
+    python -m scripts.benchmark_anomaly_detector --devices 10000 --readings 1000000
+"""
+import argparse
+import random
+import time
+from backend.app.services.anomaly_detector import DeviceAnomalyDetector
+
+
+def benchmark(devices: int, readings: int):
+    detector = DeviceAnomalyDetector(
+        alpha=0.05, z_threshold=4.0, warmup_readings=30, min_std_ratio=0.1,
+        cooldown_seconds=3600, checkpoint_interval_seconds=60
+    )
+    # القياس للـ observe نفسه: من غير كتابة تنبيهات (مفيش event loop هنا)
+    detector._schedule_spike = lambda reading, spike, alert: None
+
+    rng = random.Random(0)
+    batch = [
+        {"user_id": f"user-{i % 1000}", "device_id": f"device-{i}", "consumption_value": rng.uniform(0.5, 1.5)}
+        for i in range(devices)
+    ]
+
+    started = time.perf_counter()
+    for i in range(readings):
+        detector.observe(batch[i % devices])
+    elapsed = time.perf_counter() - started
+
+    print(f"{readings} readings over {devices} devices")
+    print(f"  {elapsed / readings * 1e6:.2f} µs per reading ({readings / elapsed:,.0f} readings/s), "
+          f"{detector.flagged} flagged")
+    print("\n[OK] Benchmark complete!")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--devices", type=int, default=10000)
+    parser.add_argument("--readings", type=int, default=1000000)
+    args = parser.parse_args()
+    benchmark(args.devices, args.readings)
@@ -0,0 +1,61 @@
+"""
+Script to benchmark the batched daily forecast against the per-request path
+Builds synthetic daily series (5-30 days each) for many users and forecasts the
+next 7 days for all of them, once the way a single /api/v1/prediction request
+does it (a pandas frame + LinearRegression per user) and once with the vectorized
+kernel behind /api/v1/prediction/batch, then checks both give the same numbers:
+
+    python -m scripts.benchmark_batch_forecast --users 1000 5000 20000
+"""
+import argparse
+import time
+import numpy as np
+import pandas as pd
+from sklearn.linear_model import LinearRegression
+from ai_service.services.forecast_kernel import forecast
+
+
+def synthetic_users(users: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    lengths = rng.integers(5, 31, users)
+    return [rng.gamma(4.0, 2.0, length) + rng.normal(0.05, 0.02) * np.arange(length) for length in lengths]
+
+
+def per_request_forecast(totals: np.ndarray, days: int) -> np.ndarray:
+    """What PredictionService did for one user before the kernel"""
+    daily = pd.DataFrame({
+        "date": pd.date_range("2024-01-01", periods=len(totals), freq="D"),
+        "consumption": totals
+    })
+    X = np.arange(len(daily)).reshape(-1, 1)
+    model = LinearRegression()
+    model.fit(X, daily["consumption"].to_numpy())
+    future_X = np.arange(len(daily), len(daily) + days).reshape(-1, 1)
+    return np.maximum(model.predict(future_X), 0.5)
+
+
+def benchmark(user_counts, days: int):
+    print(f"Forecasting {days} days per user\n")
+    print(f"{'users':>8} {'per-request users/s':>20} {'batched users/s':>16} {'speedup':>8} {'max |diff|':>11}")
+    for users in user_counts:
+        series = synthetic_users(users)
+
+        started = time.perf_counter()
+        expected = [per_request_forecast(totals, days) for totals in series]
+        per_request = users / (time.perf_counter() - started)
+
+        started = time.perf_counter()
+        batched = forecast(series, days)["predictions"]
+        batch = users / (time.perf_counter() - started)
+
+        diff = float(np.max(np.abs(np.vstack(expected) - batched)))
+        print(f"{users:>8} {per_request:>20.0f} {batch:>16.0f} {batch / per_request:>7.0f}x {diff:>11.2e}")
+    print("\n[OK] Benchmark complete!")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, nargs="+", default=[1000, 5000])
+    parser.add_argument("--days", type=int, default=7)
+    args = parser.parse_args()
+    benchmark(args.users, args.days)
@@ -0,0 +1,91 @@
+"""
+Script to benchmark the AI service's model executor under concurrent users
+Fits and scores synthetic 30-day hourly series for many users at once, with the
+process pool at 0 (inline on the event loop), 1, 2, 4 ... workers up to the CPU
+count, and reports throughput, latency and how long a health check would have
+waited on the event loop meanwhile:
+
+    python -m scripts.benchmark_model_executor --users 64
+"""
+import argparse
+import asyncio
+import os
+import time
+import numpy as np
+from ai_service.services.executor import ModelExecutor
+from ai_service.services.model_tasks import fit_analysis_models, score_analysis
+
+
+def synthetic_series(seed: int, hours: int = 30 * 24):
+    rng = np.random.default_rng(seed)
+    timestamps = np.datetime64("2024-01-01T00:00:00") + np.arange(hours).astype("timedelta64[h]")
+    daily_shape = 1.0 + np.sin(np.arange(hours) * 2 * np.pi / 24)
+    totals = daily_shape + rng.gamma(2.0, 0.3, hours)
+    counts = np.full(hours, 1800, dtype=np.int64)
+    return timestamps.astype("datetime64[s]"), totals, counts
+
+
+async def analyse_user(executor: ModelExecutor, series) -> float:
+    started = time.perf_counter()
+    hours, totals, counts = series
+    models = await executor.run(fit_analysis_models, hours, totals)
+    await executor.run(score_analysis, models, hours, totals, counts)
+    return time.perf_counter() - started
+
+
+async def probe_event_loop(stop: asyncio.Event, interval: float = 0.01) -> float:
+    """أطول تأخير للـ event loop (زي health check مستني) أثناء الـ benchmark"""
+    worst = 0.0
+    while not stop.is_set():
+        expected = time.perf_counter() + interval
+        await asyncio.sleep(interval)
+        worst = max(worst, time.perf_counter() - expected)
+    return worst
+
+
+async def run_round(workers: int, users: int) -> dict:
+    executor = ModelExecutor(workers=workers, max_pending=users * 2, timeout_seconds=600)
+    executor.start()
+    all_series = [synthetic_series(seed) for seed in range(users)]
+    # تسخين الـ workers (استيراد sklearn في كل process) بره القياس
+    await asyncio.gather(*(analyse_user(executor, all_series[0]) for _ in range(max(workers, 1))))
+
+    stop = asyncio.Event()
+    probe = asyncio.create_task(probe_event_loop(stop))
+    started = time.perf_counter()
+    latencies = await asyncio.gather(*(analyse_user(executor, series) for series in all_series))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    loop_lag = await probe
+    executor.stop()
+
+    return {
+        "workers": workers,
+        "users_per_second": users / elapsed,
+        "p50_ms": float(np.percentile(latencies, 50)) * 1000,
+        "p95_ms": float(np.percentile(latencies, 95)) * 1000,
+        "max_loop_lag_ms": loop_lag * 1000
+    }
+
+
+async def benchmark(users: int, max_workers: int):
+    worker_counts = [0] + [n for n in (1, 2, 4, 8, 16, 32) if n < max_workers] + [max_workers]
+    print(f"Fitting and scoring {users} users concurrently (CPU count: {os.cpu_count()})\n")
+    print(f"{'workers':>8} {'users/s':>10} {'p50 ms':>10} {'p95 ms':>10} {'loop lag ms':>12}")
+    baseline = None
+    for workers in sorted(set(worker_counts)):
+        result = await run_round(workers, users)
+        if workers == 1:
+            baseline = result["users_per_second"]
+        speedup = f"  x{result['users_per_second'] / baseline:.2f}" if baseline and workers > 1 else ""
+        print(f"{result['workers']:>8} {result['users_per_second']:>10.1f} {result['p50_ms']:>10.0f} "
+              f"{result['p95_ms']:>10.0f} {result['max_loop_lag_ms']:>12.0f}{speedup}")
+    print("\n[OK] Benchmark complete! workers=0 is the old behaviour (fits on the event loop).")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=64)
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+    asyncio.run(benchmark(args.users, args.max_workers))
@@ -0,0 +1,38 @@
+"""
+Script to verify that every canonical query shape is served by an index
+Reconciles the index registry, explains each query from backend/app/indexes.py
+and exits with status 1 if any of them falls back to a COLLSCAN (use it as a CI gate):
+
+    python -m scripts.check_query_plans
+
+tests/test_query_plans.py runs the same check in the test suite.
+"""
+import asyncio
+import sys
+from motor.motor_asyncio import AsyncIOMotorClient
+from backend.app.config import settings
+from backend.app.indexes import CANONICAL_QUERIES, find_collscans, reconcile_indexes
+
+
+async def check_query_plans() -> int:
+    """Return the number of canonical queries that need a collection scan"""
+    client = AsyncIOMotorClient(settings.mongodb_url)
+    db = client[settings.mongodb_db_name]
+
+    report = await reconcile_indexes(db)
+    collscans = await find_collscans(db)
+
+    print(f"Checked {len(CANONICAL_QUERIES)} query shapes")
+    for name in collscans:
+        print(f"  [COLLSCAN] {name}")
+    if report["extra"]:
+        print(f"  [INFO] Undeclared indexes: {', '.join(report['extra'])}")
+    if not collscans:
+        print("\n[OK] Every query shape uses an index!")
+
+    client.close()
+    return len(collscans)
+
+
+if __name__ == "__main__":
+    sys.exit(1 if asyncio.run(check_query_plans()) else 0)
@@ -41,6 +41,7 @@ async def init_plans():
     
     print("Initializing energy plans...")
     
+    created = 0
     for plan_data in PLANS:
         # Check if plan already exists
         existing = await db.plans.find_one({"plan_name": plan_data["plan_name"]})
@@ -51,6 +52,15 @@ async def init_plans():
         plan_data["created_at"] = datetime.utcnow()
         result = await db.plans.insert_one(plan_data)
         print(f"  [OK] Created plan: {plan_data['plan_name']} (ID: {result.inserted_id})")
+        created += 1
+
+    # Let running backend workers know the plan catalog changed
+    if created:
+        await db.catalog_versions.update_one(
+            {"_id": "plans"},
+            {"$inc": {"version": 1}},
+            upsert=True
+        )
     
     print("\n[OK] Plans initialization complete!")
     client.close()
@@ -0,0 +1,50 @@
+"""
+Script to copy raw readings from the per-reading db.consumption layout into the
+bucketed or time-series layout
+Run it once from the repository root with ingestion stopped, then set
+CONSUMPTION_STORAGE_MODE to the same layout and restart the backend:
+
+    python -m scripts.migrate_consumption_layout buckets
+"""
+import asyncio
+import sys
+from motor.motor_asyncio import AsyncIOMotorClient
+from backend.app.config import settings
+from backend.app.database import mongodb
+from backend.app.services import consumption_store
+
+BATCH_SIZE = 5000
+
+
+async def migrate(target: str):
+    """Copy db.consumption into the target layout in _id order"""
+    if target not in (consumption_store.STORAGE_BUCKETS, consumption_store.STORAGE_TIMESERIES):
+        print(f"Unknown target layout '{target}' (expected buckets or timeseries)")
+        return
+
+    mongodb.client = AsyncIOMotorClient(settings.mongodb_url)
+    db = mongodb.client[settings.mongodb_db_name]
+    settings.consumption_storage_mode = target
+    await consumption_store.ensure_layout(db)
+
+    total = await db.consumption.count_documents({})
+    print(f"Migrating {total} readings into the '{target}' layout...")
+
+    copied = 0
+    last_id = None
+    while True:
+        query = {"_id": {"$gt": last_id}} if last_id else {}
+        batch = await db.consumption.find(query).sort("_id", 1).limit(BATCH_SIZE).to_list(length=BATCH_SIZE)
+        if not batch:
+            break
+        await consumption_store.insert_readings(batch)
+        copied += len(batch)
+        last_id = batch[-1]["_id"]
+        print(f"  [OK] {copied}/{total}")
+
+    print(f"\n[OK] Migration complete! db.consumption can be dropped once CONSUMPTION_STORAGE_MODE={target} is live.")
+    mongodb.client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(migrate(sys.argv[1] if len(sys.argv) > 1 else consumption_store.STORAGE_BUCKETS))
@@ -0,0 +1,24 @@
+import asyncio
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+ROUND_TRIP_METHODS = ("find_one", "find_one_and_update", "update_one", "update_many", "insert_one", "insert_many",
+                      "bulk_write", "distinct")
+
+
+@pytest.fixture(autouse=True)
+def round_trips(monkeypatch):
+    """
+    mongomock-motor runs each call without ever yielding to the event loop, so
+    gathered calls would simply run one after another. Yield before every call,
+    like a real round trip, so concurrent deductions actually interleave.
+    """
+    collection_class = type(AsyncMongoMockClient().db.collection)
+    for name in ROUND_TRIP_METHODS:
+        method = getattr(collection_class, name)
+
+        async def round_trip(self, *args, _method=method, **kwargs):
+            await asyncio.sleep(0)
+            return await _method(self, *args, **kwargs)
+
+        monkeypatch.setattr(collection_class, name, round_trip)
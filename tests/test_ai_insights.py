@@ -0,0 +1,50 @@
+"""
+Tests for the precomputed AI insights: plan exhaustion follows the subscription's
+current balance instead of the one stored by the nightly run.
+"""
+import asyncio
+from datetime import datetime
+from mongomock_motor import AsyncMongoMockClient
+from backend.app import database
+from backend.app.services.ai_insights import get_fresh_insight
+
+USER_ID = "user-1"
+
+
+async def _setup(remaining_quota: float, plan_exhaustion: dict):
+    database.mongodb.client = AsyncMongoMockClient()
+    db = database.get_database()
+    now = datetime.utcnow()
+    subscription = {"user_id": USER_ID, "start_date": now, "updated_at": now,
+                    "remaining_quota": remaining_quota, "is_active": True}
+    await db.plan_subscriptions.insert_one(subscription)
+    await db.ai_insights.insert_one({
+        "user_id": USER_ID,
+        "subscription_id": str(subscription["_id"]),
+        "data_high_water": now,
+        "prediction_days": 7,
+        "computed_at": now,
+        "plan_exhaustion": plan_exhaustion
+    })
+
+
+def test_plan_exhaustion_uses_the_current_balance():
+    async def scenario():
+        # بالليل كان الرصيد 100 ومعدل 10 في اليوم، ودلوقتي فاضل 20 بس
+        await _setup(20.0, {"user_id": USER_ID, "current_balance_kwh": 100.0, "daily_rate_kwh": 10.0,
+                            "estimated_days_remaining": 10.0, "system_status": "Healthy"})
+        insight = await get_fresh_insight(USER_ID, "plan_exhaustion")
+        assert insight["current_balance_kwh"] == 20.0
+        assert insight["estimated_days_remaining"] == 2.0
+        assert insight["system_status"] == "Urgent / Critical"
+
+    asyncio.run(scenario())
+
+
+def test_plan_exhaustion_without_a_daily_rate_is_computed_live():
+    async def scenario():
+        await _setup(20.0, {"user_id": USER_ID, "current_balance_kwh": 100.0, "estimated_days_remaining": 10.0})
+        assert await get_fresh_insight(USER_ID, "plan_exhaustion") is None
+
+    asyncio.run(scenario())
+
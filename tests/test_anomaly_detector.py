@@ -0,0 +1,66 @@
+"""
+Tests for DeviceAnomalyDetector across workers: two detectors share MongoDB like
+two uvicorn workers, and the alert cooldown and checkpoints hold between them.
+"""
+import asyncio
+from datetime import datetime
+from mongomock_motor import AsyncMongoMockClient
+from backend.app import database
+from backend.app.indexes import reconcile_indexes
+from backend.app.services.anomaly_detector import DeviceAnomalyDetector
+
+USER_ID = "user-1"
+DEVICE_ID = "meter-1"
+
+
+def _detector() -> DeviceAnomalyDetector:
+    return DeviceAnomalyDetector(alpha=0.1, z_threshold=3.0, warmup_readings=5, min_std_ratio=0.1,
+                                 cooldown_seconds=3600, checkpoint_interval_seconds=60)
+
+
+def _reading(value: float) -> dict:
+    return {"user_id": USER_ID, "device_id": DEVICE_ID, "consumption_value": value, "timestamp": datetime.utcnow()}
+
+
+async def _setup():
+    database.mongodb.client = AsyncMongoMockClient()
+    await reconcile_indexes(database.get_database())
+
+
+def test_one_anomaly_alert_per_cooldown_across_workers():
+    async def scenario():
+        await _setup()
+        workers = [_detector(), _detector()]
+        for worker in workers:
+            for _ in range(10):
+                worker.observe(_reading(1.0))
+            assert worker.observe(_reading(50.0)) is not None
+        await asyncio.gather(*(task for worker in workers for task in list(worker._alert_tasks)))
+
+        alerts = await database.get_database().alerts.count_documents({"alert_type": "anomaly"})
+        assert alerts == 1
+
+    asyncio.run(scenario())
+
+
+def test_checkpoint_keeps_the_state_with_more_readings():
+    async def scenario():
+        await _setup()
+        ahead, behind = _detector(), _detector()
+        for _ in range(20):
+            ahead.observe(_reading(2.0))
+        for _ in range(5):
+            behind.observe(_reading(9.0))
+
+        assert await ahead.checkpoint() == 1
+        await behind.checkpoint()
+
+        state = await database.get_database().device_anomaly_state.find_one({"device_id": DEVICE_ID})
+        assert state["count"] == 20
+        assert state["mean"] == 2.0
+
+        fresh = _detector()
+        await fresh.load()
+        assert fresh._state[(USER_ID, DEVICE_ID)][0] == 20
+
+    asyncio.run(scenario())
@@ -0,0 +1,104 @@
+"""
+Tests for GET /consumption/history against mongomock-motor: keyset pages neither
+skip nor repeat readings that share a timestamp, tampered cursors are rejected
+with 400, and the NDJSON stream is one reading per line.
+"""
+import asyncio
+import base64
+import json
+from datetime import datetime, timedelta
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from mongomock_motor import AsyncMongoMockClient
+from backend.app import database
+from backend.app.api import consumption
+from backend.app.config import settings
+from backend.app.services.consumption_store import decode_cursor, encode_cursor, insert_readings
+from backend.app.utils.dependencies import get_current_user
+
+USER_ID = "user-1"
+LAYOUTS = ("documents", "timeseries", "buckets")
+TIED = datetime(2026, 1, 5, 12, 0, 0)
+
+
+async def _seed():
+    # 5 قراءات بنفس الـ timestamp بالظبط، وقبلها 2 أقدم
+    readings = [
+        {"user_id": USER_ID, "device_id": f"meter-{i % 2}", "consumption_value": float(i), "timestamp": TIED}
+        for i in range(5)
+    ] + [
+        {"user_id": USER_ID, "device_id": "meter-0", "consumption_value": 10.0 + i,
+         "timestamp": TIED - timedelta(minutes=i + 1)}
+        for i in range(2)
+    ]
+    await insert_readings(readings)
+
+
+@pytest.fixture(params=LAYOUTS)
+def client(request, monkeypatch):
+    monkeypatch.setattr(settings, "consumption_storage_mode", request.param)
+    database.mongodb.client = AsyncMongoMockClient()
+    asyncio.run(_seed())
+
+    app = FastAPI()
+    app.include_router(consumption.router, prefix="/consumption")
+    app.dependency_overrides[get_current_user] = lambda: {"id": USER_ID}
+    with TestClient(app) as test_client:
+        yield test_client
+
+
+def _token(payload) -> str:
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode().rstrip("=")
+
+
+def test_pages_are_stable_across_equal_timestamps(client):
+    seen, cursor = [], None
+    # حد أقصى للصفحات: cursor بيرجع نفس الصفحة ميعلقش الـ test
+    for _ in range(10):
+        params = {"limit": 2, **({"cursor": cursor} if cursor else {})}
+        page = client.get("/consumption/history", params=params).json()
+        seen.extend(page["items"])
+        cursor = page["next_cursor"]
+        if not cursor:
+            break
+
+    ids = [item["id"] for item in seen]
+    assert len(ids) == 7 and len(set(ids)) == 7
+    timestamps = [item["timestamp"] for item in seen]
+    assert timestamps == sorted(timestamps, reverse=True)
+    # الصفحات بالـ cursor نفس ترتيب طلب واحد كبير
+    everything = client.get("/consumption/history", params={"limit": 50}).json()["items"]
+    assert [item["id"] for item in everything] == ids
+
+
+@pytest.mark.parametrize("token", [
+    "not-base64!",
+    _token(["a list"]),
+    _token({"t": TIED.isoformat()}),
+    _token({"t": "yesterday", "i": "65a000000000000000000000"}),
+    _token({"t": TIED.isoformat(), "i": "not-an-object-id"})
+])
+def test_tampered_cursors_are_rejected(client, token):
+    for fmt in ("json", "ndjson"):
+        response = client.get("/consumption/history", params={"cursor": token, "format": fmt})
+        assert response.status_code == 400
+        assert response.json() == {"detail": "Invalid cursor"}
+
+
+def test_ndjson_is_one_reading_per_line(client):
+    response = client.get("/consumption/history", params={"format": "ndjson"})
+
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    assert response.text.endswith("\n")
+    lines = response.text.splitlines()
+    assert len(lines) == 7
+    readings = [json.loads(line) for line in lines]
+    assert set(readings[0]) == {"id", "device_id", "user_id", "consumption_value", "timestamp"}
+    assert datetime.fromisoformat(readings[0]["timestamp"]) == TIED
+    assert readings[-1]["consumption_value"] == 11.0
+
+
+def test_cursor_round_trip():
+    reading = {"id": "65a000000000000000000000", "timestamp": TIED}
+    assert decode_cursor(encode_cursor(reading)) == (TIED, reading["id"])
@@ -0,0 +1,55 @@
+import asyncio
+import time
+import httpx
+from backend.app.utils.http_client import ServiceClient
+
+
+def half_open_client(handler) -> ServiceClient:
+    client = ServiceClient("upstream", "http://upstream", breaker_threshold=1, breaker_reset_seconds=1)
+    client._client = httpx.AsyncClient(base_url="http://upstream", transport=httpx.MockTransport(handler))
+    client.breaker.failures = 1
+    client.breaker.opened_at = time.monotonic() - 2
+    return client
+
+
+def test_cancelled_trial_releases_the_breaker():
+    hang = asyncio.Event()
+
+    async def handler(request):
+        if request.url.path == "/slow":
+            await hang.wait()
+        return httpx.Response(200)
+
+    async def scenario():
+        client = half_open_client(handler)
+        trial = asyncio.create_task(client.get("/slow"))
+        await asyncio.sleep(0.01)
+        assert client.breaker.trial_in_flight
+
+        trial.cancel()
+        await asyncio.gather(trial, return_exceptions=True)
+        assert not client.breaker.trial_in_flight
+
+        # الطلب اللي بعده ياخد الـ trial ويقفل الـ circuit
+        response = await client.get("/fast")
+        assert response.status_code == 200
+        assert client.breaker.state == "closed"
+
+    asyncio.run(scenario())
+
+
+def test_failed_trial_reopens_the_breaker():
+    async def handler(request):
+        raise httpx.ConnectError("refused")
+
+    async def scenario():
+        client = half_open_client(handler)
+        client.retries = 0
+        try:
+            await client.get("/down")
+        except httpx.ConnectError:
+            pass
+        assert client.breaker.state == "open"
+        assert not client.breaker.trial_in_flight
+
+    asyncio.run(scenario())
@@ -0,0 +1,139 @@
+"""
+Concurrency tests for the atomic quota deduction (deduct_quota_and_check_alerts).
+
+Runs against mongomock-motor, so no MongoDB server is needed:
+
+    pip install -r requirements-dev.txt
+    python -m pytest tests
+"""
+import asyncio
+from datetime import datetime, timedelta
+from mongomock_motor import AsyncMongoMockClient
+from backend.app import database
+from backend.app.indexes import reconcile_indexes
+from backend.app.services.ingest_service import new_reading, persist_readings
+from backend.app.services.plan_service import deduct_quota_and_check_alerts
+
+USER_ID = "user-1"
+
+
+async def _setup(total_quota: float) -> dict:
+    database.mongodb.client = AsyncMongoMockClient()
+    db = database.get_database()
+    await reconcile_indexes(db)
+    now = datetime.utcnow()
+    subscription = {
+        "user_id": USER_ID,
+        "plan_id": "plan-1",
+        "start_date": now,
+        "end_date": now + timedelta(days=30),
+        "remaining_quota": total_quota,
+        "total_quota": total_quota,
+        "consumed_since_start": 0.0,
+        "alerts_fired": [],
+        "is_active": True
+    }
+    await db.plan_subscriptions.insert_one(subscription)
+    return subscription
+
+
+async def _deduct_concurrently(readings: int, value: float):
+    await asyncio.gather(*(deduct_quota_and_check_alerts(USER_ID, value) for _ in range(readings)))
+    db = database.get_database()
+    subscription = await db.plan_subscriptions.find_one({"user_id": USER_ID})
+    alerts = await db.alerts.find({"user_id": USER_ID}).to_list(length=None)
+    return subscription, sorted(alert["alert_type"] for alert in alerts)
+
+
+def test_parallel_deductions_are_exact():
+    async def scenario():
+        await _setup(total_quota=100.0)
+        return await _deduct_concurrently(readings=300, value=0.25)
+
+    subscription, alerts = asyncio.run(scenario())
+    assert subscription["remaining_quota"] == 25.0
+    assert subscription["consumed_since_start"] == 75.0
+    assert alerts == ["70%"]
+    assert subscription["alerts_fired"] == ["70%"]
+
+
+def test_parallel_deductions_clamp_at_zero_and_alert_once():
+    async def scenario():
+        await _setup(total_quota=100.0)
+        return await _deduct_concurrently(readings=500, value=0.5)
+
+    subscription, alerts = asyncio.run(scenario())
+    assert subscription["remaining_quota"] == 0
+    # الإجمالي بيكمل يعد بعد ما الباقة تخلص، الرصيد بس اللي بيقف عند صفر
+    assert subscription["consumed_since_start"] == 250.0
+    assert alerts == ["100%", "70%", "90%"]
+    assert sorted(subscription["alerts_fired"]) == ["100%", "70%", "90%"]
+
+
+def test_parallel_deductions_across_users_do_not_interfere():
+    async def scenario():
+        await _setup(total_quota=100.0)
+        db = database.get_database()
+        await db.plan_subscriptions.insert_one({
+            "user_id": "user-2", "plan_id": "plan-1", "remaining_quota": 10.0, "total_quota": 10.0,
+            "alerts_fired": [], "is_active": True, "start_date": datetime.utcnow()
+        })
+        await asyncio.gather(
+            *(deduct_quota_and_check_alerts(USER_ID, 0.125) for _ in range(400)),
+            *(deduct_quota_and_check_alerts("user-2", 0.125) for _ in range(40))
+        )
+        return {
+            subscription["user_id"]: subscription["remaining_quota"]
+            async for subscription in db.plan_subscriptions.find()
+        }
+
+    remaining = asyncio.run(scenario())
+    assert remaining == {USER_ID: 50.0, "user-2": 5.0}
+
+
+def test_parallel_readings_through_the_ingest_path():
+    async def scenario():
+        await _setup(total_quota=100.0)
+        now = datetime.utcnow()
+        await asyncio.gather(*(
+            persist_readings([new_reading(USER_ID, f"meter-{i % 8}", 0.25, now)])
+            for i in range(320)
+        ))
+        db = database.get_database()
+        subscription = await db.plan_subscriptions.find_one({"user_id": USER_ID})
+        daily = await db.consumption_daily.find({"user_id": USER_ID}).to_list(length=None)
+        alerts = await db.alerts.find({"user_id": USER_ID}).to_list(length=None)
+        return subscription, daily, sorted(alert["alert_type"] for alert in alerts)
+
+    subscription, daily, alerts = asyncio.run(scenario())
+    assert subscription["remaining_quota"] == 20.0
+    assert sum(row["total"] for row in daily) == 80.0
+    assert sum(row["count"] for row in daily) == 320
+    assert alerts == ["70%"]
+
+
+def test_deduction_follows_a_new_subscription_after_the_cached_start_date():
+    async def scenario():
+        old = await _setup(100.0)
+        db = database.get_database()
+        now = datetime.utcnow()
+        await deduct_quota_and_check_alerts(USER_ID, 1.0, readings=[(now, 1.0)])
+
+        # اشتراك جديد بيبدأ بعد ما الـ start_date القديم اتخزن في الـ cache
+        await db.plan_subscriptions.update_one({"_id": old["_id"]}, {"$set": {"is_active": False}})
+        start = now + timedelta(minutes=5)
+        await db.plan_subscriptions.insert_one({
+            **{key: value for key, value in old.items() if key != "_id"},
+            "start_date": start, "remaining_quota": 50.0, "total_quota": 50.0
+        })
+        readings = [(start - timedelta(minutes=1), 2.0), (start, 3.0), (start + timedelta(minutes=1), 4.0)]
+        await deduct_quota_and_check_alerts(USER_ID, 9.0, readings=readings)
+
+        current = await db.plan_subscriptions.find_one({"user_id": USER_ID, "is_active": True})
+        assert current["remaining_quota"] == 41.0
+        # القراءة اللي قبل start_date بتتخصم من الكوتا بس
+        assert current["consumed_since_start"] == 7.0
+        previous = await db.plan_subscriptions.find_one({"_id": old["_id"]})
+        assert previous["remaining_quota"] == 99.0
+
+    asyncio.run(scenario())
@@ -0,0 +1,33 @@
+"""
+Tests for PredictionService.predict_plan_exhaustion with the backend calls
+replaced: a subscriber without readings still gets an answer.
+"""
+import asyncio
+import pytest
+from ai_service.config import settings
+from ai_service.services import prediction_service as module
+from ai_service.services.prediction_service import PredictionService
+
+USER_ID = "user-1"
+
+
+@pytest.mark.parametrize("source", ["models", "stats"])
+def test_plan_exhaustion_for_a_user_without_data(source, monkeypatch):
+    async def no_data(*args, **kwargs):
+        return None
+
+    async def subscription(user_id):
+        return {"user_id": user_id, "remaining_quota": 5.0}
+
+    monkeypatch.setattr(settings, "analysis_source", source)
+    monkeypatch.setattr(module, "load_series", no_data)
+    monkeypatch.setattr(module, "load_stats", no_data)
+    service = PredictionService("http://backend")
+    monkeypatch.setattr(service, "fetch_subscription_data", subscription)
+
+    result = asyncio.run(service.predict_plan_exhaustion(USER_ID))
+
+    # نفس الـ fallback بتاع المعدل الصفر: 1 kWh في اليوم
+    assert result["daily_rate_kwh"] == 1.0
+    assert result["estimated_days_remaining"] == 5.0
+    assert result["system_status"] == "Warning"
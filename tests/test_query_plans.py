@@ -0,0 +1,36 @@
+"""
+Every canonical query shape in backend/app/indexes.py must be served by an index.
+
+explain() needs a real query planner, so this runs against the MongoDB at
+settings.mongodb_url (MONGODB_URL), in a throwaway database, and is skipped when
+no server answers there.
+"""
+import asyncio
+import pytest
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import PyMongoError
+from backend.app.config import settings
+from backend.app.indexes import find_collscans, reconcile_indexes
+
+TEST_DB_NAME = f"{settings.mongodb_db_name}_query_plans_test"
+
+
+def test_canonical_queries_use_indexes():
+    async def scenario():
+        client = AsyncIOMotorClient(settings.mongodb_url, serverSelectionTimeoutMS=1000)
+        try:
+            await client.admin.command("ping")
+        except PyMongoError:
+            client.close()
+            pytest.skip(f"no MongoDB server at {settings.mongodb_url}")
+
+        try:
+            await client.drop_database(TEST_DB_NAME)
+            db = client[TEST_DB_NAME]
+            await reconcile_indexes(db)
+            assert await find_collscans(db) == []
+        finally:
+            await client.drop_database(TEST_DB_NAME)
+            client.close()
+
+    asyncio.run(scenario())
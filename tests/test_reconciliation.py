@@ -0,0 +1,129 @@
+"""
+Tests for reconcile_subscription_totals against mongomock-motor: corrections are a
+compare-and-set, skip users with readings stored but not yet deducted, and agree
+with the counter about readings timestamped before the subscription started.
+"""
+import asyncio
+from datetime import datetime, timedelta
+from mongomock_motor import AsyncMongoMockClient
+from backend.app import database
+from backend.app.indexes import reconcile_indexes
+from backend.app.services import ingest_service, leases
+from backend.app.services.ingest_service import new_reading, persist_readings
+from backend.app.services.reconciliation import reconcile_subscription_totals
+
+USER_ID = "user-1"
+
+
+async def _setup(**fields) -> dict:
+    database.mongodb.client = AsyncMongoMockClient()
+    db = database.get_database()
+    await reconcile_indexes(db)
+    now = datetime.utcnow()
+    subscription = {
+        "user_id": USER_ID,
+        "plan_id": "plan-1",
+        "start_date": now - timedelta(days=1),
+        "end_date": now + timedelta(days=29),
+        "remaining_quota": 100.0,
+        "total_quota": 100.0,
+        "consumed_since_start": 0.0,
+        "alerts_fired": [],
+        "is_active": True,
+        **fields
+    }
+    await db.plan_subscriptions.insert_one(subscription)
+    return subscription
+
+
+async def _subscription() -> dict:
+    return await database.get_database().plan_subscriptions.find_one({"user_id": USER_ID})
+
+
+def test_drift_is_set_to_the_raw_sum():
+    async def scenario():
+        await _setup()
+        await persist_readings([new_reading(USER_ID, "meter", 2.0, datetime.utcnow()) for _ in range(3)])
+        db = database.get_database()
+        await db.plan_subscriptions.update_one({"user_id": USER_ID}, {"$set": {"consumed_since_start": 4.5}})
+        fixed = await reconcile_subscription_totals()
+        return fixed, await _subscription(), await reconcile_subscription_totals()
+
+    fixed, subscription, fixed_again = asyncio.run(scenario())
+    assert fixed == 1
+    assert subscription["consumed_since_start"] == 6.0
+    assert fixed_again == 0
+
+
+def test_readings_before_start_date_are_not_counted_or_reconciled_away():
+    async def scenario():
+        subscription = await _setup()
+        start = subscription["start_date"]
+        await persist_readings([
+            new_reading(USER_ID, "meter", 1.5, start - timedelta(hours=2)),
+            new_reading(USER_ID, "meter", 2.5, start + timedelta(hours=2))
+        ])
+        counted = (await _subscription())["consumed_since_start"]
+        return counted, await reconcile_subscription_totals(), await _subscription()
+
+    counted, fixed, subscription = asyncio.run(scenario())
+    assert counted == 2.5
+    assert fixed == 0
+    # الكوتا بتتخصم بكل القراءات، الإجمالي بس اللي بيبدأ من start_date
+    assert subscription["remaining_quota"] == 96.0
+
+
+def test_reading_stored_but_not_yet_deducted_is_not_counted_twice():
+    async def scenario():
+        await _setup()
+        stored, release = asyncio.Event(), asyncio.Event()
+        deduct = ingest_service.deduct_quota_and_check_alerts
+
+        async def slow_deduct(*args, **kwargs):
+            # القراءة اتكتبت خام، والخصم لسه مجاش
+            stored.set()
+            await release.wait()
+            await deduct(*args, **kwargs)
+
+        ingest_service.deduct_quota_and_check_alerts = slow_deduct
+        try:
+            ingest = asyncio.create_task(persist_readings([new_reading(USER_ID, "meter", 3.0, datetime.utcnow())]))
+            await stored.wait()
+            fixed = await reconcile_subscription_totals()
+            release.set()
+            await ingest
+        finally:
+            ingest_service.deduct_quota_and_check_alerts = deduct
+        return fixed, await _subscription()
+
+    fixed, subscription = asyncio.run(scenario())
+    assert fixed == 0
+    assert subscription["consumed_since_start"] == 3.0
+    assert subscription["ingest_inflight"] == []
+
+
+def test_stale_inflight_tag_does_not_block_reconciliation():
+    async def scenario():
+        lost = {"batch": "lost", "at": datetime.utcnow() - timedelta(days=1)}
+        await _setup(ingest_inflight=[lost])
+        await database.get_database().consumption.insert_one(new_reading(USER_ID, "meter", 1.25, datetime.utcnow()))
+        return await reconcile_subscription_totals(), await _subscription()
+
+    fixed, subscription = asyncio.run(scenario())
+    assert fixed == 1
+    assert subscription["consumed_since_start"] == 1.25
+    assert subscription["ingest_inflight"] == []
+
+
+def test_lease_is_held_by_one_worker_at_a_time(monkeypatch):
+    async def scenario():
+        database.mongodb.client = AsyncMongoMockClient()
+        monkeypatch.setattr(leases, "HOLDER", "worker-a")
+        first = await leases.acquire_lease("job", 60)
+        monkeypatch.setattr(leases, "HOLDER", "worker-b")
+        second = await leases.acquire_lease("job", 60)
+        await database.get_database().leases.update_one({"_id": "job"}, {"$set": {"expires_at": datetime.utcnow()}})
+        third = await leases.acquire_lease("job", 60)
+        return first, second, third
+
+    assert asyncio.run(scenario()) == (True, False, True)
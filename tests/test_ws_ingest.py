@@ -0,0 +1,73 @@
+"""
+Tests for the streaming ingest WebSocket (/consumption/ws) with storage replaced:
+the announced flow-control window is enforced, and storage failures are answered
+with an error frame and logged.
+"""
+import logging
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from backend.app.api import consumption
+from backend.app.config import settings
+
+USER_ID = "user-1"
+
+
+@pytest.fixture
+def client(monkeypatch):
+    stored = []
+
+    async def principal(**kwargs):
+        return {"id": USER_ID}
+
+    async def persist(readings):
+        stored.extend(readings)
+        return {}
+
+    monkeypatch.setattr(consumption, "get_ingest_principal", principal)
+    monkeypatch.setattr(consumption, "persist_readings", persist)
+    monkeypatch.setattr(settings, "ingest_write_behind_enabled", False)
+    monkeypatch.setattr(settings, "anomaly_detection_enabled", False)
+    app = FastAPI()
+    app.include_router(consumption.router, prefix="/consumption")
+    with TestClient(app) as test_client:
+        test_client.stored = stored
+        yield test_client
+
+
+def _frame(seq: int) -> dict:
+    return {"seq": seq, "device_id": "meter-1", "consumption_value": 1.0}
+
+
+def test_frames_past_the_window_are_rejected(client, monkeypatch):
+    monkeypatch.setattr(settings, "ws_ingest_window", 2)
+    monkeypatch.setattr(settings, "ws_ingest_ack_every", 1)
+    with client.websocket_connect("/consumption/ws") as ws:
+        assert ws.receive_json() == {"type": "ready", "window": 2}
+        ws.send_json(_frame(1))
+        assert ws.receive_json() == {"type": "ack", "seq": 1}
+
+        # آخر ack كان 1، فـ 4 برا الـ window (2 و3 بس مسموحين)
+        ws.send_json(_frame(4))
+        error = ws.receive_json()
+        assert error["type"] == "error" and error["seq"] == 4 and error["accepted"] == 0
+
+        for seq in (2, 3, 4):
+            ws.send_json(_frame(seq))
+            assert ws.receive_json() == {"type": "ack", "seq": seq}
+    assert len(client.stored) == 4
+
+
+def test_storage_failure_sends_an_error_frame_and_logs(client, monkeypatch, caplog):
+    async def failing(readings):
+        raise RuntimeError("primary stepped down")
+
+    monkeypatch.setattr(consumption, "persist_readings", failing)
+    with caplog.at_level(logging.ERROR, logger=consumption.logger.name):
+        with client.websocket_connect("/consumption/ws") as ws:
+            ws.receive_json()
+            ws.send_json(_frame(1))
+            error = ws.receive_json()
+
+    assert error == {"type": "error", "seq": 1, "detail": "Failed to store readings", "accepted": 0}
+    assert any("storing frame 1" in record.getMessage() for record in caplog.records)